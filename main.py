@@ -11,7 +11,7 @@ Main Features:
 --------------
 - User Authentication:
   - Simple username/password registration and login system.
-  - Data persistence using JSON files stored in a `user_data/` directory.
+  - Data persistence in an embedded SQLite database (or legacy JSON files) under `user_data/`.
 
 - Trading Simulation:
   - Simulate buying and selling popular cryptocurrencies using real-time market data from CoinDesk.
@@ -31,7 +31,9 @@ Main Features:
 
 - Admin Settings:
   - View all registered users, including activity history and holdings.
-  - Option to reset (delete) all user data.
+  - Option to reset (delete) all user data, single accounts, or accounts inactive for N days;
+    deletion finishes in the background so the UI stays responsive.
+  - Warns about accounts that could not be read and can check and repair the store.
 
 Design Notes:
 -------------
@@ -39,16 +41,47 @@ Design Notes:
 - All image files must be available at hardcoded paths for proper icon rendering.
 - Application state is maintained in instance variables (e.g. current_username, current_balance).
 - Supports tabbed navigation via sidebar for modular views (Homepage, Buy/Sell, etc.).
+- Market data is read from an in-memory PriceCache that a background thread refreshes every
+  PRICE_TTL seconds; views never wait on CoinDesk. Tabs drawn before the first prices
+  arrive show placeholders and are redrawn by watch_prices (polled with root.after).
+  The refresher polls every PRICE_STREAM_INTERVAL seconds (PRICE_TTL unless set lower;
+  replays stream every REPLAY_STREAM_INTERVAL) and pushes changed symbols to
+  subscribers; open views rewrite just those labels in place (see bind_price).
+  Prices come from a MarketDataProvider: CoinDesk, or recorded responses replayed from a
+  file/URL (CRYPTOSIM_MARKET_REPLAY) for offline runs. The CoinDesk asset universe
+  (CRYPTOSIM_ASSETS) is fetched in parallel, rate-limited chunks merged into one
+  QuoteBook; quotes a failed chunk misses are kept from the previous one (see PartialFetch).
+  The last good response is kept in `user_data/_cache/market.json` and served (with its
+  age shown) at startup or while offline.
 
 Data Storage Format:
 --------------------
-Each user is stored in a JSON file: `user_data/{username}.json`
-Fields:
+Users are persisted through a pluggable `UserStore` (see STORAGE_BACKEND):
+- "sqlite" (default): `user_data/cryptosim.db` with indexed `users`, `holdings` and `activity`
+  tables. Legacy JSON files are imported automatically the first time the database is opened.
+- "json": one JSON snapshot per user, `user_data/ab/cd/{username}.json` (hash-sharded; legacy
+  flat files are migrated in the background or with `--migrate-sharded`), plus an append-only
+  `{username}.journal` next to it of trades/deposits/withdrawals replayed on load.
+  With CRYPTOSIM_BINARY=1 snapshots are written as compact `{username}.bin` records instead
+  (see encode_user_record); both formats are always readable.
+  Background batches are group-committed through `user_data/_commit/*.group` logs.
+  The full activity history lives in `{username}.activity/` as segmented logs with a sparse
+  offset index (see ActivityLog), so any history page is read in constant time.
+`user_data/_cache/usernames.bloom` is a Bloom filter of all usernames (see UsernameIndex); it is
+only a cache and is rebuilt from the store at every start.
+JSON snapshots carry a `_crc` checksum (binary records a CRC32 trailer) so damage is detected
+rather than silently skipped; `--check-store [--repair]` verifies every record in parallel.
+`user_backup/` holds a consistent whole-store snapshot plus a delta log of every write since
+(see StoreBackup) that damaged records are restored from; it sits next to `user_data/` so
+clearing the store leaves it alone.
+Record fields:
 - username: string
 - password: string
 - balance: float (USD)
 - holdings: dict mapping symbol → amount
-- activity: list of {desc: string, color: string}
+- activity: list of {desc: string, color: string}, newest first (the newest ACTIVITY_LIMIT items)
+- schema: record version (missing = 1); older records are upgraded by the migrations
+  registered with @record_migration the first time they are loaded
 
 Author: (Assumed)
 Date: Auto-documented July 2025
@@ -59,12 +92,3272 @@ from PIL import Image, ImageTk
 import os
 
 import requests
+from requests.adapters import HTTPAdapter
 import urllib.request
+from abc import ABC, abstractmethod
+import argparse
 import os
 import json
 import shutil
+import sqlite3
+import bisect
+import hashlib
+import math
+import mmap
+import multiprocessing
+import random
+import sys
+from array import array
+import struct
+import threading
+import time
+import zlib
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+try:
+    import numpy as np   # optional: vectorises BalanceSnapshot net worth
+except ImportError:
+    np = None
 USER_DATA_DIR = "user_data"
 os.makedirs(USER_DATA_DIR, exist_ok=True)
+# names in user_data starting with this are the app's own (caches, markers, logs), never
+# accounts: walk_user_files skips them and usernames can't start with it
+RESERVED_PREFIX = "_"
+
+# which UserStore implementation the app uses: "sqlite" (default) or "json"
+STORAGE_BACKEND = os.environ.get("CRYPTOSIM_STORAGE", "sqlite")
+USER_DB_PATH = os.path.join(USER_DATA_DIR, "cryptosim.db")
+
+# how many recent activity items are kept inline in each user record (dashboard panel)
+ACTIVITY_LIMIT = 5
+# full activity history: entries per history page, per on-disk segment, and per index stride
+ACTIVITY_PAGE_SIZE = 20
+ACTIVITY_SEGMENT_SIZE = 4096
+ACTIVITY_INDEX_STRIDE = 64
+# how many rows the Leaderboard tab shows
+LEADERBOARD_SIZE = 100
+# files the app derives from the store live here; RESERVED_PREFIX keeps them out of the JSON
+# store's view, so rewriting them doesn't count as a store write (see last_modified)
+CACHE_DIR = os.path.join(USER_DATA_DIR, "_cache")
+# columnar balances/holdings snapshot for cross-user views, rebuilt every interval seconds
+BALANCE_SNAPSHOT_PATH = os.path.join(CACHE_DIR, "balances.snap")
+BALANCE_SNAPSHOT_INTERVAL = 60
+# Bloom filter of every username, so register/login can rule out unknown names without I/O
+USERNAME_BLOOM_PATH = os.path.join(CACHE_DIR, "usernames.bloom")
+USERNAME_BLOOM_FP_RATE = 0.01
+# JsonUserStore folds a user's journal back into their JSON snapshot past this size
+JOURNAL_SNAPSHOT_BYTES = 64 * 1024
+# seconds the background writer waits for more changes before hitting the disk
+WRITE_BEHIND_WINDOW = float(os.environ.get("CRYPTOSIM_WRITE_WINDOW", "0.5"))
+# a failed background write is retried after 0.1s, doubling up to WRITE_RETRY_MAX_DELAY
+WRITE_RETRY_DELAY = 0.1
+WRITE_RETRY_MAX_DELAY = 5.0
+# consecutive failed writes after which flush() raises and close() gives up
+WRITE_RETRY_LIMIT = 5
+# JsonUserStore: make each background batch durable with one fsync of a group log
+GROUP_COMMIT = os.environ.get("CRYPTOSIM_GROUP_COMMIT", "1") == "1"
+# group logs are checkpointed (files fsynced, logs deleted) after this many batches
+GROUP_CHECKPOINT_EVERY = 64
+# JsonUserStore: spread user files over user_data/ab/cd/ hash-prefix directories
+SHARDED_LAYOUT = os.environ.get("CRYPTOSIM_SHARDED", "1") == "1"
+# threads used to scan shard directories in parallel
+WALK_WORKERS = 8
+# workers used to parse user files when many need loading at once (1 = always serial);
+# threads inside the app, separate processes only for the command-line tools
+BULK_LOAD_WORKERS = int(os.environ.get("CRYPTOSIM_LOAD_WORKERS", os.cpu_count() or 1))
+# users handed to a worker per task, and the fewest worth starting the pool for
+BULK_LOAD_CHUNK = 512
+BULK_LOAD_MIN = 2000
+# JsonUserStore: write snapshots in the compact binary format (.bin) instead of JSON
+BINARY_RECORDS = os.environ.get("CRYPTOSIM_BINARY", "0") == "1"
+# snapshot extensions JsonUserStore reads, in either format
+SNAPSHOT_EXTS = (".bin", ".json")
+# marks data renamed out of a store and waiting for BackgroundPurge to delete it
+TOMBSTONE_MARK = "_deleted-"
+# upgrade every record to SCHEMA_VERSION in the background at startup (records are
+# otherwise upgraded one by one, the first time each is loaded)
+BACKGROUND_RECORD_MIGRATION = os.environ.get("CRYPTOSIM_MIGRATE_RECORDS", "0") == "1"
+# whole-store backups (see StoreBackup): a consistent snapshot every interval seconds,
+# or sooner once the delta log since the last one passes RECOVERY_DELTA_BYTES, which
+# bounds how much a recovery has to replay. Kept next to user_data/, not in it, so
+# clearing the store doesn't take the backup along.
+BACKUP_DIR = "user_backup"
+BACKUP_INTERVAL = 15 * 60
+# the first snapshot waits this long after startup, so it doesn't compete with it
+BACKUP_STARTUP_DELAY = 5 * 60
+RECOVERY_DELTA_BYTES = 16 * 1024 * 1024
+# market data (see PriceCache): served from memory, considered fresh for PRICE_TTL seconds;
+# older data is still served while a background refresh replaces it
+PRICE_TTL = float(os.environ.get("CRYPTOSIM_PRICE_TTL", "30"))
+# seconds between the background refresher's polls; each poll pushes the symbols whose
+# quote changed to PriceCache subscribers (open views update just those labels). Every
+# live poll is an API call and a cache write, so it defaults to PRICE_TTL; set it lower
+# to stream faster (replayed data streams every REPLAY_STREAM_INTERVAL instead)
+PRICE_STREAM_INTERVAL = float(os.environ.get("CRYPTOSIM_PRICE_STREAM", PRICE_TTL))
+REPLAY_STREAM_INTERVAL = 1.0
+# how often the Tk thread applies price updates that arrived in the background
+PRICE_POLL_MS = 100
+COINDESK_METADATA_URL = "https://data-api.coindesk.com/asset/v2/metadata"
+COINDESK_ASSETS = "BTC,ETH,SOL,USDT,XRP,BNB,DOGE,ADA,SHIB,TRX,LINK,AVAX"
+# asset universe: a comma-separated symbol list, or a file with one symbol per line
+MARKET_ASSETS = os.environ.get("CRYPTOSIM_ASSETS", COINDESK_ASSETS)
+# large universes are fetched MARKET_CHUNK assets per request, MARKET_FETCH_WORKERS
+# requests at a time, and at most MARKET_RATE_LIMIT requests per second
+MARKET_CHUNK = 100
+MARKET_FETCH_WORKERS = 8
+MARKET_RATE_LIMIT = float(os.environ.get("CRYPTOSIM_MARKET_RPS", "20"))
+# Buy/Sell rows drawn at once; search narrows the rest
+MARKET_TABLE_ROWS = 200
+# serve recorded responses (an NDJSON file from --record-market, a single JSON response, or
+# an http(s) URL) instead of calling CoinDesk; see ReplayProvider
+MARKET_REPLAY = os.environ.get("CRYPTOSIM_MARKET_REPLAY")
+# replay: recorded responses advanced per second (0 = one per fetch), and added latency
+MARKET_REPLAY_RATE = float(os.environ.get("CRYPTOSIM_REPLAY_RATE", "0"))
+MARKET_REPLAY_LATENCY = float(os.environ.get("CRYPTOSIM_REPLAY_LATENCY", "0"))
+# MarketDataClient: (connect, read) timeouts per attempt, attempts per request, and the
+# total seconds a request may spend across retries; backoff is jittered from MARKET_BACKOFF
+MARKET_TIMEOUT = (3.05, 10)
+MARKET_ATTEMPTS = 4
+MARKET_RETRY_BUDGET = 20.0
+MARKET_BACKOFF = 0.5
+MARKET_POOL_SIZE = MARKET_FETCH_WORKERS
+# last good market data response, loaded at startup so views have prices before any fetch
+PRICE_CACHE_PATH = os.path.join(CACHE_DIR, "market.json")
+# default for Settings → "Reset Inactive Accounts"
+INACTIVE_RESET_DAYS = 30
+# records per write_batch when importing NDJSON, and per page when streaming users out
+IMPORT_BATCH = 1000
+EXPORT_PAGE = 1000
+
+
+def atomic_write(path, data, sync=True):
+    """
+    Writes bytes via temp file + rename, so readers never see a partial file.
+
+    With sync=False the fsync is skipped – only safe when the data is already durable
+    somewhere else (e.g. a group commit log).
+    """
+    tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(tmp, "wb") as f:
+        f.write(data)
+        if sync:
+            f.flush()
+            os.fsync(f.fileno())
+    os.replace(tmp, path)
+
+
+def fsync_paths(paths):
+    """fsyncs each existing file in paths, then their directories where the OS allows it."""
+    dirs = set()
+    for path in paths:
+        try:
+            with open(path, "ab") as f:
+                os.fsync(f.fileno())
+        except FileNotFoundError:
+            pass
+        dirs.add(os.path.dirname(path) or ".")
+    if hasattr(os, "O_DIRECTORY"):
+        for d in dirs:
+            fd = os.open(d, os.O_RDONLY | os.O_DIRECTORY)
+            try:
+                os.fsync(fd)
+            finally:
+                os.close(fd)
+
+
+class BackgroundPurge:
+    """
+    Deletes data a store has already detached, on a daemon thread.
+
+    steps is a generator function that yields the number of items to remove first, then
+    once per item removed; progress() reports (removed, total) for the UI. A purge that
+    is interrupted leaves its tombstone behind, and the store starts a new one for it
+    the next time it's opened.
+    """
+
+    def __init__(self, steps):
+        self.removed, self.total = 0, None
+        self._thread = threading.Thread(target=self._run, args=(steps,), name="purge", daemon=True)
+        self._thread.start()
+
+    def _run(self, steps):
+        it = steps()
+        self.total = next(it, 0)
+        for _ in it:
+            self.removed += 1
+
+    def progress(self):
+        return self.removed, self.total
+
+    def done(self):
+        return not self._thread.is_alive()
+
+    def join(self, timeout=None):
+        self._thread.join(timeout)
+
+
+def _remove_tree_steps(path):
+    """BackgroundPurge steps for a directory tree: one per file, then the directories."""
+    files = [os.path.join(d, fn) for d, _, names in os.walk(path) for fn in names]
+    yield len(files)
+    for fn in files:
+        try:
+            os.remove(fn)
+        except FileNotFoundError:
+            pass
+        yield
+    shutil.rmtree(path, ignore_errors=True)
+
+
+def tombstone(path, dest=None):
+    """
+    Renames path to a tombstone (by default a sibling "{path}_deleted-{ns}") – one atomic
+    rename, so it's gone for everyone else at once – and returns the BackgroundPurge
+    that deletes it.
+    """
+    dest = dest or f"{path}{TOMBSTONE_MARK}{time.time_ns()}"
+    os.replace(path, dest)
+    return BackgroundPurge(lambda: _remove_tree_steps(dest))
+
+
+def sweep_tombstones(parent, prefix=""):
+    """Restarts purges for tombstones in parent (named prefix + TOMBSTONE_MARK...) left by a crash."""
+    try:
+        names = os.listdir(parent)
+    except FileNotFoundError:
+        return []
+    return [BackgroundPurge(lambda path=os.path.join(parent, fn): _remove_tree_steps(path))
+            for fn in names if fn.startswith(prefix + TOMBSTONE_MARK)]
+
+
+def shard_dir(root, username):
+    """Returns the two-level hash-prefix directory a user's files live in, e.g. root/3f/a2."""
+    digest = hashlib.sha1(username.encode("utf-8")).hexdigest()
+    return os.path.join(root, digest[:2], digest[2:4])
+
+
+def _is_shard_name(name):
+    """True for the two-hex-digit directory names used by the sharded layout."""
+    return len(name) == 2 and all(c in "0123456789abcdef" for c in name)
+
+
+def _scan_shard(path):
+    """Lists every file under one first-level shard directory."""
+    files = []
+    with os.scandir(path) as level1:
+        for sub in level1:
+            if sub.is_dir() and _is_shard_name(sub.name):
+                with os.scandir(sub.path) as level2:
+                    files.extend(e for e in level2
+                                 if e.is_file() and not e.name.startswith(RESERVED_PREFIX))
+    return files
+
+
+def walk_user_files(root, workers=WALK_WORKERS):
+    """
+    Returns os.DirEntry objects for every file in a user_data tree.
+
+    Picks up both flat files in root and files in the ab/cd/ shard directories; the 256
+    first-level shards are scanned in parallel (scandir releases the GIL). Names starting
+    with RESERVED_PREFIX aren't user files and are left out.
+    """
+    files, shards = [], []
+    with os.scandir(root) as it:
+        for entry in it:
+            if entry.name.startswith(RESERVED_PREFIX):
+                continue
+            if entry.is_file():
+                files.append(entry)
+            elif entry.is_dir() and _is_shard_name(entry.name):
+                shards.append(entry.path)
+    if shards:
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            for shard_files in pool.map(_scan_shard, shards):
+                files.extend(shard_files)
+    return files
+
+
+# compact binary user record:
+#   header   magic "CSIM", u16 version, u64 _gseq, f64 balance
+#   strings  username, password (u16 length + utf-8)
+#   holdings u16 count, count x u8 symbol length, count x f64 amount, symbols (utf-8)
+#   activity u32 count, count x u16 desc length, count x u8 color length, descs, colors
+#   schema   u16 record schema version (format version 2+; see SCHEMA_VERSION)
+#   crc      u32 CRC32 of everything before it (format version 3+)
+# all little-endian; lengths are grouped so each section decodes with one unpack
+RECORD_MAGIC = b"CSIM"
+RECORD_VERSION = 3
+_REC_HEADER = struct.Struct("<4sHQd")
+_U8 = struct.Struct("<B")
+_U16 = struct.Struct("<H")
+_U32 = struct.Struct("<I")
+
+
+def _pack_strings(strings, length_fmt):
+    """Returns (packed lengths, joined utf-8 bytes) for a list of strings."""
+    raw = [x.encode("utf-8") for x in strings]
+    return struct.pack(f"<{len(raw)}{length_fmt}", *map(len, raw)), b"".join(raw)
+
+
+def _unpack_strings(data, pos, count, length_fmt, blob_pos):
+    """Splits count strings out of the blob at blob_pos; returns (strings, end of blob)."""
+    lengths = struct.unpack_from(f"<{count}{length_fmt}", data, pos)
+    strings = []
+    for n in lengths:
+        strings.append(data[blob_pos:blob_pos + n].decode("utf-8"))
+        blob_pos += n
+    if blob_pos > len(data):
+        raise ValueError("truncated user record")
+    return strings, blob_pos
+
+
+def encode_user_record(record):
+    """Packs a user record into the compact binary snapshot format."""
+    parts = [_REC_HEADER.pack(RECORD_MAGIC, RECORD_VERSION, record.get("_gseq", 0),
+                              float(record.get("balance", 0.0)))]
+    for key in ("username", "password"):
+        raw = str(record.get(key, "")).encode("utf-8")
+        parts += [_U16.pack(len(raw)), raw]
+
+    holdings = record.get("holdings", {})
+    sym_lengths, syms = _pack_strings(list(holdings), "B")
+    parts += [_U16.pack(len(holdings)), sym_lengths,
+              struct.pack(f"<{len(holdings)}d", *map(float, holdings.values())), syms]
+
+    activity = record.get("activity", [])
+    desc_lengths, descs = _pack_strings([a["desc"] for a in activity], "H")
+    color_lengths, colors = _pack_strings([a["color"] for a in activity], "B")
+    parts += [_U32.pack(len(activity)), desc_lengths, color_lengths, descs, colors]
+    parts.append(_U16.pack(record.get("schema", 1)))
+    data = b"".join(parts)
+    return data + _U32.pack(zlib.crc32(data))
+
+
+def decode_user_record(data, activity=True):
+    """
+    Unpacks encode_user_record output. Raises ValueError on a bad header or truncation.
+    With activity=False the activity strings are skipped (still checksummed) and the
+    record has no "activity" key.
+    """
+    data = bytes(data)
+    try:
+        magic, version, gseq, balance = _REC_HEADER.unpack_from(data, 0)
+        if magic != RECORD_MAGIC or version > RECORD_VERSION:
+            raise ValueError(f"not a v{RECORD_VERSION} user record")
+        pos = _REC_HEADER.size
+        names = []
+        for _ in range(2):
+            (n,) = _U16.unpack_from(data, pos)
+            names.append(data[pos + 2:pos + 2 + n].decode("utf-8"))
+            pos += 2 + n
+        record = {"username": names[0], "password": names[1], "balance": balance}
+
+        (count,) = _U16.unpack_from(data, pos)
+        pos += _U16.size
+        amounts = struct.unpack_from(f"<{count}d", data, pos + count)
+        symbols, pos = _unpack_strings(data, pos, count, "B", pos + 9 * count)
+        record["holdings"] = dict(zip(symbols, amounts))
+
+        (count,) = _U32.unpack_from(data, pos)
+        pos += _U32.size
+        if activity:
+            descs, pos2 = _unpack_strings(data, pos, count, "H", pos + 3 * count)
+            colors, end = _unpack_strings(data, pos + 2 * count, count, "B", pos2)
+            record["activity"] = [{"desc": d, "color": c} for d, c in zip(descs, colors)]
+        else:
+            end = (pos + 3 * count + sum(struct.unpack_from(f"<{count}H", data, pos))
+                   + sum(struct.unpack_from(f"<{count}B", data, pos + 2 * count)))
+            if end > len(data):
+                raise ValueError("truncated user record")
+        if version >= 2:
+            (schema,) = _U16.unpack_from(data, end)
+            end += _U16.size
+            if schema > 1:
+                record["schema"] = schema
+        if version >= 3:
+            (crc,) = _U32.unpack_from(data, end)
+            if crc != zlib.crc32(data[:end]):
+                raise ValueError("user record checksum mismatch")
+            end += _U32.size
+    except (struct.error, UnicodeDecodeError) as e:
+        raise ValueError(f"truncated user record: {e}")
+    if end != len(data):
+        raise ValueError("truncated user record")
+    if gseq:
+        record["_gseq"] = gseq
+    return record
+
+
+# user record schema version; records without a "schema" key are version 1. To change
+# the record shape, bump this and register the upgrade from the previous version.
+SCHEMA_VERSION = 2
+RECORD_MIGRATIONS = {}   # version -> function upgrading a record from it to version + 1
+
+
+def record_migration(version):
+    """Decorator registering the in-place upgrade of a record from `version` to `version + 1`."""
+    def register(upgrade):
+        RECORD_MIGRATIONS[version] = upgrade
+        return upgrade
+    return register
+
+
+@record_migration(1)
+def _normalise_record(record):
+    """v2: every field present, balance and holdings as floats, activity items complete."""
+    record.setdefault("password", "")
+    record["balance"] = float(record.get("balance") or 0.0)
+    record["holdings"] = {sym: float(amt) for sym, amt in (record.get("holdings") or {}).items()}
+    record["activity"] = [{"desc": str(item.get("desc", "")), "color": item.get("color", "black")}
+                          for item in record.get("activity") or [] if isinstance(item, dict)]
+
+
+def upgrade_record(record):
+    """
+    Runs the registered migrations on a record, in place, up to SCHEMA_VERSION.
+    Returns True if it was upgraded (so the caller can write it back).
+    """
+    version = record.get("schema", 1)
+    if version >= SCHEMA_VERSION:
+        return False
+    while version < SCHEMA_VERSION:
+        RECORD_MIGRATIONS[version](record)
+        version += 1
+    record["schema"] = version
+    return True
+
+
+def copy_record(record):
+    """
+    Returns a copy of a record that can be changed freely: holdings and activity are
+    copied too, so caches that hand out records never share their inner containers.
+    """
+    copy = dict(record)
+    if "holdings" in copy:
+        copy["holdings"] = dict(copy["holdings"])
+    if "activity" in copy:
+        copy["activity"] = [dict(item) for item in copy["activity"]]
+    return copy
+
+
+def apply_event(record, event):
+    """
+    Applies one account event to a user record in place.
+
+    Events are small dicts:
+      {"type": "deposit"|"withdraw"|"trade", "cash": usd delta,
+       "symbol": sym, "qty": coin delta, "desc": str, "color": str}
+      {"type": "remove_holding", "symbol": sym}
+    Only the keys an event needs are present.
+    """
+    holdings = record.setdefault("holdings", {})
+    if event["type"] == "remove_holding":
+        holdings.pop(event["symbol"], None)
+    else:
+        record["balance"] = record.get("balance", 0.0) + event.get("cash", 0.0)
+        if "symbol" in event:
+            sym = event["symbol"]
+            holdings[sym] = holdings.get(sym, 0) + event["qty"]
+    if "desc" in event:
+        activity = record.setdefault("activity", [])
+        activity.insert(0, {"desc": event["desc"], "color": event["color"]})
+        del activity[ACTIVITY_LIMIT:]
+    return record
+
+
+def encode_frame(obj):
+    """Encodes obj as a length-prefixed, CRC-checked JSON frame (see UserJournal)."""
+    payload = json.dumps(obj, separators=(",", ":")).encode("utf-8")
+    return UserJournal.FRAME.pack(len(payload), zlib.crc32(payload)) + payload
+
+
+def read_frame(f):
+    """Reads one frame from a binary file; returns None at EOF or on a torn/corrupt frame."""
+    header = f.read(UserJournal.FRAME.size)
+    if len(header) < UserJournal.FRAME.size:
+        return None
+    length, crc = UserJournal.FRAME.unpack(header)
+    payload = f.read(length)
+    if len(payload) < length or zlib.crc32(payload) != crc:
+        return None
+    return json.loads(payload)
+
+
+class UserJournal:
+    """
+    Append-only event log for one user.
+
+    Each entry is a length-prefixed frame: 4-byte big-endian payload length, 4-byte CRC32,
+    then the JSON-encoded event. A frame cut short by a crash fails the length or CRC check
+    and is dropped (and trimmed off the file) on replay.
+    """
+
+    FRAME = struct.Struct(">II")
+
+    def __init__(self, path):
+        self.path = path
+
+    def append(self, event):
+        """Appends one event – O(1) regardless of how long the history is."""
+        self.extend([event])
+
+    def extend(self, events, sync=False):
+        """Appends several events with a single open/write (and a single fsync if sync)."""
+        with open(self.path, "ab") as f:
+            f.write(b"".join(encode_frame(event) for event in events))
+            if sync:
+                f.flush()
+                os.fsync(f.fileno())
+
+    def replay(self, repair=True):
+        """Returns every intact event in order, truncating any torn tail if repair."""
+        events, intact, total = self.scan()
+        if repair and intact < total:
+            with open(self.path, "r+b") as f:
+                f.truncate(intact)
+        return events
+
+    def scan(self):
+        """Returns (intact events, bytes they span, file size) without changing the file."""
+        try:
+            with open(self.path, "rb") as f:
+                buf = f.read()
+        except FileNotFoundError:
+            return [], 0, 0
+        events, pos = [], 0
+        while pos + self.FRAME.size <= len(buf):
+            length, crc = self.FRAME.unpack_from(buf, pos)
+            payload = buf[pos + self.FRAME.size:pos + self.FRAME.size + length]
+            if len(payload) < length or zlib.crc32(payload) != crc:
+                break
+            events.append(json.loads(payload))
+            pos += self.FRAME.size + length
+        return events, pos, len(buf)
+
+    def size(self):
+        """Current journal size in bytes (0 if it doesn't exist)."""
+        try:
+            return os.path.getsize(self.path)
+        except OSError:
+            return 0
+
+    def reset(self):
+        """Drops all events (called once they're folded into a snapshot)."""
+        try:
+            os.remove(self.path)
+        except FileNotFoundError:
+            pass
+
+
+class ActivityLog:
+    """
+    A user's complete activity history, oldest first, stored in a directory.
+
+    Entries are framed like UserJournal and split into segments of ACTIVITY_SEGMENT_SIZE
+    entries (seg-00000000.log, seg-00000001.log, ...). Each segment has a sparse index
+    (seg-00000000.idx): the byte offset of every ACTIVITY_INDEX_STRIDE-th entry as a u64.
+    Reading any page is an index lookup, a seek and at most one stride of skipped frames,
+    however long the history is.
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        self._count = None
+
+    def _segment(self, n, ext):
+        """Path of segment n's log (".log") or index (".idx")."""
+        return os.path.join(self.directory, f"seg-{n:08d}{ext}")
+
+    def _read_index(self, n):
+        """Returns segment n's offsets (a small, fixed-size file)."""
+        try:
+            with open(self._segment(n, ".idx"), "rb") as f:
+                return array("Q", f.read())
+        except FileNotFoundError:
+            return array("Q")
+
+    def count(self):
+        """Total number of entries (cached after the first call)."""
+        if self._count is None:
+            self._count = self._recount()
+        return self._count
+
+    def _recount(self):
+        """Counts entries from the last segment's index, repairing a crash-torn tail."""
+        try:
+            segments = sorted(fn for fn in os.listdir(self.directory) if fn.endswith(".log"))
+        except FileNotFoundError:
+            return 0
+        if not segments:
+            return 0
+        last = int(segments[-1][4:12])
+        index = self._read_index(last)
+        n = max(len(index) - 1, 0) * ACTIVITY_INDEX_STRIDE
+        with open(self._segment(last, ".log"), "r+b") as f:
+            f.seek(index[n // ACTIVITY_INDEX_STRIDE] if index else 0)
+            good = f.tell()
+            missing = []
+            while True:
+                if n % ACTIVITY_INDEX_STRIDE == 0 and n // ACTIVITY_INDEX_STRIDE >= len(index):
+                    missing.append(good)
+                if read_frame(f) is None:
+                    if missing and missing[-1] == good:
+                        missing.pop()
+                    break
+                good = f.tell()
+                n += 1
+            f.truncate(good)
+        if missing:
+            # the index append was lost while the entry made it to disk
+            with open(self._segment(last, ".idx"), "ab") as f:
+                f.write(array("Q", missing).tobytes())
+        return last * ACTIVITY_SEGMENT_SIZE + n
+
+    def extend(self, entries):
+        """Appends entries (dicts) at the newest end of the history."""
+        count = self.count()
+        os.makedirs(self.directory, exist_ok=True)
+        i = 0
+        while i < len(entries):
+            seg, k = divmod(count, ACTIVITY_SEGMENT_SIZE)
+            chunk = entries[i:i + ACTIVITY_SEGMENT_SIZE - k]
+            offsets = array("Q")
+            with open(self._segment(seg, ".log"), "ab") as f:
+                f.seek(0, os.SEEK_END)
+                pos = f.tell()
+                frames = []
+                for j, entry in enumerate(chunk):
+                    frame = encode_frame(entry)
+                    if (k + j) % ACTIVITY_INDEX_STRIDE == 0:
+                        offsets.append(pos)
+                    frames.append(frame)
+                    pos += len(frame)
+                f.write(b"".join(frames))
+            # data first, then index: _recount() rebuilds index entries lost in between
+            if offsets:
+                with open(self._segment(seg, ".idx"), "ab") as f:
+                    f.write(offsets.tobytes())
+            count += len(chunk)
+            i += len(chunk)
+        self._count = count
+
+    def read(self, start, end):
+        """Returns entries [start, end) in oldest-first order."""
+        start, end = max(start, 0), min(end, self.count())
+        entries = []
+        while start < end:
+            seg, k = divmod(start, ACTIVITY_SEGMENT_SIZE)
+            index = self._read_index(seg)
+            stop = min(end, (seg + 1) * ACTIVITY_SEGMENT_SIZE)
+            with open(self._segment(seg, ".log"), "rb") as f:
+                f.seek(index[k // ACTIVITY_INDEX_STRIDE])
+                for _ in range(k % ACTIVITY_INDEX_STRIDE):
+                    read_frame(f)
+                for _ in range(stop - start):
+                    entry = read_frame(f)
+                    if entry is None:
+                        return entries
+                    entries.append(entry)
+            start = stop
+        return entries
+
+    def page(self, page, size=ACTIVITY_PAGE_SIZE):
+        """Returns page `page` (0 = newest) of the history, newest first."""
+        end = self.count() - page * size
+        if end <= 0:
+            return []
+        return self.read(max(0, end - size), end)[::-1]
+
+
+def record_checksum(record):
+    """CRC32 of a record's canonical JSON, ignoring its own "_crc" field."""
+    body = {k: v for k, v in record.items() if k != "_crc"}
+    return zlib.crc32(json.dumps(body, sort_keys=True, separators=(",", ":")).encode("utf-8"))
+
+
+def parse_user_snapshot(data, activity=True):
+    """
+    Parses snapshot bytes of either format. Raises ValueError if corrupted.
+    activity=False leaves out the "activity" list (binary snapshots skip decoding it).
+    """
+    if data[:len(RECORD_MAGIC)] == RECORD_MAGIC:
+        return decode_user_record(data, activity)
+    record = json.loads(data)
+    if not isinstance(record, dict) or "username" not in record:
+        raise ValueError("not a user record")
+    # files written before checksums existed have no "_crc" and are taken as they are
+    if "_crc" in record and record.pop("_crc") != record_checksum(record):
+        raise ValueError("user record checksum mismatch")
+    if not activity:
+        record.pop("activity", None)
+    return record
+
+
+def read_user_snapshot(path, activity=True):
+    """Parses a snapshot file of either format, returning None if missing or corrupted."""
+    if path is None:
+        return None
+    try:
+        with open(path, "rb") as f:
+            return parse_user_snapshot(f.read(), activity)
+    except (ValueError, IOError):
+        # file is missing, empty, or corrupted
+        return None
+
+
+def fold_events(record, events, activity=True):
+    """
+    Rolls a snapshot forward with a user's journaled events.
+
+    Group-committed snapshots carry the "_gseq" of the last batch folded into them,
+    and journal events from that batch or earlier are skipped, so replay is idempotent.
+    activity=False applies only the balance and holdings changes.
+    """
+    folded = record.get("_gseq", 0)
+    for event in events:
+        gseq = event.get("gseq", 0)
+        if gseq and gseq <= folded:
+            continue
+        if not activity and "desc" in event:
+            event = {k: v for k, v in event.items() if k not in ("desc", "color")}
+        apply_event(record, event)
+        if gseq:
+            record["_gseq"] = gseq
+    return record
+
+
+def _load_user_chunk(jobs):
+    """Worker for bulk_load_users: [(username, snapshot, journal)] -> [(username, record)]."""
+    loaded = []
+    for username, snapshot, journal in jobs:
+        record = read_user_snapshot(snapshot)
+        if record is not None and journal is not None:
+            # another process may be appending, so leave a torn tail for the owner to repair
+            fold_events(record, UserJournal(journal).replay(repair=False))
+        if record is not None:
+            upgrade_record(record)    # written back when the user is next loaded directly
+        loaded.append((username, record))
+    return loaded
+
+
+def bulk_load_users(jobs, workers=BULK_LOAD_WORKERS, chunk_size=BULK_LOAD_CHUNK,
+                    processes=False):
+    """
+    Parses many users' files in a worker pool, yielding (username, record) in job order.
+
+    jobs is a list of (username, snapshot path, journal path or None). It is split into
+    chunk_size pieces that workers parse in parallel; results stream back as each chunk
+    finishes, in order. record is None for unreadable snapshots. See _map_chunks for
+    threads vs processes.
+    """
+    return _map_chunks(_load_user_chunk, jobs, workers, chunk_size, processes)
+
+
+def user_file_jobs(root):
+    """
+    bulk_load_users jobs for every user under a JsonUserStore root:
+    [(username, snapshot path or None, journal path or None)].
+    """
+    files = {}
+    for entry in walk_user_files(root):
+        if entry.name.endswith(SNAPSHOT_EXTS):
+            files.setdefault(os.path.splitext(entry.name)[0], [None, None])[0] = entry.path
+        elif entry.name.endswith(".journal"):
+            files.setdefault(entry.name[:-8], [None, None])[1] = entry.path
+    return [(user, snap, journal) for user, (snap, journal) in files.items()]
+
+
+def read_user_files(root, workers=BULK_LOAD_WORKERS):
+    """
+    Yields every readable record under a JsonUserStore root without writing anything:
+    journals are folded in but not repaired, and records are upgraded in memory only.
+    For one-off reads such as importing a legacy tree into another store.
+    """
+    if not os.path.isdir(root):
+        return
+    jobs = [job for job in user_file_jobs(root) if job[1] is not None]
+    for _, record in bulk_load_users(jobs, workers):
+        if record is not None:
+            yield record
+
+
+def _process_context():
+    """forkserver where the platform has it, else spawn - never a plain fork."""
+    methods = multiprocessing.get_all_start_methods()
+    return multiprocessing.get_context("forkserver" if "forkserver" in methods else "spawn")
+
+
+def _map_chunks(worker, jobs, workers, chunk_size, processes=False):
+    """
+    Runs worker(chunk) over jobs in a pool, yielding its results in job order.
+
+    The pool is threads unless processes is set; the file reads dominate, so threads
+    overlap most of the work. processes is only for the command-line tools: forking the
+    running app while its refresher and writer threads hold locks can deadlock the
+    children, so even then workers start from a forkserver (or spawn), not a fork.
+    """
+    chunks = [jobs[i:i + chunk_size] for i in range(0, len(jobs), chunk_size)]
+    if workers <= 1 or len(chunks) <= 1:
+        for chunk in chunks:
+            yield from worker(chunk)
+        return
+    workers = min(workers, len(chunks))
+    if processes:
+        pool = ProcessPoolExecutor(max_workers=workers, mp_context=_process_context())
+    else:
+        pool = ThreadPoolExecutor(max_workers=workers)
+    with pool:
+        for results in pool.map(worker, chunks):
+            yield from results
+
+
+def _check_user_chunk(jobs):
+    """Worker for JsonUserStore.check_integrity: [(username, snapshot, journal)] -> problems."""
+    problems = []
+    for username, snapshot, journal in jobs:
+        if snapshot is None:
+            problems.append((username, "orphan", "journal without a snapshot"))
+        else:
+            try:
+                with open(snapshot, "rb") as f:
+                    parse_user_snapshot(f.read())
+            except (ValueError, IOError) as e:
+                problems.append((username, "snapshot", str(e) or type(e).__name__))
+        if journal is not None:
+            _, intact, total = UserJournal(journal).scan()
+            if intact < total:
+                problems.append((username, "journal", f"torn tail of {total - intact} bytes"))
+    return problems
+
+
+class UserRegistry:
+    """
+    In-memory cache of parsed user records, used by JsonUserStore.load_all.
+
+    Each user is parsed once. Later refreshes only stat() every snapshot and journal and
+    re-read users whose (inode, size, mtime) changed, so repeated Leaderboard/Settings
+    views cost a directory scan instead of parsing every file again. When at least
+    BULK_LOAD_MIN users need parsing (a cold start), they're parsed by bulk_load_users.
+    """
+
+    def __init__(self):
+        self._entries = {}    # username -> (stamp, record)
+        self._lock = threading.Lock()
+        self.unreadable = []  # users whose snapshot failed to parse on the last refresh
+
+    def refresh(self, store):
+        """Brings the cache in line with what's on disk under store.root."""
+        with self._lock:
+            stamps = {}
+            for entry in walk_user_files(store.root):
+                if entry.name.endswith(SNAPSHOT_EXTS):
+                    user, slot = os.path.splitext(entry.name)[0], 0
+                elif entry.name.endswith(".journal"):
+                    user, slot = entry.name[:-8], 1
+                else:
+                    continue
+                try:
+                    st = entry.stat()
+                except FileNotFoundError:
+                    continue
+                stamp = (entry.path, st.st_ino, st.st_size, st.st_mtime_ns)
+                stamps.setdefault(user, [None, None])[slot] = stamp
+
+            fresh, stale = {}, []
+            for user, stamp in stamps.items():
+                if stamp[0] is None:
+                    continue    # journal without a snapshot isn't a user
+                stamp = tuple(stamp)
+                cached = self._entries.get(user)
+                if cached is not None and cached[0] == stamp:
+                    fresh[user] = cached
+                else:
+                    stale.append((user, stamp))
+
+            workers = getattr(store, "load_workers", 1)
+            if workers > 1 and len(stale) >= BULK_LOAD_MIN:
+                jobs = [(user, snap[0], journal and journal[0]) for user, (snap, journal) in stale]
+                loaded = bulk_load_users(jobs, workers)
+            else:
+                loaded = ((user, store.load(user)) for user, _ in stale)
+            unreadable = []
+            for (user, stamp), (_, record) in zip(stale, loaded):
+                if record is not None:
+                    fresh[user] = (stamp, record)
+                else:
+                    unreadable.append(user)
+            self._entries = fresh
+            self.unreadable = unreadable
+        return self
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __iter__(self):
+        return iter(self._entries)
+
+    def items(self):
+        """
+        Iterates (username, record) pairs without touching the disk. Records are copies,
+        so callers can't change the cache behind the store's back.
+        """
+        return ((user, copy_record(entry[1])) for user, entry in self._entries.items())
+
+    def clear(self):
+        """Forgets every cached record."""
+        with self._lock:
+            self._entries = {}
+            self.unreadable = []
+
+
+class UserStore(ABC):
+    """
+    Storage backend for user records.
+
+    A record is a plain dict in the same shape as the legacy JSON files:
+    {username, password, balance, holdings: {symbol: amount}, activity: [{desc, color}],
+    schema}. Subclasses implement the actual persistence; the app only talks to this
+    interface. load() returns records at SCHEMA_VERSION: an older record is upgraded
+    (see upgrade_record) and written back the first time it's read.
+    """
+
+    @abstractmethod
+    def exists(self, username):
+        """Returns True if an account with this username is stored."""
+
+    @abstractmethod
+    def load(self, username):
+        """Returns the record for username, or None if missing/unreadable."""
+
+    @abstractmethod
+    def save(self, record):
+        """Creates or replaces the record for record["username"]."""
+
+    def append_event(self, username, event):
+        """Records one account event (see apply_event). Default: read-modify-write."""
+        self.append_events(username, [event])
+
+    def append_events(self, username, events):
+        """
+        Records several events for one user, in order; events for a user that isn't
+        stored (deleted meanwhile) are dropped. Default: read-modify-write.
+        """
+        record = self.load(username)
+        if record is not None:
+            for event in events:
+                apply_event(record, event)
+            self.save(record)
+
+    def write_batch(self, batch):
+        """Writes a coalesced batch { username: (record or None, [events]) }."""
+        for username, (record, events) in batch.items():
+            if record is not None:
+                self.save(record)
+            if events:
+                self.append_events(username, events)
+
+    @abstractmethod
+    def load_all(self):
+        """Returns a dict { username: record } for every stored user."""
+
+    def load_portfolios(self):
+        """Returns { username: (balance, holdings) } – just what the leaderboard needs."""
+        return {
+            user: (data.get("balance", 0.0), data.get("holdings", {}))
+            for user, data in self.load_all().items()
+        }
+
+    def usernames(self):
+        """Returns every stored username (no records are parsed where the backend allows)."""
+        return list(self.load_all())
+
+    def iter_users(self, after=None):
+        """
+        Yields every record in username order, starting after `after`, one at a time so
+        memory stays flat however many users there are.
+        """
+        for username in sorted(self.usernames()):
+            if after is None or username > after:
+                record = self.load(username)
+                if record is not None:
+                    yield record
+
+    def load_account(self, username):
+        """Returns the record without its "activity" list (login only needs balance and holdings)."""
+        record = self.load(username)
+        if record is not None:
+            record.pop("activity", None)
+        return record
+
+    def activity_count(self, username):
+        """Number of entries in a user's full activity history."""
+        record = self.load(username)
+        return len(record.get("activity", [])) if record else 0
+
+    def activity_page(self, username, page, size=ACTIVITY_PAGE_SIZE):
+        """Page `page` (0 = newest) of a user's activity history as [{desc, color}], newest first."""
+        record = self.load(username)
+        return record.get("activity", [])[page * size:(page + 1) * size] if record else []
+
+    @abstractmethod
+    def inactive_users(self, days):
+        """Returns the usernames with no writes in the last `days` days."""
+
+    def last_modified(self):
+        """
+        time.time() of the latest write or delete, or None if the backend can't tell
+        (callers then treat anything derived from the store as out of date).
+        """
+        return None
+
+    def unreadable_users(self):
+        """Accounts the last load_all found on disk but couldn't read."""
+        return []
+
+    def check_integrity(self, workers=BULK_LOAD_WORKERS, processes=False):
+        """
+        Verifies every stored record; returns [(username or None, kind, detail)].
+        processes picks worker processes over threads (command line only, see _map_chunks).
+        """
+        return []
+
+    def repair(self, problems, backup=None):
+        """
+        Fixes what check_integrity found, restoring records from a StoreBackup where it
+        has them. Returns [(username or None, action taken)].
+        """
+        return []
+
+    @abstractmethod
+    def delete_users(self, usernames):
+        """
+        Deletes the given accounts. They disappear at once; returns a BackgroundPurge
+        still removing their data, or None if nothing is left to do.
+        """
+
+    @abstractmethod
+    def clear(self):
+        """Deletes every stored user, returning a BackgroundPurge like delete_users."""
+
+    def close(self):
+        """Releases any open handles."""
+        pass
+
+
+class JsonUserStore(UserStore):
+    """
+    Legacy layout: one pretty-printed JSON snapshot per user in user_data/.
+
+    Trades, deposits and withdrawals don't rewrite the snapshot; they're appended to
+    user_data/{username}.journal and replayed on load. Once a journal grows past
+    JOURNAL_SNAPSHOT_BYTES it is folded back into the snapshot.
+
+    With group_commit, write_batch makes a whole batch durable with one fsync: every
+    user's change goes into user_data/_commit/{seq}.group followed by a commit marker,
+    and only then are snapshots renamed into place and journals appended (unsynced).
+    Committed group logs still on disk at startup are rolled forward, and a checkpoint
+    fsyncs the touched files and drops the logs every GROUP_CHECKPOINT_EVERY batches.
+
+    With sharded, files live in user_data/ab/cd/ (first bytes of sha1(username)) so no
+    directory grows past a few entries per thousand users. Users still in the flat layout
+    are found there until migrate_to_sharded() moves them, which can run while the store
+    is in use.
+
+    With binary, snapshots are written as {username}.bin (see encode_user_record) instead
+    of JSON. Either format is read, so a store can hold both while users are re-saved.
+
+    load_workers is the thread count load_all uses to parse users on a cold start.
+
+    The snapshot only keeps the newest ACTIVITY_LIMIT activity items; the full history is
+    an ActivityLog in {username}.activity/ next to it. Users from before the log existed
+    have it seeded from their snapshot the first time it's needed.
+    """
+
+    LAYOUT_MARKER = "_layout"
+    # touched by every delete and clear(): a removed file leaves nothing to stat
+    DELETE_MARKER = "_last_delete"
+    USER_EXTS = SNAPSHOT_EXTS + (".journal", ".activity")
+
+    def __init__(self, root=USER_DATA_DIR, group_commit=GROUP_COMMIT, sharded=SHARDED_LAYOUT,
+                 binary=BINARY_RECORDS, load_workers=BULK_LOAD_WORKERS):
+        self.root = root
+        self.group_commit = group_commit
+        self.sharded = sharded
+        self.load_workers = load_workers
+        self.ext = ".bin" if binary else ".json"
+        self.commit_dir = os.path.join(self.root, "_commit")
+        self._gseq = 0
+        self._modified_at = 0.0   # time.time() of our latest write (see last_modified)
+        self._unsynced = set()    # files written since the last checkpoint
+        self._groups = []         # group logs written since the last checkpoint
+        self._lock = threading.RLock()
+        self._made_dirs = set()
+        self._activity_logs = {}  # log directory -> ActivityLog (caches its entry count)
+        self.registry = UserRegistry()
+        os.makedirs(self.root, exist_ok=True)
+        # once every flat file has been migrated there's no need to look for them
+        self.flat_migrated = os.path.exists(os.path.join(self.root, self.LAYOUT_MARKER))
+        if sharded and not self.flat_migrated and not any(
+                fn.endswith(SNAPSHOT_EXTS) for fn in os.listdir(self.root)):
+            self._mark_migrated()
+        if not os.path.exists(os.path.join(self.root, self.DELETE_MARKER)):
+            # a store from before the marker may have had deletes nothing records
+            self._mark_deleted()
+        self._recover()
+        # finish deletions a previous run didn't get to (see clear and delete_users)
+        sweep_tombstones(os.path.dirname(os.path.abspath(self.root)), os.path.basename(self.root))
+        sweep_tombstones(self.root)
+
+    def _base(self, username):
+        """Path of a user's files without extension, in whichever layout they're in."""
+        flat = os.path.join(self.root, username)
+        if not self.sharded:
+            return flat
+        sharded = os.path.join(shard_dir(self.root, username), username)
+        if self.flat_migrated or self._snapshot_at(sharded):
+            return sharded
+        return flat if self._snapshot_at(flat) else sharded
+
+    def _snapshot_at(self, base):
+        """Returns the existing snapshot file for base (preferring our format), or None."""
+        for ext in (self.ext,) + SNAPSHOT_EXTS:
+            if os.path.exists(base + ext):
+                return base + ext
+        return None
+
+    def path(self, username):
+        """Constructs the path new snapshots for a given user are written to."""
+        return self._base(username) + self.ext
+
+    def _encode(self, record):
+        """Serialises a snapshot in this store's format."""
+        if self.ext == ".bin":
+            return encode_user_record(record)
+        return json.dumps(dict(record, _crc=record_checksum(record)), indent=2).encode("utf-8")
+
+    def _write_snapshot(self, username, record, sync=True):
+        """Writes a snapshot atomically and removes any copy left in the other format."""
+        base = self._base(username)
+        path = base + self.ext
+        self._ensure_dir(path)
+        if len(record.get("activity", ())) > ACTIVITY_LIMIT:
+            # imported records carry their whole history; that belongs in the ActivityLog
+            record = dict(record, activity=record["activity"][:ACTIVITY_LIMIT])
+        atomic_write(path, self._encode(record), sync)
+        for ext in SNAPSHOT_EXTS:
+            if ext != self.ext and os.path.exists(base + ext):
+                os.remove(base + ext)
+        return path
+
+    def journal(self, username):
+        """Returns the UserJournal that sits next to a user's snapshot."""
+        return UserJournal(self._base(username) + ".journal")
+
+    def activity_log(self, username):
+        """Returns the ActivityLog that sits next to a user's snapshot."""
+        directory = self._base(username) + ".activity"
+        log = self._activity_logs.get(directory)
+        if log is None:
+            log = self._activity_logs[directory] = ActivityLog(directory)
+        return log
+
+    def _seeded_log(self, username, record=None):
+        """Returns the user's ActivityLog, seeding it from the snapshot if it's still empty."""
+        log = self.activity_log(username)
+        if log.count() == 0:
+            record = record if record is not None else self.load(username)
+            if record and record.get("activity"):
+                log.extend(record["activity"][::-1])
+        return log
+
+    def _log_activity(self, username, events):
+        """Adds the activity of events (those with a "desc") to the user's history."""
+        entries = [{"desc": e["desc"], "color": e["color"], "gseq": e["gseq"]} if "gseq" in e
+                   else {"desc": e["desc"], "color": e["color"]}
+                   for e in events if "desc" in e]
+        if entries:
+            self._seeded_log(username).extend(entries)
+
+    def activity_count(self, username):
+        with self._lock:
+            return self._seeded_log(username).count()
+
+    def activity_page(self, username, page, size=ACTIVITY_PAGE_SIZE):
+        with self._lock:
+            return [{"desc": e["desc"], "color": e["color"]}
+                    for e in self._seeded_log(username).page(page, size)]
+
+    def _ensure_dir(self, path):
+        """Creates the directory for path once per process."""
+        d = os.path.dirname(path)
+        if d not in self._made_dirs:
+            os.makedirs(d, exist_ok=True)
+            self._made_dirs.add(d)
+
+    def exists(self, username):
+        return self._snapshot_at(self._base(username)) is not None
+
+    def needs_migration(self):
+        """True if this is a sharded store that may still have flat-layout users."""
+        return self.sharded and not self.flat_migrated
+
+    def migrate_to_sharded(self, progress=None):
+        """
+        Moves every flat-layout user into the sharded layout.
+
+        Each user is moved under the store lock, so concurrent loads and writes always
+        see the user in exactly one place. progress(done, total) is called after each user.
+        """
+        names = sorted({os.path.splitext(fn)[0] for fn in os.listdir(self.root)
+                        if fn.endswith(SNAPSHOT_EXTS)})
+        for done, user in enumerate(names, start=1):
+            with self._lock:
+                flat = os.path.join(self.root, user)
+                sharded = os.path.join(shard_dir(self.root, user), user)
+                stale = self._snapshot_at(sharded) is not None
+                self._ensure_dir(sharded)
+                # journal and history first: the snapshot decides which layout the user is in
+                for ext in (".journal", ".activity") + SNAPSHOT_EXTS:
+                    if not os.path.exists(flat + ext):
+                        continue
+                    if stale:
+                        # already written in the new layout; the flat copy is stale
+                        if os.path.isdir(flat + ext):
+                            shutil.rmtree(flat + ext)
+                        else:
+                            os.remove(flat + ext)
+                    else:
+                        os.replace(flat + ext, sharded + ext)
+                self._activity_logs.pop(flat + ".activity", None)
+            if progress:
+                progress(done, len(names))
+        with self._lock:
+            self._mark_migrated()
+
+    def _mark_deleted(self):
+        """Stamps the delete marker's mtime with the current time."""
+        path = os.path.join(self.root, self.DELETE_MARKER)
+        with open(path, "a"):
+            pass
+        os.utime(path)
+
+    def _mark_migrated(self):
+        """Records that no flat-layout users are left."""
+        atomic_write(os.path.join(self.root, self.LAYOUT_MARKER), b"sharded-v1\n")
+        self.flat_migrated = True
+
+    def _load_snapshot(self, username):
+        """Reads a user's snapshot in whichever format it was saved."""
+        return read_user_snapshot(self._snapshot_at(self._base(username)))
+
+    def _replay(self, username, record):
+        """Rolls a snapshot forward with the user's journaled events (see fold_events)."""
+        return fold_events(record, self.journal(username).replay())
+
+    def load(self, username):
+        with self._lock:
+            record = self._load_snapshot(username)
+            if record is None:
+                return None
+            record = self._replay(username, record)
+            if upgrade_record(record):
+                self.save(record)
+            return record
+
+    def load_account(self, username):
+        with self._lock:
+            record = read_user_snapshot(self._snapshot_at(self._base(username)), activity=False)
+            if record is None:
+                return None
+            if record.get("schema", 1) < SCHEMA_VERSION:
+                # upgrading needs the whole record; load() writes it back
+                return super().load_account(username)
+            # history is read page by page through the ActivityLog (activity_page)
+            return fold_events(record, self.journal(username).replay(), activity=False)
+
+    def save(self, record, sync=True):
+        with self._lock:
+            self._modified_at = time.time()
+            # history is append-only: a saved record's activity only seeds an empty log
+            self._seeded_log(record["username"], record)
+            self._write_snapshot(record["username"], record, sync)
+            # the snapshot now contains everything the journal did
+            self.journal(record["username"]).reset()
+
+    def write_batch(self, batch):
+        with self._lock:
+            self._modified_at = time.time()
+            if not self.group_commit:
+                return super().write_batch(batch)
+            self._group_commit(batch)
+
+    def _group_commit(self, batch):
+        """Writes a batch behind one fsynced group log (see class docstring)."""
+        gseq = self._next_gseq()
+        entries = [
+            {"username": username,
+             # a batch's events happened after its record, so the record folds in only
+             # the batches before this one
+             "record": None if record is None else dict(record, _gseq=gseq - 1),
+             "events": [dict(e, gseq=gseq) for e in events]}
+            for username, (record, events) in batch.items()
+        ]
+        os.makedirs(self.commit_dir, exist_ok=True)
+        log = UserJournal(os.path.join(self.commit_dir, f"{gseq:020d}.group"))
+        # the single fsync: once the commit marker is on disk the batch is durable
+        log.extend(entries + [{"commit": len(entries)}], sync=True)
+        self._groups.append(log.path)
+        for entry in entries:
+            user = entry["username"]
+            if entry["record"] is not None:
+                self.save(entry["record"], sync=False)
+                self._unsynced.add(self.path(user))
+            if entry["events"] and self.exists(user):
+                self.append_events(user, entry["events"])
+                self._unsynced.add(self.journal(user).path)
+        if len(self._groups) >= GROUP_CHECKPOINT_EVERY:
+            self.checkpoint()
+
+    def _next_gseq(self):
+        """Group sequence numbers are time-based so they keep increasing across restarts."""
+        self._gseq = max(self._gseq + 1, time.time_ns())
+        return self._gseq
+
+    def checkpoint(self):
+        """Makes every group-committed write durable in place, then drops the group logs."""
+        if not self._groups:
+            return
+        fsync_paths(self._unsynced)
+        for path in self._groups:
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+        self._unsynced.clear()
+        self._groups.clear()
+
+    def _recover(self):
+        """Rolls committed group logs forward after a crash and removes stray temp files."""
+        for entry in walk_user_files(self.root):
+            if entry.name.endswith(".tmp"):
+                os.remove(entry.path)
+        if not os.path.isdir(self.commit_dir):
+            return
+        for fn in sorted(os.listdir(self.commit_dir)):
+            path = os.path.join(self.commit_dir, fn)
+            frames = UserJournal(path).replay()
+            if not frames or "commit" not in frames[-1]:
+                # crashed before the commit marker: the batch was never acknowledged
+                os.remove(path)
+                continue
+            gseq = int(fn.split(".")[0])
+            self._gseq = max(self._gseq, gseq)
+            for entry in frames[:-1]:
+                self._roll_forward(gseq, entry)
+            self._groups.append(path)
+        self.checkpoint()
+
+    def _roll_forward(self, gseq, entry):
+        """Re-applies one committed group entry unless it already reached the disk."""
+        user = entry["username"]
+        record = entry["record"]
+        snapshot = self._load_snapshot(user)
+        folded = snapshot.get("_gseq", 0) if snapshot else 0
+        if record is not None and folded < record["_gseq"]:
+            # snapshot lost or older than this batch; newer journal events still replay on top
+            self._write_snapshot(user, record)
+            folded = record["_gseq"]
+        if entry["events"] and self.exists(user):
+            journal = self.journal(user)
+            done = max([folded] + [e.get("gseq", 0) for e in journal.replay()])
+            if done < gseq:
+                self._ensure_dir(journal.path)
+                journal.extend(entry["events"], sync=True)
+            log = self.activity_log(user)
+            newest = log.read(log.count() - 1, log.count())
+            if not newest or newest[0].get("gseq", 0) < gseq:
+                self._log_activity(user, entry["events"])
+
+    def append_events(self, username, events):
+        with self._lock:
+            if not self.exists(username):
+                return    # deleted: a journal without a snapshot would never be read
+            self._modified_at = time.time()
+            self._log_activity(username, events)
+            journal = self.journal(username)
+            self._ensure_dir(journal.path)
+            journal.extend(events)
+            if journal.size() > JOURNAL_SNAPSHOT_BYTES:
+                record = self.load(username)
+                if record is not None:
+                    self.save(record)
+
+    def load_all(self):
+        # only files whose stat changed since the last call are parsed again
+        return dict(self.registry.refresh(self).items())
+
+    def usernames(self):
+        # a snapshot file is an account; its name is all we need
+        return list({os.path.splitext(e.name)[0] for e in walk_user_files(self.root)
+                     if e.name.endswith(SNAPSHOT_EXTS)})
+
+    def unreadable_users(self):
+        return list(self.registry.unreadable)
+
+    def last_modified(self):
+        latest = self._modified_at
+        try:
+            latest = max(latest, os.stat(os.path.join(self.root, self.DELETE_MARKER)).st_mtime)
+        except FileNotFoundError:
+            pass
+        for entry in walk_user_files(self.root):
+            try:
+                latest = max(latest, entry.stat().st_mtime)
+            except FileNotFoundError:
+                continue
+        return latest
+
+    def check_integrity(self, workers=BULK_LOAD_WORKERS, processes=False):
+        jobs = user_file_jobs(self.root)
+        return list(_map_chunks(_check_user_chunk, jobs, workers, BULK_LOAD_CHUNK, processes))
+
+    def repair(self, problems, backup=None):
+        broken = sorted({user for user, kind, _ in problems if kind in ("snapshot", "orphan")})
+        recovered = backup.recover(broken) if backup is not None and broken else {}
+        actions = []
+        with self._lock:
+            for user, kind, _ in problems:
+                if kind == "journal":
+                    self.journal(user).replay()    # trims the torn tail
+                    actions.append((user, "truncated torn journal tail"))
+            for user in broken:
+                if user in recovered:
+                    self.save(recovered[user])
+                    actions.append((user, "restored from backup"))
+                    continue
+                # no good copy anywhere: move the files aside so the account stops
+                # silently vanishing and the bytes are still there to inspect
+                base = self._base(user)
+                for ext in SNAPSHOT_EXTS + (".journal",):
+                    if os.path.exists(base + ext):
+                        os.replace(base + ext, base + ext + ".corrupt")
+                actions.append((user, "quarantined (*.corrupt); not in any backup"))
+        return actions
+
+    def inactive_users(self, days):
+        cutoff = time.time() - days * 86400
+        newest = {}
+        for entry in walk_user_files(self.root):
+            if entry.name.endswith(SNAPSHOT_EXTS):
+                user = os.path.splitext(entry.name)[0]
+            elif entry.name.endswith(".journal"):
+                user = entry.name[:-8]
+            else:
+                continue
+            try:
+                mtime = entry.stat().st_mtime
+            except FileNotFoundError:
+                continue
+            newest[user] = max(newest.get(user, 0), mtime)
+        return [user for user, mtime in newest.items() if mtime < cutoff]
+
+    def delete_users(self, usernames):
+        with self._lock:
+            self._modified_at = time.time()
+            # a later crash recovery must not roll deleted users forward again
+            self.checkpoint()
+            trash = os.path.join(self.root, f"{TOMBSTONE_MARK}{time.time_ns()}")
+            os.makedirs(trash)
+            for user in usernames:
+                base = self._base(user)
+                for ext in self.USER_EXTS:
+                    if os.path.exists(base + ext):
+                        os.replace(base + ext, os.path.join(trash, user + ext))
+                self._activity_logs.pop(base + ".activity", None)
+            self._mark_deleted()
+        return tombstone(trash, trash)
+
+    def clear(self):
+        with self._lock:
+            self._modified_at = time.time()
+            purge = tombstone(self.root) if os.path.exists(self.root) else None
+            os.makedirs(self.root)    # recreate empty folder
+            self._mark_deleted()
+            self._unsynced.clear()
+            self._groups.clear()
+            self._made_dirs.clear()
+            self._activity_logs.clear()
+            self.registry.clear()
+            if self.sharded:
+                # an empty store has nothing left in the flat layout
+                self._mark_migrated()
+        return purge
+
+    def close(self):
+        self.checkpoint()
+
+
+class SqliteUserStore(UserStore):
+    """
+    Embedded SQLite store: one row per user, one row per holding, one row per activity item.
+
+    The database runs in WAL mode so readers never block the writer, and write_batch
+    commits a whole background batch as one transaction. Every query is a
+    constant SQL string below, so sqlite3's statement cache keeps them prepared.
+    Connections are per-thread (sqlite3 objects can't be shared across threads).
+    """
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS users (
+            username TEXT PRIMARY KEY,
+            password TEXT NOT NULL,
+            balance  REAL NOT NULL DEFAULT 0,
+            schema   INTEGER NOT NULL DEFAULT 1
+        );
+        CREATE TABLE IF NOT EXISTS holdings (
+            username TEXT NOT NULL,
+            symbol   TEXT NOT NULL,
+            amount   REAL NOT NULL,
+            PRIMARY KEY (username, symbol)
+        );
+        CREATE TABLE IF NOT EXISTS activity (
+            username TEXT NOT NULL,
+            seq      INTEGER NOT NULL,
+            desc     TEXT NOT NULL,
+            color    TEXT NOT NULL,
+            PRIMARY KEY (username, seq)
+        );
+        CREATE TABLE IF NOT EXISTS meta (
+            key   TEXT PRIMARY KEY,
+            value TEXT
+        );
+        CREATE TABLE IF NOT EXISTS last_seen (
+            username TEXT PRIMARY KEY,
+            at       REAL NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS last_seen_at ON last_seen (at);
+    """
+    # per-user tables; clear() renames them to "{name}_deleted-{ns}" and purges those
+    DATA_TABLES = ("users", "holdings", "activity", "last_seen")
+    PURGE_CHUNK = 10_000
+
+    SQL_EXISTS        = "SELECT 1 FROM users WHERE username = ?"
+    SQL_USERNAMES     = "SELECT username FROM users"
+    SQL_USERS_AFTER   = "SELECT username FROM users WHERE username > ? ORDER BY username LIMIT ?"
+    SQL_SELECT_USER   = "SELECT username, password, balance, schema FROM users WHERE username = ?"
+    SQL_SELECT_HOLD   = "SELECT symbol, amount FROM holdings WHERE username = ? ORDER BY rowid"
+    SQL_SELECT_ACT    = "SELECT desc, color FROM activity WHERE username = ? ORDER BY seq DESC LIMIT ?"
+    SQL_HAS_ACT       = "SELECT 1 FROM activity WHERE username = ? LIMIT 1"
+    SQL_COUNT_ACT     = "SELECT COALESCE(MAX(seq), 0) FROM activity WHERE username = ?"
+    SQL_PAGE_ACT      = ("SELECT desc, color FROM activity WHERE username = ? AND seq > ? AND seq <= ? "
+                         "ORDER BY seq DESC")
+    SQL_UPSERT_USER   = ("INSERT INTO users (username, password, balance, schema) VALUES (?, ?, ?, ?) "
+                         "ON CONFLICT(username) DO UPDATE SET password = excluded.password, "
+                         "balance = excluded.balance, schema = excluded.schema")
+    SQL_UPSERT_HOLD   = ("INSERT INTO holdings (username, symbol, amount) VALUES (?, ?, ?) "
+                         "ON CONFLICT(username, symbol) DO UPDATE SET amount = excluded.amount")
+    SQL_DELETE_HOLD   = "DELETE FROM holdings WHERE username = ?"
+    SQL_INSERT_ACT    = "INSERT INTO activity (username, seq, desc, color) VALUES (?, ?, ?, ?)"
+    SQL_ADD_BALANCE   = "UPDATE users SET balance = balance + ? WHERE username = ?"
+    SQL_ADD_HOLD      = ("INSERT INTO holdings (username, symbol, amount) VALUES (?, ?, ?) "
+                         "ON CONFLICT(username, symbol) DO UPDATE SET amount = amount + excluded.amount")
+    SQL_REMOVE_HOLD   = "DELETE FROM holdings WHERE username = ? AND symbol = ?"
+    SQL_PUSH_ACT      = ("INSERT INTO activity (username, seq, desc, color) "
+                         "SELECT ?, COALESCE(MAX(seq), 0) + 1, ?, ? FROM activity WHERE username = ?")
+    SQL_ALL_USERS     = "SELECT username, password, balance, schema FROM users"
+    SQL_ALL_HOLD      = "SELECT username, symbol, amount FROM holdings ORDER BY rowid"
+    # newest ACTIVITY_LIMIT items per user, walking the (username, seq) primary key
+    SQL_ALL_ACT       = ("WITH newest AS (SELECT username, MAX(seq) AS top FROM activity GROUP BY username) "
+                         "SELECT a.username, a.desc, a.color FROM newest n JOIN activity a "
+                         "ON a.username = n.username AND a.seq > n.top - ? "
+                         "ORDER BY a.username, a.seq DESC")
+    # leaderboard: balances and holdings for everyone in one pass
+    SQL_PORTFOLIOS    = ("SELECT u.username, u.balance, h.symbol, h.amount FROM users u "
+                         "LEFT JOIN holdings h ON h.username = u.username")
+    SQL_TOUCH         = ("INSERT INTO last_seen (username, at) VALUES (?, ?) "
+                         "ON CONFLICT(username) DO UPDATE SET at = excluded.at")
+    SQL_SEED_SEEN     = "INSERT OR IGNORE INTO last_seen (username, at) SELECT username, ? FROM users"
+    SQL_INACTIVE      = ("SELECT l.username FROM last_seen l JOIN users u ON u.username = l.username "
+                         "WHERE l.at < ?")
+    SQL_LAST_WRITE    = "SELECT MAX(at) FROM last_seen"
+    SQL_DELETE_ACT    = "DELETE FROM activity WHERE username = ?"
+    SQL_TOMBSTONES    = "SELECT name FROM sqlite_master WHERE type = 'table' AND instr(name, ?) > 0"
+    SQL_GET_META      = "SELECT value FROM meta WHERE key = ?"
+    SQL_SET_META      = "INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)"
+
+    def __init__(self, path=USER_DB_PATH):
+        self.path = path
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._local = threading.local()
+        self._writes = 0              # bumped by every write made through this store
+        self._all_cache = (None, {})  # (version key, load_all result)
+        self._conn().executescript(self.SCHEMA)
+        columns = [row[1] for row in self._conn().execute("PRAGMA table_info(users)")]
+        if "schema" not in columns:
+            # databases from before record versioning: every row starts out as version 1
+            with self._conn() as conn:
+                conn.execute("ALTER TABLE users ADD COLUMN schema INTEGER NOT NULL DEFAULT 1")
+        if self.get_meta("last_seen_seeded") is None:
+            # accounts from before last_seen existed count as active from now on
+            with self._conn() as conn:
+                conn.execute(self.SQL_SEED_SEEN, (time.time(),))
+            self.set_meta("last_seen_seeded", "1")
+        # finish purges a previous run didn't get to
+        for (table,) in self._conn().execute(self.SQL_TOMBSTONES, (TOMBSTONE_MARK,)).fetchall():
+            BackgroundPurge(lambda table=table: self._drop_tables_steps([table]))
+
+    def _version(self):
+        """
+        Changes whenever the database may have changed. Every write made through this
+        store calls _changed(), which is what the cache relies on; PRAGMA data_version
+        only adds commits by other processes (it's per connection and doesn't move for
+        that connection's own writes).
+        """
+        return (self._writes, self._conn().execute("PRAGMA data_version").fetchone()[0])
+
+    def _changed(self):
+        """Marks the load_all cache stale."""
+        self._writes += 1
+
+    def _conn(self):
+        """Returns this thread's connection, opening it on first use."""
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, cached_statements=128)
+            conn.execute("PRAGMA journal_mode=WAL")
+            # every commit is synced; WriteBehindStore batches writes so that's one per batch
+            conn.execute("PRAGMA synchronous=FULL")
+            self._local.conn = conn
+        return conn
+
+    def exists(self, username):
+        return self._conn().execute(self.SQL_EXISTS, (username,)).fetchone() is not None
+
+    def load(self, username):
+        record = self._read_record(self._conn(), username)
+        if record is not None and upgrade_record(record):
+            record = self._write_upgrade(username)
+        return record
+
+    def _read_record(self, conn, username):
+        """One user's record as stored (not upgraded), or None."""
+        row = conn.execute(self.SQL_SELECT_USER, (username,)).fetchone()
+        if row is None:
+            return None
+        return {
+            "username": row[0],
+            "password": row[1],
+            "balance":  row[2],
+            "holdings": dict(conn.execute(self.SQL_SELECT_HOLD, (username,))),
+            "activity": [{"desc": d, "color": c}
+                         for d, c in conn.execute(self.SQL_SELECT_ACT, (username, ACTIVITY_LIMIT))],
+            "schema":   row[3],
+        }
+
+    def _write_upgrade(self, username):
+        """
+        Upgrades a user's stored record and writes it back. The record is read again
+        inside the write transaction, so a write committed since load() read it (another
+        thread's connection, e.g. the background migration next to the writer) isn't
+        overwritten with older data.
+        """
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            record = self._read_record(conn, username)
+            if record is not None and upgrade_record(record):
+                self._write_record(conn, record)
+        except BaseException:
+            conn.rollback()
+            raise
+        conn.commit()
+        self._changed()
+        return record
+
+    def load_account(self, username):
+        conn = self._conn()
+        row = conn.execute(self.SQL_SELECT_USER, (username,)).fetchone()
+        if row is None:
+            return None
+        if row[3] < SCHEMA_VERSION:
+            # upgrading needs the whole record; load() writes it back
+            return super().load_account(username)
+        return {
+            "username": row[0],
+            "password": row[1],
+            "balance":  row[2],
+            "holdings": dict(conn.execute(self.SQL_SELECT_HOLD, (username,))),
+            "schema":   row[3],
+        }
+
+    def save(self, record):
+        self.save_many([record])
+
+    def save_many(self, records):
+        """Writes several records in a single transaction."""
+        conn = self._conn()
+        with conn:
+            for record in records:
+                self._write_record(conn, record)
+        self._changed()
+
+    def append_events(self, username, events):
+        """Applies each event as a handful of row updates, all in a single transaction."""
+        conn = self._conn()
+        with conn:
+            self._write_events(conn, username, events)
+        self._changed()
+
+    def write_batch(self, batch):
+        """Group commit: the whole batch is one transaction, so one WAL sync."""
+        conn = self._conn()
+        with conn:
+            for username, (record, events) in batch.items():
+                if record is not None:
+                    self._write_record(conn, record)
+                if events:
+                    self._write_events(conn, username, events)
+        self._changed()
+
+    def _write_record(self, conn, record):
+        """Replaces one user's rows with the contents of record."""
+        user = record["username"]
+        if conn.execute(self.SQL_EXISTS, (user,)).fetchone() is None:
+            # a new account never inherits history left under its name
+            conn.execute(self.SQL_DELETE_ACT, (user,))
+        conn.execute(self.SQL_UPSERT_USER,
+                     (user, record.get("password", ""), record.get("balance", 0.0),
+                      record.get("schema", 1)))
+        conn.execute(self.SQL_TOUCH, (user, time.time()))
+        conn.execute(self.SQL_DELETE_HOLD, (user,))
+        conn.executemany(self.SQL_UPSERT_HOLD,
+                         [(user, sym, amt) for sym, amt in record.get("holdings", {}).items()])
+        # history is append-only: a saved record's activity only seeds a user without any
+        if conn.execute(self.SQL_HAS_ACT, (user,)).fetchone() is None:
+            # activity is newest-first, so the highest seq is the newest item
+            acts = record.get("activity", [])
+            conn.executemany(self.SQL_INSERT_ACT,
+                             [(user, len(acts) - i, a["desc"], a["color"])
+                              for i, a in enumerate(acts)])
+
+    def _write_events(self, conn, username, events):
+        """Applies events to one user's rows (see apply_event); skips a user that isn't stored."""
+        if conn.execute(self.SQL_EXISTS, (username,)).fetchone() is None:
+            return    # deleted: don't leave orphan holdings/activity/last_seen rows
+        conn.execute(self.SQL_TOUCH, (username, time.time()))
+        for event in events:
+            if event["type"] == "remove_holding":
+                conn.execute(self.SQL_REMOVE_HOLD, (username, event["symbol"]))
+            else:
+                if event.get("cash"):
+                    conn.execute(self.SQL_ADD_BALANCE, (event["cash"], username))
+                if "symbol" in event:
+                    conn.execute(self.SQL_ADD_HOLD, (username, event["symbol"], event["qty"]))
+            if "desc" in event:
+                conn.execute(self.SQL_PUSH_ACT, (username, event["desc"], event["color"], username))
+
+    def load_all(self):
+        version = self._version()
+        if self._all_cache[0] == version:
+            return {user: copy_record(record) for user, record in self._all_cache[1].items()}
+        conn = self._conn()
+        all_users = {
+            user: {"username": user, "password": pw, "balance": bal,
+                   "holdings": {}, "activity": [], "schema": schema}
+            for user, pw, bal, schema in conn.execute(self.SQL_ALL_USERS)
+        }
+        for user, sym, amt in conn.execute(self.SQL_ALL_HOLD):
+            if user in all_users:
+                all_users[user]["holdings"][sym] = amt
+        for user, desc, color in conn.execute(self.SQL_ALL_ACT, (ACTIVITY_LIMIT,)):
+            if user in all_users:
+                all_users[user]["activity"].append({"desc": desc, "color": color})
+        for record in all_users.values():
+            upgrade_record(record)    # in memory; written back when the user is next loaded
+        self._all_cache = (version, all_users)
+        return {user: copy_record(record) for user, record in all_users.items()}
+
+    def load_portfolios(self):
+        portfolios = {}
+        for user, bal, sym, amt in self._conn().execute(self.SQL_PORTFOLIOS):
+            _, holdings = portfolios.setdefault(user, (bal, {}))
+            if sym is not None:
+                holdings[sym] = amt
+        return portfolios
+
+    def usernames(self):
+        return [row[0] for row in self._conn().execute(self.SQL_USERNAMES)]
+
+    def iter_users(self, after=None):
+        # keyset pagination over the primary key: no full listing, no OFFSET scans
+        after = "" if after is None else after
+        while True:
+            page = [row[0] for row in self._conn().execute(self.SQL_USERS_AFTER, (after, EXPORT_PAGE))]
+            if not page:
+                return
+            for username in page:
+                record = self.load(username)
+                if record is not None:
+                    yield record
+            after = page[-1]
+
+    def activity_count(self, username):
+        # seq runs 1..n per user, so the newest seq is the count
+        return self._conn().execute(self.SQL_COUNT_ACT, (username,)).fetchone()[0]
+
+    def activity_page(self, username, page, size=ACTIVITY_PAGE_SIZE):
+        top = self.activity_count(username) - page * size
+        return [{"desc": d, "color": c}
+                for d, c in self._conn().execute(self.SQL_PAGE_ACT, (username, top - size, top))]
+
+    def inactive_users(self, days):
+        return [row[0] for row in self._conn().execute(self.SQL_INACTIVE,
+                                                       (time.time() - days * 86400,))]
+
+    def last_modified(self):
+        # writes touch last_seen; deletes (which remove those rows) stamp "modified_at"
+        latest = self._conn().execute(self.SQL_LAST_WRITE).fetchone()[0] or 0.0
+        return max(latest, float(self.get_meta("modified_at", 0.0)))
+
+    def check_integrity(self, workers=BULK_LOAD_WORKERS, processes=False):
+        # SQLite checksums its own pages and indexes; quick_check walks all of them
+        return [(None, "database", msg) for (msg,) in self._conn().execute("PRAGMA quick_check")
+                if msg != "ok"]
+
+    def repair(self, problems, backup=None):
+        if not problems:
+            return []
+        conn = self._conn()
+        conn.execute("REINDEX")
+        if backup is None:
+            return [(None, "rebuilt indexes")]
+        # only accounts the database lost or can no longer read are restored; the rest
+        # are newer than the backup and stay as they are
+        restore = []
+        for user, record in backup.recover().items():
+            try:
+                if self.load(user) is not None:
+                    continue
+            except sqlite3.DatabaseError:
+                pass
+            restore.append(record)
+        for i in range(0, len(restore), IMPORT_BATCH):
+            self.save_many(restore[i:i + IMPORT_BATCH])
+        return [(None, "rebuilt indexes")] + [(r["username"], "restored from backup") for r in restore]
+
+    def delete_users(self, usernames):
+        # every per-user table is keyed by username, so all of their rows go in one
+        # transaction: nothing is left behind for a crash to orphan
+        rows = [(u,) for u in usernames]
+        conn = self._conn()
+        with conn:
+            for table in self.DATA_TABLES:
+                conn.executemany(f"DELETE FROM {table} WHERE username = ?", rows)
+            conn.execute(self.SQL_SET_META, ("modified_at", repr(time.time())))
+        self._changed()
+        return None
+
+    def clear(self):
+        # swap every data table for an empty one in one transaction, then drop the old
+        # ones in the background. sqlite3 only opens transactions implicitly for DML, so
+        # the DDL is wrapped in an explicit BEGIN/COMMIT (and executescript, which
+        # commits first, is avoided); a crash leaves either the old tables or new ones.
+        suffix = f"{TOMBSTONE_MARK}{time.time_ns()}"
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            # indexes follow a renamed table; dropping this one lets SCHEMA recreate it
+            conn.execute("DROP INDEX IF EXISTS last_seen_at")
+            for table in self.DATA_TABLES:
+                conn.execute(f'ALTER TABLE {table} RENAME TO "{table}{suffix}"')
+            for statement in self.SCHEMA.split(";"):
+                if statement.strip():
+                    conn.execute(statement)
+            conn.execute(self.SQL_SET_META, ("modified_at", repr(time.time())))
+        except BaseException:
+            conn.rollback()
+            raise
+        conn.commit()
+        self._changed()
+        tables = [table + suffix for table in self.DATA_TABLES]
+        return BackgroundPurge(lambda: self._drop_tables_steps(tables))
+
+    def _drop_tables_steps(self, tables):
+        """BackgroundPurge steps for detached tables: rows in PURGE_CHUNK batches, then DROP."""
+        conn = self._conn()
+        counts = [conn.execute(f'SELECT COUNT(*) FROM "{t}"').fetchone()[0] for t in tables]
+        yield sum(counts)
+        for table in tables:
+            while True:
+                with conn:
+                    deleted = conn.execute(
+                        f'DELETE FROM "{table}" WHERE rowid IN '
+                        f'(SELECT rowid FROM "{table}" LIMIT {self.PURGE_CHUNK})').rowcount
+                if not deleted:
+                    break
+                for _ in range(deleted):
+                    yield
+            with conn:
+                conn.execute(f'DROP TABLE "{table}"')
+
+    def get_meta(self, key, default=None):
+        """Reads a value from the meta key/value table."""
+        row = self._conn().execute(self.SQL_GET_META, (key,)).fetchone()
+        return row[0] if row else default
+
+    def set_meta(self, key, value):
+        """Writes a value to the meta key/value table."""
+        conn = self._conn()
+        with conn:
+            conn.execute(self.SQL_SET_META, (key, value))
+
+    def close(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is not None:
+            conn.close()
+            self._local.conn = None
+
+
+class WriteBehindStore(UserStore):
+    """
+    Wraps another UserStore and moves writes onto a background thread.
+
+    save/append_event only queue the change and return. The writer thread waits
+    `window` seconds for more changes, so a burst of trades by the same user is coalesced:
+    a newer full record replaces the older one, and queued events are written as one batch.
+    Reads flush anything still queued first, so callers always see their own writes.
+
+    A failed batch is put back and retried with a doubling delay. Once WRITE_RETRY_LIMIT
+    writes in a row have failed, flush() raises the error instead of waiting, and close()
+    stops retrying and raises it, so shutting down never hangs on a broken disk.
+    """
+
+    def __init__(self, backing, window=WRITE_BEHIND_WINDOW, backup=None):
+        self.backing = backing
+        self.window = window
+        self.backup = backup     # StoreBackup that logs every batch, if any
+        self._pending = {}       # username -> [record or None, [events queued after it]]
+        self._cond = threading.Condition()
+        self._submitted = 0      # changes queued so far
+        self._written = 0        # changes handed to the backing store so far
+        self._batch_target = None  # _submitted as of the batch being written, if any
+        self._flushers = 0
+        self._attempts = 0       # batches the writer has tried to write
+        self._failures = 0       # consecutive failed attempts
+        self._generation = 0     # bumped by clear(), so a failed batch isn't retried after it
+        self.last_error = None
+        self._closed = False
+        self._thread = threading.Thread(target=self._run, name="user-writer", daemon=True)
+        self._thread.start()
+
+    def _queue(self, username, record=None, event=None):
+        """Adds one change to the pending batch and wakes the writer."""
+        with self._cond:
+            if self._closed:
+                raise RuntimeError("WriteBehindStore is closed")
+            if record is not None:
+                # a full record supersedes anything queued before it
+                self._pending[username] = [record, []]
+            else:
+                self._pending.setdefault(username, [None, []])[1].append(event)
+            self._submitted += 1
+            self._cond.notify_all()
+
+    def _run(self):
+        """Writer thread: waits for changes, lets them pile up for `window`, writes them."""
+        while True:
+            with self._cond:
+                while not self._pending and not self._closed:
+                    self._cond.wait()
+                if not self._pending:
+                    return
+                if self._failures:
+                    if self._closed and self._failures >= WRITE_RETRY_LIMIT:
+                        return   # close() reports what was left unwritten
+                    delay = min(WRITE_RETRY_MAX_DELAY, WRITE_RETRY_DELAY * 2 ** (self._failures - 1))
+                    deadline = time.monotonic() + delay
+                    while True:
+                        remaining = deadline - time.monotonic()
+                        if remaining <= 0:
+                            break
+                        self._cond.wait(remaining)
+                deadline = time.monotonic() + self.window
+                while not self._flushers and not self._closed:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self._cond.wait(remaining)
+                batch, self._pending = self._pending, {}
+                target = self._batch_target = self._submitted
+                generation = self._generation
+            error = self._write(batch)
+            with self._cond:
+                self._attempts += 1
+                if error is None or generation != self._generation:
+                    # written, or cleared while being written: nothing left to retry
+                    self._written = target
+                    self._failures = 0
+                else:
+                    self.last_error = error
+                    self._failures += 1
+                    for username, (record, events) in batch.items():
+                        self._requeue(username, record, events)
+                self._batch_target = None
+                self._cond.notify_all()
+
+    def _write(self, batch):
+        """Hands one coalesced batch to the backing store (one group commit); returns the error, if any."""
+        try:
+            if self.backup is not None:
+                self.backup.write(self.backing, batch)
+            else:
+                self.backing.write_batch(batch)
+        except Exception as e:
+            print(f"Failed to save user data: {e}")
+            return e
+        return None
+
+    def _requeue(self, username, record, events):
+        """Puts a failed write back in front of anything queued since, to retry next batch."""
+        current = self._pending.get(username)
+        if current is None:
+            self._pending[username] = [record, list(events)]
+        elif current[0] is None:
+            current[0] = record
+            current[1][:0] = events
+
+    def flush(self):
+        """
+        Blocks until everything queued so far has been written.
+        Raises OSError if writes keep failing (WRITE_RETRY_LIMIT in a row, at least one
+        of them since this call) or the writer has given up; the changes stay queued.
+        """
+        with self._cond:
+            if self._written >= self._submitted:
+                return
+            target = self._submitted
+            attempts = self._attempts
+            self._flushers += 1
+            self._cond.notify_all()
+            try:
+                while self._written < target and self._thread.is_alive():
+                    if self._failures >= WRITE_RETRY_LIMIT and self._attempts > attempts:
+                        break
+                    self._cond.wait()
+            finally:
+                self._flushers -= 1
+            if self._written < target:
+                raise OSError(f"User data could not be saved: {self.last_error}") from self.last_error
+
+    def save(self, record):
+        self._queue(record["username"], record=record)
+
+    def append_event(self, username, event):
+        self._queue(username, event=event)
+
+    def append_events(self, username, events):
+        for event in events:
+            self._queue(username, event=event)
+
+    def exists(self, username):
+        self.flush()
+        return self.backing.exists(username)
+
+    def load(self, username):
+        self.flush()
+        return self.backing.load(username)
+
+    def load_all(self):
+        self.flush()
+        return self.backing.load_all()
+
+    def load_portfolios(self):
+        self.flush()
+        return self.backing.load_portfolios()
+
+    def load_account(self, username):
+        self.flush()
+        return self.backing.load_account(username)
+
+    def usernames(self):
+        self.flush()
+        return self.backing.usernames()
+
+    def iter_users(self, after=None):
+        self.flush()
+        return self.backing.iter_users(after)
+
+    def activity_count(self, username):
+        self.flush()
+        return self.backing.activity_count(username)
+
+    def activity_page(self, username, page, size=ACTIVITY_PAGE_SIZE):
+        self.flush()
+        return self.backing.activity_page(username, page, size)
+
+    def inactive_users(self, days):
+        self.flush()
+        return self.backing.inactive_users(days)
+
+    def delete_users(self, usernames):
+        self.flush()
+        if self.backup is not None:
+            self.backup.log_delete(usernames)
+        return self.backing.delete_users(usernames)
+
+    def unreadable_users(self):
+        return self.backing.unreadable_users()
+
+    def last_modified(self):
+        self.flush()
+        return self.backing.last_modified()
+
+    def check_integrity(self, workers=BULK_LOAD_WORKERS, processes=False):
+        self.flush()
+        return self.backing.check_integrity(workers, processes)
+
+    def repair(self, problems, backup=None):
+        self.flush()
+        return self.backing.repair(problems, backup or self.backup)
+
+    def clear(self):
+        with self._cond:
+            # drop queued changes; only a batch already being written is waited for
+            self._pending.clear()
+            self._generation += 1
+            self._submitted = self._written if self._batch_target is None else self._batch_target
+        self.flush()
+        purge = self.backing.clear()
+        if self.backup is not None:
+            self.backup.reset()
+        return purge
+
+    def close(self):
+        """
+        Flushes, stops the writer thread and closes the backing store.
+        If writes are failing, the writer retries up to WRITE_RETRY_LIMIT times in all and
+        close() then raises OSError naming how many users' changes were lost.
+        """
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+        self._thread.join()
+        self.backing.close()
+        if self._pending:
+            raise OSError(f"Changes for {len(self._pending)} user(s) could not be saved: "
+                          f"{self.last_error}") from self.last_error
+
+
+class StoreBackup:
+    """
+    Whole-store backup: a consistent snapshot plus a delta log of every write since.
+
+    delta.log frames (as in UserJournal) each batch written through write(), and each
+    delete, under an increasing seq. snapshot() dumps every record to snapshot.ndjson,
+    one {"seq", "crc", "record"} line per user, where seq is the last delta entry
+    already reflected in that record; records are read one at a time under the same
+    lock write() holds, so the store keeps running and every line is exact. recover()
+    is then the snapshot line plus the delta entries after its seq.
+
+    Snapshots are taken every BACKUP_INTERVAL seconds, or as soon as the delta passes
+    RECOVERY_DELTA_BYTES, so recovery never replays more than that; estimate() turns
+    the sizes into seconds using the throughput measured by the last snapshot.
+
+    The store makes each batch durable itself, so batch entries aren't fsynced one by
+    one: the delta is synced every GROUP_CHECKPOINT_EVERY batches, like the JSON store's
+    files at a checkpoint, and on every delete.
+    """
+
+    SNAPSHOT = "snapshot.ndjson"
+    DELTA = "delta.log"
+    MANIFEST = "manifest.json"
+
+    def __init__(self, directory=BACKUP_DIR):
+        self.directory = directory
+        self._lock = threading.Lock()
+        self._snapshot_lock = threading.Lock()
+        self._due = threading.Event()
+        self.delta = UserJournal(os.path.join(directory, self.DELTA))
+        self._unsynced = 0   # delta entries appended since its last fsync
+        self.seq = max([self.manifest().get("seq", 0)] + [e["seq"] for e in self.delta.replay()])
+
+    def _path(self, name):
+        return os.path.join(self.directory, name)
+
+    def manifest(self):
+        """Facts about the current snapshot ({} if there is none)."""
+        try:
+            with open(self._path(self.MANIFEST)) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def _log(self, entry, sync=True):
+        """
+        Appends one delta entry and returns its seq. Call with _lock held. Without sync
+        it's fsynced along with the next GROUP_CHECKPOINT_EVERY - 1 entries.
+        """
+        os.makedirs(self.directory, exist_ok=True)
+        self.seq += 1
+        entry["seq"] = self.seq
+        self._unsynced += 1
+        sync = sync or self._unsynced >= GROUP_CHECKPOINT_EVERY
+        self.delta.extend([entry], sync=sync)
+        if sync:
+            self._unsynced = 0
+        if self.delta.size() > RECOVERY_DELTA_BYTES:
+            self._due.set()
+        return self.seq
+
+    def write(self, store, batch):
+        """Logs a batch and writes it to store; the two are atomic w.r.t. snapshot()."""
+        with self._lock:
+            seq = self._log({"batch": {user: [record, list(events)]
+                                       for user, (record, events) in batch.items()}},
+                            sync=False)
+            try:
+                store.write_batch(batch)
+            except Exception:
+                self._log({"void": seq}, sync=False)
+                raise
+
+    def log_delete(self, usernames):
+        """Logs deleted accounts so recovery doesn't bring them back."""
+        with self._lock:
+            self._log({"delete": list(usernames)})
+
+    def reset(self):
+        """Drops every snapshot and delta (after the store itself was cleared)."""
+        with self._lock:
+            if os.path.exists(self.directory):
+                tombstone(self.directory)
+
+    def snapshot(self, store):
+        """Writes a fresh consistent snapshot of store, then trims the delta log."""
+        with self._snapshot_lock:
+            start = time.perf_counter()
+            with self._lock:
+                start_seq = self.seq
+            os.makedirs(self.directory, exist_ok=True)
+            tmp = self._path(self.SNAPSHOT + ".tmp")
+            records = 0
+            with open(tmp, "wb") as out:
+                for username in sorted(store.usernames()):
+                    with self._lock:
+                        seq = self.seq
+                        record = store.load(username)
+                    if record is None:
+                        continue
+                    record.pop("_gseq", None)
+                    line = {"seq": seq, "crc": record_checksum(record), "record": record}
+                    out.write(json.dumps(line, separators=(",", ":")).encode("utf-8") + b"\n")
+                    records += 1
+                out.flush()
+                os.fsync(out.fileno())
+            os.replace(tmp, self._path(self.SNAPSHOT))
+            size = os.path.getsize(self._path(self.SNAPSHOT))
+            atomic_write(self._path(self.MANIFEST), json.dumps({
+                "seq": start_seq, "records": records, "bytes": size,
+                "seconds": time.perf_counter() - start, "built_at": time.time(),
+            }).encode("utf-8"))
+            with self._lock:
+                # every record in the snapshot already reflects entries up to start_seq
+                keep = [e for e in self.delta.replay() if e["seq"] > start_seq]
+                atomic_write(self.delta.path, b"".join(encode_frame(e) for e in keep))
+            self._due.clear()
+            return records
+
+    def recover(self, usernames=None):
+        """
+        Rebuilds records from the snapshot and delta: { username: record } for the given
+        users (all of them if None). Snapshot lines failing their checksum are skipped.
+        """
+        wanted = set(usernames) if usernames is not None else None
+        state = {}   # username -> (last seq applied, record or None)
+        try:
+            with open(self._path(self.SNAPSHOT), "rb") as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        continue
+                    record = entry["record"]
+                    if wanted is not None and record["username"] not in wanted:
+                        continue
+                    if record_checksum(record) == entry["crc"]:
+                        state[record["username"]] = (entry["seq"], record)
+        except FileNotFoundError:
+            pass
+
+        entries = self.delta.replay()
+        voided = {e["void"] for e in entries if "void" in e}
+        for entry in entries:
+            seq = entry["seq"]
+            if seq in voided:
+                continue
+            for user in entry.get("delete", ()):
+                if (wanted is None or user in wanted) and seq > state.get(user, (0,))[0]:
+                    state[user] = (seq, None)
+            for user, (record, events) in entry.get("batch", {}).items():
+                if wanted is not None and user not in wanted:
+                    continue
+                applied, current = state.get(user, (0, None))
+                if seq <= applied:
+                    continue
+                if record is not None:
+                    current = dict(record)
+                    current.pop("_gseq", None)
+                for event in events:
+                    if current is not None:
+                        apply_event(current, event)
+                state[user] = (seq, current)
+        return {user: record for user, (_, record) in state.items() if record is not None}
+
+    def estimate(self):
+        """
+        Returns (records, bytes to read, estimated seconds) for a full recovery right now.
+        Bytes never exceed the snapshot plus RECOVERY_DELTA_BYTES.
+        """
+        manifest = self.manifest()
+        total = manifest.get("bytes", 0) + self.delta.size()
+        if not manifest:
+            return 0, total, None
+        rate = manifest["bytes"] / manifest["seconds"] if manifest["seconds"] else 0
+        return manifest["records"], total, (total / rate if rate else 0.0)
+
+    def start(self, store, interval=BACKUP_INTERVAL, delay=BACKUP_STARTUP_DELAY):
+        """
+        Takes snapshots of store on a daemon thread, every interval or when the delta is
+        full. The first comes no sooner than delay seconds from now, and a snapshot is
+        skipped while nothing has been written since the last one.
+        """
+        def run():
+            checked = time.time() + delay - interval
+            while True:
+                since = max(self.manifest().get("built_at", 0), checked)
+                self._due.wait(max(1.0, since + interval - time.time()))
+                checked = time.time()
+                manifest = self.manifest()
+                if manifest and manifest.get("seq") == self.seq:
+                    self._due.clear()
+                    continue
+                try:
+                    self.snapshot(store)
+                except Exception as e:
+                    print(f"Store backup failed: {e}")
+                    time.sleep(60)
+        threading.Thread(target=run, name="store-backup", daemon=True).start()
+
+
+class LeaderboardIndex:
+    """
+    Net-worth ranking that is kept up to date instead of rebuilt on every view.
+
+    Holds every user's balance and holdings vector, their current net worth, and a sorted
+    list of (-net_worth, username) keys. A balance change re-files one key; a price change
+    re-files only the holders of the symbols whose price moved. top() is a slice and
+    rank() is a bisect, so both are O(log n) lookups.
+    """
+
+    def __init__(self, portfolios=None, prices=None, worth=None):
+        self.prices = dict(prices or {})
+        self.portfolios = {}   # username -> {"balance": float, "holdings": {sym: amount}}
+        self.worth = {}        # username -> net worth at self.prices
+        self.holders = {}      # symbol -> set of usernames holding it
+        self._ranking = []     # sorted (-net_worth, username)
+        for user, (balance, holdings) in (portfolios or {}).items():
+            self._track(user, {"balance": balance, "holdings": dict(holdings)})
+            if worth is not None and user in worth:
+                # precomputed, e.g. by BalanceSnapshot.read
+                self.worth[user] = worth[user]
+            else:
+                self.worth[user] = self._net_worth(self.portfolios[user])
+        self._ranking = sorted((-w, u) for u, w in self.worth.items())
+
+    def _net_worth(self, portfolio):
+        """USD balance plus holdings valued at the index's current prices."""
+        return portfolio["balance"] + sum(
+            self.prices.get(sym, 0.0) * amt for sym, amt in portfolio["holdings"].items()
+        )
+
+    def _track(self, user, portfolio):
+        """Stores a portfolio and registers the user under every symbol they hold."""
+        old = self.portfolios.get(user)
+        if old is not None:
+            for sym in old["holdings"]:
+                self.holders.get(sym, set()).discard(user)
+        self.portfolios[user] = portfolio
+        for sym in portfolio["holdings"]:
+            self.holders.setdefault(sym, set()).add(user)
+
+    def _refile(self, user):
+        """Recomputes one user's net worth and moves their key to its new position."""
+        old = self.worth.get(user)
+        if old is not None:
+            del self._ranking[bisect.bisect_left(self._ranking, (-old, user))]
+        worth = self._net_worth(self.portfolios[user])
+        self.worth[user] = worth
+        bisect.insort(self._ranking, (-worth, user))
+
+    def update(self, user, balance, holdings):
+        """Adds or replaces a user's portfolio."""
+        self._track(user, {"balance": balance, "holdings": dict(holdings)})
+        self._refile(user)
+
+    def apply_event(self, user, event):
+        """Applies an account event (see apply_event) to a tracked user's portfolio."""
+        if user not in self.portfolios:
+            return
+        portfolio = self.portfolios[user]
+        apply_event(portfolio, {k: v for k, v in event.items() if k not in ("desc", "color")})
+        self._track(user, portfolio)
+        self._refile(user)
+
+    def remove(self, user):
+        """Drops a user from the ranking."""
+        if user not in self.worth:
+            return
+        del self._ranking[bisect.bisect_left(self._ranking, (-self.worth.pop(user), user))]
+        self._track(user, {"balance": 0.0, "holdings": {}})
+        del self.portfolios[user]
+
+    def set_prices(self, prices):
+        """Re-values holders of every symbol whose price changed."""
+        changed = {sym for sym in set(prices) | set(self.prices)
+                   if prices.get(sym) != self.prices.get(sym)}
+        self.prices = dict(prices)
+        affected = set()
+        for sym in changed:
+            affected |= self.holders.get(sym, set())
+        if len(affected) > len(self.worth) // 4:
+            # most of the board moved: one sort beats many re-files
+            for user in affected:
+                self.worth[user] = self._net_worth(self.portfolios[user])
+            self._ranking = sorted((-w, u) for u, w in self.worth.items())
+        else:
+            for user in affected:
+                self._refile(user)
+
+    def top(self, k):
+        """Returns the k richest users as [(username, net_worth)]."""
+        return [(user, -neg) for neg, user in self._ranking[:k]]
+
+    def rank(self, user):
+        """Returns a user's 1-based rank, or None if they aren't ranked."""
+        if user not in self.worth:
+            return None
+        return bisect.bisect_left(self._ranking, (-self.worth[user], user)) + 1
+
+    def __len__(self):
+        return len(self._ranking)
+
+
+class BalanceSnapshot:
+    """
+    Memory-mapped, columnar copy of every user's balance and holdings.
+
+    File layout (native byte order, every section 8-byte aligned):
+      header    magic "CSBS", u16 version, u16 byte order (1 little / 2 big),
+                u32 users, u32 assets, f64 built_at, u32 symbol width, 4 pad bytes
+      symbols   assets x width-byte NUL-padded utf-8 (width: the longest symbol,
+                rounded up to a multiple of 8, at least 16)
+      balances  users x f64
+      holdings  users x assets f64, row-major (dense matrix)
+      names     (users + 1) x u64 offsets into the blob that follows, then utf-8 usernames
+
+    Net worth for everyone is balances + holdings @ price_vector – one matrix-vector
+    product (numpy when it's installed) with no per-user file I/O.
+    """
+
+    MAGIC = b"CSBS"
+    VERSION = 2
+    HEADER = struct.Struct("=4sHHIIdI4x")
+    MIN_SYMBOL_SIZE = 16
+    BYTE_ORDER = 1 if sys.byteorder == "little" else 2
+
+    def __init__(self, path=BALANCE_SNAPSHOT_PATH):
+        self.path = path
+
+    def build(self, portfolios, built_at=None):
+        """
+        Writes a fresh snapshot from { username: (balance, holdings) }, atomically.
+        built_at should be when `portfolios` was read (default: now); readers compare it
+        with the store's last_modified() to tell whether the snapshot is current.
+        """
+        users = list(portfolios)
+        symbols = sorted({sym for _, holdings in portfolios.values() for sym in holdings})
+        column = {sym: j for j, sym in enumerate(symbols)}
+        encoded = [sym.encode("utf-8") for sym in symbols]
+        width = max([self.MIN_SYMBOL_SIZE] + [-(-len(raw) // 8) * 8 for raw in encoded])
+
+        balances = array("d", (float(portfolios[u][0]) for u in users))
+        matrix = array("d", bytes(8 * len(users) * len(symbols)))
+        for i, user in enumerate(users):
+            row = i * len(symbols)
+            for sym, amt in portfolios[user][1].items():
+                if sym in column:
+                    matrix[row + column[sym]] = float(amt)
+
+        names = [u.encode("utf-8") for u in users]
+        offsets = array("Q", [0])
+        for raw in names:
+            offsets.append(offsets[-1] + len(raw))
+
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        atomic_write(self.path, b"".join([
+            self.HEADER.pack(self.MAGIC, self.VERSION, self.BYTE_ORDER, len(users), len(symbols),
+                             time.time() if built_at is None else built_at, width),
+            b"".join(raw.ljust(width, b"\0") for raw in encoded),
+            balances.tobytes(), matrix.tobytes(), offsets.tobytes(), b"".join(names),
+        ]), sync=False)
+
+    def age(self):
+        """Seconds since the snapshot was built, or None if there's no usable snapshot."""
+        try:
+            with open(self.path, "rb") as f:
+                header = f.read(self.HEADER.size)
+            magic, version, order, _, _, built_at, _ = self.HEADER.unpack(header)
+        except (OSError, struct.error):
+            return None
+        if magic != self.MAGIC or version != self.VERSION or order != self.BYTE_ORDER:
+            return None
+        return time.time() - built_at
+
+    def read(self, quotes):
+        """
+        Returns (portfolios, net_worths) at the given QuoteBook's prices, or None if the
+        snapshot is missing or unreadable.
+        """
+        if self.age() is None:
+            return None
+        with open(self.path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            _, _, _, n, m, _, width = self.HEADER.unpack_from(mm, 0)
+            pos = self.HEADER.size
+            symbols = [mm[pos + j * width:pos + (j + 1) * width].rstrip(b"\0").decode("utf-8")
+                       for j in range(m)]
+            pos += m * width
+            bal_pos, hold_pos = pos, pos + 8 * n
+            names_pos = hold_pos + 8 * n * m
+            offsets = array("Q", mm[names_pos:names_pos + 8 * (n + 1)])
+            blob = names_pos + 8 * (n + 1)
+            users = [mm[blob + offsets[i]:blob + offsets[i + 1]].decode("utf-8") for i in range(n)]
+
+            price_vec = quotes.vector(symbols)
+            view = memoryview(mm)
+            try:
+                balances = view[bal_pos:hold_pos].cast("d")
+                matrix = view[hold_pos:names_pos].cast("d")
+                worth = self._net_worths(balances, matrix, price_vec, n, m)
+                portfolios = {
+                    user: (balances[i], {symbols[j]: matrix[i * m + j]
+                                         for j in range(m) if matrix[i * m + j]})
+                    for i, user in enumerate(users)
+                }
+                balances.release()
+                matrix.release()
+            finally:
+                view.release()
+        return portfolios, dict(zip(users, worth))
+
+    @staticmethod
+    def _net_worths(balances, matrix, price_vec, n, m):
+        """balances + matrix @ price_vec, as a list of floats."""
+        if np is not None and n and m:
+            bal = np.frombuffer(balances, dtype=np.float64, count=n)
+            hold = np.frombuffer(matrix, dtype=np.float64, count=n * m).reshape(n, m)
+            result = (bal + hold @ np.asarray(price_vec)).tolist()
+            del bal, hold   # drop the buffer exports before the mmap closes
+            return result
+        priced = [(j, p) for j, p in enumerate(price_vec) if p]
+        return [balances[i] + sum(matrix[i * m + j] * p for j, p in priced) for i in range(n)]
+
+
+class BloomFilter:
+    """
+    Fixed-size Bloom filter over strings: "no" answers are exact, "yes" answers are wrong
+    about fp_rate of the time once `capacity` items have been added.
+
+    File layout: magic "CSBF", u32 hash count, u64 bit count, u64 items, then the bits.
+    """
+
+    MAGIC = b"CSBF"
+    HEADER = struct.Struct("<4sIQQ")
+
+    def __init__(self, capacity=1024, fp_rate=USERNAME_BLOOM_FP_RATE, bits=None, hashes=None):
+        capacity = max(capacity, 1)
+        self.m = bits or max(64, int(-capacity * math.log(fp_rate) / math.log(2) ** 2))
+        self.k = hashes or max(1, round(self.m / capacity * math.log(2)))
+        self.bits = bytearray((self.m + 7) // 8)
+        self.count = 0
+
+    def _positions(self, item):
+        """k bit positions by double hashing one 128-bit digest."""
+        digest = hashlib.blake2b(item.encode("utf-8"), digest_size=16).digest()
+        h1, h2 = struct.unpack("<QQ", digest)
+        return [(h1 + i * h2) % self.m for i in range(self.k)]
+
+    def add(self, item):
+        for pos in self._positions(item):
+            self.bits[pos >> 3] |= 1 << (pos & 7)
+        self.count += 1
+
+    def __contains__(self, item):
+        return all(self.bits[pos >> 3] & (1 << (pos & 7)) for pos in self._positions(item))
+
+    def to_bytes(self):
+        return self.HEADER.pack(self.MAGIC, self.k, self.m, self.count) + bytes(self.bits)
+
+    @classmethod
+    def from_bytes(cls, data):
+        """Parses to_bytes() output; raises ValueError if it's not a valid filter."""
+        try:
+            magic, k, m, count = cls.HEADER.unpack_from(data, 0)
+        except struct.error:
+            raise ValueError("truncated Bloom filter header")
+        bits = data[cls.HEADER.size:]
+        if magic != cls.MAGIC or not k or len(bits) != (m + 7) // 8:
+            raise ValueError("not a Bloom filter file")
+        bloom = cls(bits=m, hashes=k)
+        bloom.bits[:] = bits
+        bloom.count = count
+        return bloom
+
+
+class UsernameIndex:
+    """
+    Answers "does this account exist?" for register and login, mostly without disk I/O.
+
+    At startup the Bloom filter persisted at `path` is loaded, and a background thread
+    rebuilds the exact set of usernames from store.usernames(). Until the rebuild is
+    done, names the filter rules out are answered immediately and only possible matches
+    go to the store; afterwards the in-memory set answers everything.
+
+    The persisted filter is removed as soon as a name is added and written again by
+    save() (at rebuild and on close), so a crash can never leave a filter on disk that
+    misses an account.
+    """
+
+    def __init__(self, store, path=USERNAME_BLOOM_PATH):
+        self.store = store
+        self.path = path
+        self._names = None      # exact set once the rebuild finishes
+        self._added = set()     # names added while the rebuild was running
+        self._lock = threading.Lock()
+        self._on_disk = False
+        try:
+            with open(path, "rb") as f:
+                self._bloom = BloomFilter.from_bytes(f.read())
+            self._on_disk = True
+        except (OSError, ValueError):
+            self._bloom = None
+        threading.Thread(target=self.rebuild, daemon=True).start()
+
+    def rebuild(self):
+        """Reloads the exact name set from the store and persists a fresh filter."""
+        names = set(self.store.usernames())
+        with self._lock:
+            names |= self._added
+            bloom = BloomFilter(capacity=2 * len(names) + 1024)
+            for name in names:
+                bloom.add(name)
+            self._names, self._bloom, self._added = names, bloom, set()
+        self.save()
+
+    def __contains__(self, username):
+        with self._lock:
+            if self._names is not None:
+                return username in self._names
+            if username in self._added:
+                return True
+            if self._bloom is not None and username not in self._bloom:
+                return False
+        return self.store.exists(username)
+
+    def add(self, username):
+        """Records a newly created account."""
+        with self._lock:
+            if self._names is not None:
+                self._names.add(username)
+            else:
+                self._added.add(username)
+            if self._bloom is not None:
+                self._bloom.add(username)
+            if self._on_disk:
+                # the file no longer covers every account until save() runs again
+                try:
+                    os.remove(self.path)
+                except FileNotFoundError:
+                    pass
+                self._on_disk = False
+
+    def discard(self, usernames):
+        """Forgets deleted accounts (the filter keeps them; they only cost a store lookup)."""
+        with self._lock:
+            for name in usernames:
+                if self._names is not None:
+                    self._names.discard(name)
+                self._added.discard(name)
+
+    def clear(self):
+        """Forgets every name (after the store has been emptied)."""
+        with self._lock:
+            self._names, self._added = set(), set()
+            self._bloom = BloomFilter()
+        self.save()
+
+    def save(self):
+        """Persists the filter, if the index knows every name."""
+        with self._lock:
+            if self._names is None or self._bloom is None:
+                return
+            data = self._bloom.to_bytes()
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            atomic_write(self.path, data, sync=False)
+            self._on_disk = True
+
+
+def migrate_records(store, progress=None):
+    """
+    Loads every record once, which upgrades and writes back any that are older than
+    SCHEMA_VERSION. Safe to run while the store is in use. Returns the number visited.
+    """
+    visited = 0
+    for _ in store.iter_users():
+        visited += 1
+        if progress and visited % EXPORT_PAGE == 0:
+            progress(visited)
+    if progress:
+        progress(visited)
+    return visited
+
+
+def open_user_store(backend=STORAGE_BACKEND):
+    """
+    Opens the configured UserStore.
+
+    The first time the SQLite store is opened, any legacy user_data/*.json accounts are
+    imported into it so existing users keep their balances. The legacy files are only
+    read (see read_user_files); they're left exactly as they were. With
+    BACKGROUND_RECORD_MIGRATION, old records are upgraded by a background thread.
+    """
+    if backend == "json":
+        store = JsonUserStore(USER_DATA_DIR)
+        if store.needs_migration():
+            # move legacy flat files into shards in the background; the store stays usable
+            threading.Thread(target=store.migrate_to_sharded, name="shard-migration",
+                             daemon=True).start()
+    else:
+        store = SqliteUserStore(USER_DB_PATH)
+        if store.get_meta("legacy_imported") is None:
+            legacy = list(read_user_files(USER_DATA_DIR))
+            for i in range(0, len(legacy), IMPORT_BATCH):
+                store.save_many(legacy[i:i + IMPORT_BATCH])
+            store.set_meta("legacy_imported", "1")
+    if BACKGROUND_RECORD_MIGRATION:
+        threading.Thread(target=migrate_records, args=(store,), name="record-migration",
+                         daemon=True).start()
+    return store
+
+
+class MarketDataClient:
+    """
+    The one HTTP client for market data: a pooled requests.Session (connections and TLS
+    sessions are reused), a (connect, read) timeout on every attempt, and retries with
+    full-jitter exponential backoff for connection errors, timeouts, 429 and 5xx, all
+    within a per-request time budget so a dead endpoint fails in bounded time.
+
+    Latency and outcome of every request are kept for stats().
+    """
+
+    RETRY_STATUS = {429, 500, 502, 503, 504}
+
+    def __init__(self, timeout=MARKET_TIMEOUT, attempts=MARKET_ATTEMPTS,
+                 budget=MARKET_RETRY_BUDGET, backoff=MARKET_BACKOFF, pool_size=MARKET_POOL_SIZE):
+        self.timeout = timeout
+        self.attempts = attempts
+        self.budget = budget
+        self.backoff = backoff
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        self.session.headers["Content-type"] = "application/json; charset=UTF-8"
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.failures = 0
+        self.retries = 0
+        self.latencies = deque(maxlen=1000)   # seconds, successful requests only
+
+    def get_json(self, url, params=None):
+        """GETs url and returns the decoded JSON body. Raises the last error once out of retries."""
+        start = time.perf_counter()
+        deadline = start + self.budget
+        attempt = 0
+        while True:
+            attempt += 1
+            try:
+                response = self.session.get(url, params=params, timeout=self.timeout)
+                if response.status_code in self.RETRY_STATUS:
+                    raise requests.HTTPError(f"HTTP {response.status_code}", response=response)
+                response.raise_for_status()
+                data = response.json()
+            except (requests.ConnectionError, requests.Timeout, requests.HTTPError) as e:
+                status = e.response.status_code if e.response is not None else None
+                retryable = status is None or status in self.RETRY_STATUS
+                delay = random.uniform(0, self.backoff * 2 ** (attempt - 1))
+                if not retryable or attempt >= self.attempts or time.perf_counter() + delay >= deadline:
+                    self._record(False, start)
+                    raise
+                with self._lock:
+                    self.retries += 1
+                time.sleep(delay)
+                continue
+            except ValueError:
+                self._record(False, start)
+                raise
+            self._record(True, start)
+            return data
+
+    def _record(self, ok, start):
+        with self._lock:
+            self.requests += 1
+            if ok:
+                self.latencies.append(time.perf_counter() - start)
+            else:
+                self.failures += 1
+
+    def stats(self):
+        """{"requests", "failures", "failure_rate", "retries", "p50_ms", "p95_ms"} so far."""
+        with self._lock:
+            latencies = sorted(self.latencies)
+            requests_, failures, retries = self.requests, self.failures, self.retries
+        pick = lambda q: latencies[min(len(latencies) - 1, int(q * len(latencies)))] * 1000
+        return {
+            "requests": requests_, "failures": failures, "retries": retries,
+            "failure_rate": failures / requests_ if requests_ else 0.0,
+            "p50_ms": pick(0.5) if latencies else None,
+            "p95_ms": pick(0.95) if latencies else None,
+        }
+
+    def close(self):
+        self.session.close()
+
+
+def load_asset_universe(spec=MARKET_ASSETS):
+    """Symbols to quote, from a comma-separated list or a file of one symbol per line."""
+    if os.path.isfile(spec):
+        with open(spec, "r", encoding="utf-8") as f:
+            text = f.read().replace("\n", ",")
+    else:
+        text = spec
+    symbols = []
+    for sym in text.split(","):
+        sym = sym.strip().upper()
+        if sym and sym not in symbols:
+            symbols.append(sym)
+    return symbols
+
+
+class RateLimiter:
+    """Token bucket shared between threads: acquire() blocks until a request may start."""
+
+    def __init__(self, rate, burst=None):
+        self.rate = rate
+        self.burst = burst or max(1.0, rate)
+        self._tokens = self.burst
+        self._stamp = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        if self.rate <= 0:
+            return
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.burst, self._tokens + (now - self._stamp) * self.rate)
+                self._stamp = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait = (1 - self._tokens) / self.rate
+            time.sleep(wait)
+
+
+def parse_coindesk_metadata(data):
+    """Turns an asset/v2/metadata response into the list of coin dicts the views use."""
+    return list(data['Data'].values())
+
+
+class PartialFetch(Exception):
+    """
+    Raised by MarketDataProvider.fetch when only some of the data arrived. `symbols` is
+    the whole universe in order, `fresh` the { symbol: coin } that did arrive and
+    `error` the failure that kept the rest away.
+    """
+
+    def __init__(self, symbols, fresh, error):
+        super().__init__(f"{len(symbols) - len(fresh)} of {len(symbols)} quotes missing: {error}")
+        self.symbols = symbols
+        self.fresh = fresh
+        self.error = error
+
+    def merge(self, previous):
+        """Coin dicts in universe order: fresh quotes, else those in the previous QuoteBook."""
+        return [coin for coin in (self.fresh.get(sym) or previous.by_symbol.get(sym)
+                                  for sym in self.symbols) if coin]
+
+
+class MarketDataProvider(ABC):
+    """
+    Source of coin data for PriceCache. fetch() returns a list of coin dicts in the
+    CoinDesk metadata shape (SYMBOL, NAME, PRICE_USD, ...), raises PartialFetch when only
+    part of it could be fetched and any other exception when none could.
+    """
+
+    # seconds between PriceCache's background refreshes from this provider
+    stream_interval = PRICE_STREAM_INTERVAL
+
+    @abstractmethod
+    def fetch(self):
+        """Returns the current coin dicts; raises if there's nothing to return."""
+
+    def close(self):
+        pass
+
+
+class CoinDeskProvider(MarketDataProvider):
+    """
+    Live prices from CoinDesk's asset/v2/metadata endpoint.
+
+    The asset universe is split into requests of `chunk` symbols, fetched `workers` at a
+    time over the client's connection pool and no faster than `rate` requests per
+    second, then merged in universe order, so a refresh takes about
+    chunks / min(workers, rate × latency) round trips rather than one per chunk. If a
+    chunk still fails after the client's retries, fetch raises PartialFetch with the
+    quotes that did arrive, and PriceCache keeps the previous quotes for the rest.
+
+    With `record_path`, every merged response is also appended to that NDJSON file,
+    which ReplayProvider can serve back later.
+    """
+
+    def __init__(self, client=None, assets=None, record_path=None, chunk=MARKET_CHUNK,
+                 workers=MARKET_FETCH_WORKERS, rate=MARKET_RATE_LIMIT):
+        self.client = client or MarketDataClient()
+        self.assets = load_asset_universe() if assets is None else list(assets)
+        self.record_path = record_path
+        self.chunks = [self.assets[i:i + chunk] for i in range(0, len(self.assets), chunk)]
+        self.workers = max(1, min(workers, len(self.chunks)))
+        self.limiter = RateLimiter(rate)
+        self._pool = ThreadPoolExecutor(self.workers, thread_name_prefix="market-fetch") \
+            if self.workers > 1 else None
+
+    def _fetch_chunk(self, symbols):
+        """Returns { symbol: coin } for one chunk, or the exception it failed with."""
+        self.limiter.acquire()
+        try:
+            data = self.client.get_json(COINDESK_METADATA_URL, params={
+                "asset_lookup_priority": "SYMBOL",
+                "quote_asset": "USD",
+                "asset_language": "en-US",
+                "assets": ",".join(symbols),
+                "groups": "ID,PRICE,MKT_CAP,CHANGE,BASIC"
+            })
+            return data.get("Data") or {}
+        except Exception as e:
+            return e
+
+    def fetch(self):
+        if self._pool is None:
+            results = [self._fetch_chunk(symbols) for symbols in self.chunks]
+        else:
+            results = list(self._pool.map(self._fetch_chunk, self.chunks))
+        merged, error = {}, None
+        for result in results:
+            if isinstance(result, Exception):
+                error = error or result
+            else:
+                merged.update(result)
+        if error is not None and not merged:
+            raise error
+        if self.record_path is not None:
+            with open(self.record_path, "a", encoding="utf-8") as f:
+                f.write(json.dumps({"Data": merged}, separators=(",", ":")) + "\n")
+        if error is not None:
+            raise PartialFetch(self.assets, merged, error)
+        return parse_coindesk_metadata({"Data": merged})
+
+    def close(self):
+        if self._pool is not None:
+            self._pool.shutdown(wait=False)
+        self.client.close()
+
+
+class ReplayProvider(MarketDataProvider):
+    """
+    Serves recorded CoinDesk responses, for offline and repeatable load/latency runs.
+
+    `source` is a file (NDJSON of responses as written by CoinDeskProvider's
+    record_path, or one JSON response) or an http(s) URL answering with a response,
+    fetched through `client`. File recordings are served in order, looping at the end:
+    one per fetch, or with `rate` > 0, `rate` recordings per second of wall time
+    whatever the fetch rate. `latency` seconds are slept before each answer to stand in
+    for the network.
+    """
+
+    # recordings cost no API calls and aren't written to the price cache
+    stream_interval = min(PRICE_STREAM_INTERVAL, REPLAY_STREAM_INTERVAL)
+
+    def __init__(self, source, rate=MARKET_REPLAY_RATE, latency=MARKET_REPLAY_LATENCY,
+                 client=None):
+        self.source = source
+        self.rate = rate
+        self.latency = latency
+        self.remote = source.startswith(("http://", "https://"))
+        self.client = (client or MarketDataClient()) if self.remote else None
+        self.responses = [] if self.remote else self._read(source)
+        self._served = 0
+        self._started = time.monotonic()
+
+    @staticmethod
+    def _read(path):
+        with open(path, "r", encoding="utf-8") as f:
+            text = f.read()
+        try:
+            responses = [json.loads(text)]
+        except ValueError:
+            responses = [json.loads(line) for line in text.splitlines() if line.strip()]
+        if not responses:
+            raise ValueError(f"no recorded responses in {path}")
+        return responses
+
+    def fetch(self):
+        if self.latency:
+            time.sleep(self.latency)
+        if self.remote:
+            return parse_coindesk_metadata(self.client.get_json(self.source))
+        if self.rate > 0:
+            index = int((time.monotonic() - self._started) * self.rate)
+        else:
+            index = self._served
+            self._served += 1
+        return parse_coindesk_metadata(self.responses[index % len(self.responses)])
+
+    def close(self):
+        if self.client is not None:
+            self.client.close()
+
+
+def open_market_provider(client=None, replay=MARKET_REPLAY):
+    """Returns the configured MarketDataProvider: ReplayProvider if `replay` is set, else CoinDesk."""
+    if replay:
+        return ReplayProvider(replay, client=client)
+    return CoinDeskProvider(client)
+
+
+class QuoteBook:
+    """
+    One price refresh's coin data, indexed for lookups.
+
+    by_symbol maps symbol -> coin dict; symbols fixes a column order with column
+    mapping symbol -> index into the dense price_vector (f64), for vectorised consumers
+    like BalanceSnapshot; prices is the same data as a { symbol: price } dict. Built once
+    per fetch by PriceCache and never modified, so it can be shared between threads.
+    """
+
+    def __init__(self, coins=()):
+        self.coins = list(coins)
+        self.by_symbol = {c["SYMBOL"]: c for c in self.coins}
+        self.symbols = list(self.by_symbol)
+        self.column = {sym: j for j, sym in enumerate(self.symbols)}
+        self.price_vector = array("d", (float(c.get("PRICE_USD") or 0.0)
+                                        for c in self.by_symbol.values()))
+        self.prices = dict(zip(self.symbols, self.price_vector))
+
+    def quote(self, symbol):
+        """The coin dict for symbol, or {} if it isn't quoted."""
+        return self.by_symbol.get(symbol, {})
+
+    def price(self, symbol):
+        """USD price of symbol, 0.0 if it isn't quoted."""
+        j = self.column.get(symbol)
+        return self.price_vector[j] if j is not None else 0.0
+
+    def vector(self, symbols):
+        """Prices for the given symbols in that order (0.0 where unquoted)."""
+        return [self.price(sym) for sym in symbols]
+
+    def changes_since(self, older):
+        """{ symbol: coin } for every symbol quoted here whose data differs from `older`."""
+        return {sym: coin for sym, coin in self.by_symbol.items()
+                if older.by_symbol.get(sym) != coin}
+
+    def __contains__(self, symbol):
+        return symbol in self.column
+
+    def __len__(self):
+        return len(self.coins)
+
+
+class PriceCache:
+    """
+    In-memory coin data with stale-while-revalidate semantics.
+
+    get() never blocks: it returns the QuoteBook of whatever was fetched last (empty
+    until the first fetch lands) and, if that is older than ttl, starts one background
+    refresh.
+    start() additionally polls every PRICE_STREAM_INTERVAL seconds on a daemon thread,
+    so readers normally see fresh data, and each poll that changes anything calls the
+    subscribe()d callbacks with just the changed symbols. A failed fetch keeps the
+    previous data; a PartialFetch takes what arrived and keeps the previous quotes for
+    the rest. Either way last_error is set until a fetch succeeds in full.
+
+    Every complete fetch is also written to `path` with its timestamp and read back
+    at construction, so after a restart (or while CoinDesk is down) the last good
+    prices are served, marked stale by age(). A PartialFetch isn't saved: its merged
+    quotes would come back under a new timestamp with no warning left to show.
+    """
+
+    def __init__(self, fetch, ttl=PRICE_TTL, path=PRICE_CACHE_PATH):
+        self.fetch = fetch
+        self.ttl = ttl
+        self.path = path
+        self._book = QuoteBook()
+        self._fetched_at = None   # time.time() of the last successful fetch
+        self._lock = threading.Lock()
+        self._refreshing = False
+        self.last_error = None
+        self.version = 0          # bumped by every successful fetch
+        self._subscribers = []
+        self._load()
+
+    def _load(self):
+        """Reads the persisted response, if there is a readable one."""
+        if self.path is None:
+            return
+        try:
+            with open(self.path, "rb") as f:
+                saved = json.loads(f.read())
+            self._book, self._fetched_at = QuoteBook(saved["coins"]), saved["fetched_at"]
+        except (OSError, ValueError, KeyError, TypeError):
+            pass
+
+    def _save(self, coins, fetched_at):
+        try:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            atomic_write(self.path, json.dumps({"fetched_at": fetched_at, "coins": coins})
+                         .encode("utf-8"), sync=False)
+        except OSError as e:
+            print(f"Failed to save market data: {e}")
+
+    def age(self):
+        """Seconds since the data was fetched, or None if it never was."""
+        fetched_at = self._fetched_at
+        return None if fetched_at is None else max(0.0, time.time() - fetched_at)
+
+    def fresh(self):
+        age = self.age()
+        return age is not None and age < self.ttl
+
+    def get(self):
+        """Returns the cached QuoteBook, revalidating in the background if it's stale."""
+        return self.snapshot()[1]
+
+    def snapshot(self):
+        """Like get(), but returns (version, QuoteBook) read together."""
+        if not self.fresh():
+            self.revalidate()
+        with self._lock:
+            return self.version, self._book
+
+    def refresh(self):
+        """Fetches now, on the calling thread. Returns True if the data was replaced."""
+        error = None
+        try:
+            coins = self.fetch()
+        except PartialFetch as e:
+            coins, error = None, e
+        except Exception as e:
+            self.last_error = e
+            print(f"Failed to fetch coin data: {e}")
+            return False
+        fetched_at = time.time()
+        with self._lock:
+            if error is not None:
+                coins = error.merge(self._book)
+            book = QuoteBook(coins)
+            changes = book.changes_since(self._book)
+            self._book = book
+            self._fetched_at = fetched_at
+            self.last_error = error
+            self.version += 1
+            # still under the lock, so no snapshot() sees the new version before its
+            # changes have been handed to every subscriber
+            if changes:
+                for callback in list(self._subscribers):
+                    try:
+                        callback(changes)
+                    except Exception as e:
+                        print(f"Price subscriber failed: {e}")
+        if self.path is not None and error is None:
+            self._save(coins, fetched_at)
+        return True
+
+    def subscribe(self, callback):
+        """
+        Calls callback({ symbol: coin }) with the symbols whose quote changed, after every
+        fetch that changed any. Runs on the fetching thread with the cache locked, so
+        callbacks must be quick, must not touch Tk widgets and must not call back in.
+        """
+        self._subscribers.append(callback)
+
+    def unsubscribe(self, callback):
+        if callback in self._subscribers:
+            self._subscribers.remove(callback)
+
+    def revalidate(self):
+        """Starts a background refresh unless one is already running."""
+        with self._lock:
+            if self._refreshing:
+                return
+            self._refreshing = True
+
+        def run():
+            try:
+                self.refresh()
+            finally:
+                self._refreshing = False
+
+        threading.Thread(target=run, name="price-revalidate", daemon=True).start()
+
+    def status(self):
+        """A short note on the data's age for the UI, or "" while it's fresh."""
+        age = self.age()
+        if age is None:
+            return "Market data unavailable" if self.last_error else "Loading market data…"
+        if age < self.ttl:
+            return "⚠ Some prices may be out of date" if self.last_error else ""
+        if age < 3600:
+            when = f"{int(age // 60)} min ago" if age >= 60 else f"{int(age)}s ago"
+        elif age < 86400:
+            when = f"{age / 3600:.1f} h ago"
+        else:
+            when = time.strftime("%Y-%m-%d %H:%M", time.localtime(self._fetched_at))
+        return f"⚠ Prices from {when}" if self.last_error else f"Prices from {when}"
+
+    def start(self, interval=PRICE_STREAM_INTERVAL):
+        """Refreshes every interval seconds on a daemon thread, starting immediately."""
+        def run():
+            while True:
+                self.refresh()
+                time.sleep(interval)
+        threading.Thread(target=run, name="price-refresher", daemon=True).start()
+
+
+def change_format(coin, fmt="{:.2f}%"):
+    """bind_price format for a 24h change label: the percentage, green if up, red if down."""
+    chg = float(coin.get("SPOT_MOVING_24_HOUR_CHANGE_PERCENTAGE_USD") or 0)
+    return {"text": fmt.format(chg), "fg": "green" if chg >= 0 else "red"}
+
 
 class CryptoSimApp:
     def __init__(self, root):
@@ -82,6 +3375,31 @@ class CryptoSimApp:
         self.current_balance = 0
         self.holdings = {}
         self.activity = []   # will hold tuples of (description, color)
+        self.history_page = 0
+        self.backup = StoreBackup()
+        self.store = WriteBehindStore(open_user_store(), backup=self.backup)
+        self.backup.start(self.store.backing)
+        self.usernames = UsernameIndex(self.store)
+        self.purge_status = tk.StringVar(value="")   # progress of background account deletes
+        self.leaderboard = None   # LeaderboardIndex, built the first time it's needed
+        self.balance_snapshot = BalanceSnapshot()
+        self.market = MarketDataClient()
+        self.provider = open_market_provider(self.market)
+        # replayed prices aren't real, so they mustn't replace the last good live ones
+        self.prices = PriceCache(self.provider.fetch,
+                                 path=None if MARKET_REPLAY else PRICE_CACHE_PATH)
+        self.prices.start(self.provider.stream_interval)
+        self.prices_seen = -1         # PriceCache.version the dashboard was built from
+        self.price_deltas = {}        # symbol -> coin, changed since watch_prices last ran
+        self._deltas_lock = threading.Lock()
+        self.price_labels = {}        # symbol -> [(label, format)] showing that symbol's quote
+        self.prices.subscribe(self.queue_price_deltas)
+        self.current_tab = None
+        self.tab_awaits_prices = False   # current tab was drawn as a skeleton
+        self.root.after(PRICE_POLL_MS, self.watch_prices)
+        self._snapshot_building = False
+        self.root.protocol("WM_DELETE_WINDOW", self.on_close)
+        self.refresh_balance_snapshot()
         self.usd_icon = self.load_image(
             os.path.join('images', 'United-states_flag_icon_round.svg.png'),
             (16,16))
@@ -98,17 +3416,95 @@ class CryptoSimApp:
 
 
     def clear_all_user_data(self):
-        """Deletes all user data JSON files after confirmation."""
+        """Deletes all user accounts from the store after confirmation."""
         confirm = messagebox.askyesno("Confirm", "This will delete ALL user accounts. Continue?")
         if confirm:
-            if os.path.exists(USER_DATA_DIR):
-                shutil.rmtree(USER_DATA_DIR)  # delete folder and contents
-                os.makedirs(USER_DATA_DIR)    # recreate empty folder
+            # the store is empty right away; old files are removed in the background
+            self.watch_purge(self.store.clear(), "all accounts")
+            self.usernames.clear()
+            self.leaderboard = None
             messagebox.showinfo("Reset Complete", "All user data has been deleted.")
+            # the logged-in account is gone too
+            self.init_login_screen()
+
+    def reset_accounts(self, usernames, what):
+        """Deletes some accounts; their data is removed in the background."""
+        self.watch_purge(self.store.delete_users(usernames), what)
+        self.usernames.discard(usernames)
+        self.leaderboard = None
+        if self.current_username in usernames:
+            self.init_login_screen()
+        else:
+            self.switch_tab("Settings")
+
+    def reset_user(self, username):
+        """Deletes one account after confirmation (Settings → Reset)."""
+        if messagebox.askyesno("Confirm", f"Delete the account '{username}'?"):
+            self.reset_accounts([username], username)
+
+    def reset_inactive_users(self):
+        """Deletes every account with no activity for a chosen number of days."""
+        days = simpledialog.askinteger("Reset Inactive Accounts",
+                                       "Delete accounts inactive for how many days?",
+                                       initialvalue=INACTIVE_RESET_DAYS, minvalue=1)
+        if days is None:
+            return
+        names = self.store.inactive_users(days)
+        if not names:
+            messagebox.showinfo("Reset Inactive Accounts", f"No accounts inactive for {days} days.")
+            return
+        if messagebox.askyesno("Confirm", f"Delete {len(names)} accounts inactive for {days} days?"):
+            self.reset_accounts(names, f"{len(names)} inactive accounts")
+
+    def watch_purge(self, purge, what):
+        """Shows a background delete's progress in purge_status until it finishes."""
+        if purge is None or purge.done():
+            self.purge_status.set(f"Deleted {what}.")
+            return
+        removed, total = purge.progress()
+        self.purge_status.set(f"Deleting {what}… {removed:,} / {total or 0:,}")
+        self.root.after(200, lambda: self.watch_purge(purge, what))
+
+    def repair_store(self):
+        """Checks every stored record and restores damaged ones from the backup."""
+        problems = self.store.check_integrity()
+        if not problems:
+            messagebox.showinfo("Check Store", "Every stored record is intact.")
+            return
+        listing = "\n".join(f"{user or '-'}: {detail}" for user, _, detail in problems[:20])
+        if messagebox.askyesno("Check Store", f"{len(problems)} problem(s) found:\n{listing}\n\n"
+                                              "Restore the damaged records from the backup?"):
+            actions = self.store.repair(problems)
+            messagebox.showinfo("Check Store", "\n".join(f"{user or '-'}: {action}"
+                                                         for user, action in actions[:20]))
+            self.switch_tab("Settings")
+
+
 
 
 
+    def logout(self):
+        """Writes out any pending changes and returns to the login screen."""
+        try:
+            self.store.flush()
+        except OSError as e:
+            # stay logged in: the changes are still queued and retried in the background
+            messagebox.showerror("Save Failed", str(e))
+            return
+        # other accounts may change before the next login; rebuild the ranking then
+        self.leaderboard = None
+        self.init_login_screen()
 
+    def on_close(self):
+        """Flushes pending writes and shuts the store down before the window closes."""
+        try:
+            self.store.close()
+        except OSError as e:
+            messagebox.showerror("Save Failed", str(e))
+        self.usernames.save()
+        self.provider.close()
+        self.market.close()
+        self.root.destroy()
 
     def load_image(self, path, size):
         """Loads and resizes an image from a file path using PIL. Returns a Tkinter-compatible PhotoImage."""
@@ -123,29 +3519,16 @@ class CryptoSimApp:
             return None
         
 
-    def user_data_path(self, username=None):
-        """Constructs the path to the user data JSON file for a given or current user."""
-        u = username or self.current_username
-        return os.path.join(USER_DATA_DIR, f"{u}.json")
-
     def load_user_data(self, username):
-        """Loads and parses user data from a JSON file. Returns None if invalid."""
-        path = self.user_data_path(username)
-        if not os.path.exists(path):
-            return None
-        try:
-            with open(path, "r") as f:
-                return json.load(f)
-        except (json.JSONDecodeError, IOError):
-            # file is missing, empty, or corrupted
-            return None
+        """Loads a user's account (no activity) from the store. Returns None if missing or invalid."""
+        return self.store.load_account(username)
 
     def save_user_data(self):
-        """Saves the current user's data to their JSON file (balance, holdings, activity)."""
+        """Saves the current user's data to the store (balance, holdings, activity)."""
         # Strip out PhotoImage objects — just keep desc & color
         serialized_activity = [
             {"desc": desc, "color": color}
-            for icon, desc, color in self.activity
+            for icon, desc, color in self.recent_activity()
         ]
 
         data = {
@@ -153,47 +3536,142 @@ class CryptoSimApp:
             "password": self.current_password,
             "balance":   self.current_balance,
             "holdings":  self.holdings,
-            "activity":  serialized_activity
+            "activity":  serialized_activity,
+            "schema":    SCHEMA_VERSION,
         }
-        with open(self.user_data_path(), "w") as f:
-            json.dump(data, f, indent=2)
+        self.store.save(data)
+        if self.leaderboard is not None:
+            self.leaderboard.update(self.current_username, self.current_balance, self.holdings)
+
+    def recent_activity(self):
+        """
+        Returns the (icon, desc, color) rows for the Activity panel, fetching the newest
+        ACTIVITY_LIMIT items from the store the first time they're needed after login.
+        """
+        if self.activity is None:
+            self.activity = [
+                (self.usd_icon, item["desc"], item["color"])
+                for item in self.store.activity_page(self.current_username, 0, ACTIVITY_LIMIT)
+            ]
+        return self.activity
+
+    def push_activity(self, icon, desc, color):
+        """Adds an item to the top of the Activity panel, keeping the newest ACTIVITY_LIMIT."""
+        activity = self.recent_activity()
+        activity.insert(0, (icon, desc, color))
+        del activity[ACTIVITY_LIMIT:]
+
+    def record_event(self, event):
+        """Persists a single account event for the current user (see apply_event)."""
+        self.store.append_event(self.current_username, event)
+        if self.leaderboard is not None:
+            self.leaderboard.apply_event(self.current_username, event)
+
+    def coin_prices(self):
+        """Returns { symbol: USD price } from the current QuoteBook."""
+        return self.prices.get().prices
+
+    def get_leaderboard(self):
+        """
+        Returns the LeaderboardIndex, building it on first use from the columnar balance
+        snapshot if nothing was written since it was built, else straight from the store.
+        """
+        if self.leaderboard is None:
+            quotes = self.prices.get()
+            prices = quotes.prices
+            age = self.balance_snapshot.age()
+            modified = self.store.last_modified()
+            current = age is not None and modified is not None and modified <= time.time() - age
+            snap = self.balance_snapshot.read(quotes) if current else None
+            if snap is None:
+                self.leaderboard = LeaderboardIndex(self.store.load_portfolios(), prices)
+            else:
+                portfolios, worth = snap
+                self.leaderboard = LeaderboardIndex(portfolios, prices, worth)
+        return self.leaderboard
+
+    def refresh_balance_snapshot(self):
+        """Rebuilds the columnar balance snapshot on a worker thread, then reschedules itself."""
+        age = self.balance_snapshot.age()
+        if not self._snapshot_building and (age is None or age >= BALANCE_SNAPSHOT_INTERVAL):
+            self._snapshot_building = True
+
+            def build():
+                """Runs off the Tk thread: one pass over the store, one file write."""
+                try:
+                    started = time.time()
+                    self.balance_snapshot.build(self.store.load_portfolios(), built_at=started)
+                except Exception as e:
+                    print(f"Failed to build balance snapshot: {e}")
+                finally:
+                    self._snapshot_building = False
+
+            threading.Thread(target=build, name="balance-snapshot", daemon=True).start()
+        self.root.after(BALANCE_SNAPSHOT_INTERVAL * 1000, self.refresh_balance_snapshot)
 
 
     def fetch_coin_data(self):
-        """Centralized fetch for Buy/Sell coin metadata (same API your tab uses)."""
-        try:
-            response = requests.get(
-                'https://data-api.coindesk.com/asset/v2/metadata',
-                params={
-                    "asset_lookup_priority": "SYMBOL",
-                    "quote_asset": "USD",
-                    "asset_language": "en-US",
-                    "assets": "BTC,ETH,SOL,USDT,XRP,BNB,DOGE,ADA,SHIB,TRX,LINK,AVAX",
-                    "groups": "ID,PRICE,MKT_CAP,CHANGE,BASIC"
-                },
-                headers={"Content-type": "application/json; charset=UTF-8"}
-            )
-            data = response.json()
-            return list(data['Data'].values())
-        except Exception as e:
-            print(f"Failed to fetch coin data: {e}")
-            return []
+        """Returns the Buy/Sell coin metadata from the price cache, without blocking."""
+        self.prices_seen, self.quotes = self.prices.snapshot()
+        return self.quotes.coins
+
+    def queue_price_deltas(self, changes):
+        """PriceCache subscriber: stashes changed quotes for watch_prices (any thread)."""
+        with self._deltas_lock:
+            self.price_deltas.update(changes)
+
+    def bind_price(self, label, symbol, format):
+        """
+        Registers a label that shows symbol's quote: when it changes, the label is
+        reconfigured in place with format(coin) (a dict of Label options).
+        """
+        self.price_labels.setdefault(symbol, []).append((label, format))
+        return label
+
+    def update_price_labels(self, changes):
+        """Reconfigures the bound labels of the changed symbols, dropping destroyed ones."""
+        for symbol, coin in changes.items():
+            bound = [(label, format) for label, format in self.price_labels.get(symbol, ())
+                     if label.winfo_exists()]
+            for label, format in bound:
+                label.config(**format(coin))
+            if bound:
+                self.price_labels[symbol] = bound
+            else:
+                self.price_labels.pop(symbol, None)
+
+    def watch_prices(self):
+        """
+        Runs on the Tk thread every PRICE_POLL_MS: picks up coin data fetched in the
+        background and updates the labels bound to the symbols that changed. If the
+        current tab was drawn before any prices were known it is drawn again instead.
+        """
+        self.root.after(PRICE_POLL_MS, self.watch_prices)
+        with self._deltas_lock:
+            changes, self.price_deltas = self.price_deltas, {}
+        version, quotes = self.prices.snapshot()
+        if version == self.prices_seen or not hasattr(self, "cached_coins_data"):
+            # drained deltas are applied whatever happens; a refresh can land between the
+            # drain and the snapshot, and its version is then already seen next time
+            self.update_price_labels(changes)
+            return
+        self.prices_seen, self.quotes = version, quotes
+        # keep the current search/sort order, just with the new numbers
+        self.displayed_coins = ([quotes.by_symbol[c["SYMBOL"]] for c in self.displayed_coins
+                                 if c["SYMBOL"] in quotes]
+                                if self.displayed_coins else list(quotes.coins))
+        self.cached_coins_data = quotes.coins
+        if self.leaderboard is not None:
+            self.leaderboard.set_prices(self.coin_prices())
+        if self.tab_awaits_prices and self.current_tab and self.content.winfo_exists():
+            self.switch_tab(self.current_tab)
+        else:
+            self.update_price_labels(changes)
 
 
     def load_all_users_data(self):
-        """Returns a dict { username: user_data_dict } for every JSON in user_data/."""
-        all_users = {}
-        for fn in os.listdir(USER_DATA_DIR):
-            if not fn.endswith(".json"):
-                continue
-            user = fn[:-5]
-            path = os.path.join(USER_DATA_DIR, fn)
-            try:
-                with open(path, "r") as f:
-                    all_users[user] = json.load(f)
-            except (FileNotFoundError, json.JSONDecodeError):
-                continue
-        return all_users
+        """Returns a dict { username: user_data_dict } for every stored user."""
+        return self.store.load_all()
 
     def get_coin_icon(self, symbol, size=(30,30)):
         """
@@ -258,7 +3736,11 @@ class CryptoSimApp:
             messagebox.showerror("Error", "Please fill in all fields.")
             return
 
-        if os.path.exists(self.user_data_path(username)):
+        if username.startswith(RESERVED_PREFIX):
+            messagebox.showerror("Error", f"Usernames can't start with \"{RESERVED_PREFIX}\".")
+            return
+
+        if username in self.usernames:
             messagebox.showerror("Error", "Username already exists.")
             return
 
@@ -269,6 +3751,7 @@ class CryptoSimApp:
         self.holdings         = {}
         self.activity         = []
         self.save_user_data()
+        self.usernames.add(username)
 
         messagebox.showinfo("Success", "Account registered successfully!")
         self.init_login_screen()
@@ -280,7 +3763,8 @@ class CryptoSimApp:
         username = self.entries["Username"].get().strip()
         password = self.entries["Password"].get().strip()
 
-        data = self.load_user_data(username)
+        # unknown names are turned away without reading the store
+        data = self.load_user_data(username) if username in self.usernames else None
         if data is None or data.get("password") != password:
             messagebox.showerror("Login Failed", "Incorrect username or password.")
             return
@@ -291,12 +3775,9 @@ class CryptoSimApp:
         self.current_balance  = data.get("balance", 0.0)
         self.holdings         = data.get("holdings", {})
 
-        # rebuild activity tuples with your USD icon
-        raw_act = data.get("activity", [])
-        self.activity = [
-            (self.usd_icon, item["desc"], item["color"])
-            for item in raw_act
-        ]
+        # activity is fetched when the Activity panel first needs it (see recent_activity)
+        self.activity     = None
+        self.history_page = 0
 
         # proceed to dashboard
         self.init_dashboard(username)
@@ -337,11 +3818,9 @@ class CryptoSimApp:
 
         # record activity immediately and refresh
         desc = f"Deposited ${amount:.2f} USD"
-        self.activity.insert(0, (self.usd_icon, desc, "green"))
-        if len(self.activity) > 5: 
-            self.activity.pop()
+        self.push_activity(self.usd_icon, desc, "green")
         self.switch_tab("Homepage")
-        self.save_user_data()
+        self.record_event({"type": "deposit", "cash": amount, "desc": desc, "color": "green"})
 
         self.update_balance_display()
 
@@ -358,11 +3837,9 @@ class CryptoSimApp:
 
         # record activity immediately and refresh
         desc = f"Withdrew ${amount:.2f} USD"
-        self.activity.insert(0, (self.usd_icon, desc, "red"))
-        if len(self.activity) > 5:
-            self.activity.pop()
+        self.push_activity(self.usd_icon, desc, "red")
         self.switch_tab("Homepage")
-        self.save_user_data()
+        self.record_event({"type": "withdraw", "cash": -amount, "desc": desc, "color": "red"})
 
         self.update_balance_display()
 
@@ -422,6 +3899,8 @@ class CryptoSimApp:
         self.clear_window()
         self.cached_coins_data = self.fetch_coin_data()
         self.displayed_coins   = list(self.cached_coins_data)
+        if self.leaderboard is not None:
+            self.leaderboard.set_prices(self.coin_prices())
         sidebar = tk.Frame(self.root, bg=self.white_color, width=300)
         sidebar.pack(side="left", fill="y")
         sidebar.pack_propagate(False)
@@ -441,8 +3920,11 @@ class CryptoSimApp:
         topbar.pack_propagate(False)
 
         logout_btn = tk.Button(topbar, text="Logout", font=("Helvetica", 14), bg=self.white_color, relief="flat",
-                            command=self.init_login_screen)
+                            command=self.logout)
         logout_btn.pack(side="right", padx=10, pady=10)
+        # only says something when the prices shown aren't fresh (e.g. CoinDesk is down)
+        tk.Label(topbar, text=self.prices.status(), font=self.text_font,
+                 bg=self.white_color, fg=self.gray_text_color).pack(side="left", padx=10)
 
         self.content = tk.Frame(main_area, bg="#f3f3f3")
         self.content.pack(fill="both", expand=True)
@@ -453,6 +3935,12 @@ class CryptoSimApp:
             """TODO: Add description."""
             for widget in self.content.winfo_children():
                 widget.destroy()
+            self.price_labels = {}
+            self.current_tab = tab_name
+            # these tabs show prices; drawn before the first fetch they're placeholders
+            # that watch_prices redraws once the data is in
+            self.tab_awaits_prices = (not self.cached_coins_data
+                                      and tab_name in ("Homepage", "Buy/Sell", "Leaderboard"))
             for name, btn in tab_buttons.items():
                 btn.config(bg=self.highlight_color if name == tab_name else self.white_color,
                         fg="white" if name == tab_name else self.gray_text_color)
@@ -501,22 +3989,23 @@ class CryptoSimApp:
                 tk.Label(activity_header, text="Activity", font=("Helvetica", 12, "bold"), bg="white").pack(side="left")
                 see_all_label = tk.Label(activity_header, text="See All", font=("Helvetica", 10), fg="blue", bg="white", cursor="hand2")
                 see_all_label.pack(side="right")
-                see_all_label.bind("<Button-1>", lambda e: switch_tab("Profile"))
-
-                                # Activity List
-                # clear any old rows (keep the header intact)
-                                # Activity List
-                # clear old rows (keep the header intact)
-                for child in activity_frame.winfo_children()[1:]:
-                    child.destroy()
-
-                if not self.activity:
-                    tk.Label(activity_frame,
-                             text="No recent activity.",
-                             font=self.text_font, bg="white")\
-                      .pack(pady=20)
-                else:
-                    for icon, desc, col in self.activity:
+                see_all_label.bind("<Button-1>", lambda e: self.show_history_page(0))
+
+                # Activity List
+                def fill_activity():
+                    if not activity_frame.winfo_exists():
+                        return  # tab was switched before the activity arrived
+                    # clear old rows (keep the header intact)
+                    for child in activity_frame.winfo_children()[1:]:
+                        child.destroy()
+
+                    activity = self.recent_activity()
+                    if not activity:
+                        tk.Label(activity_frame,
+                                 text="No recent activity.",
+                                 font=self.text_font, bg="white")\
+                          .pack(pady=20)
+                    for icon, desc, col in activity:
                         row = tk.Frame(activity_frame, bg="white")
                         row.pack(fill="x", padx=10, pady=5)
                         # icon (fallback to 🪙 if None)
@@ -532,6 +4021,14 @@ class CryptoSimApp:
                                  fg=col, bg="white")\
                           .pack(side="left", padx=5)
 
+                if self.activity is None:
+                    # first view after login: draw the dashboard now, fetch activity once idle
+                    tk.Label(activity_frame, text="Loading…",
+                             font=self.text_font, bg="white").pack(pady=20)
+                    self.root.after_idle(fill_activity)
+                else:
+                    fill_activity()
+
 
                 
 
@@ -608,9 +4105,9 @@ class CryptoSimApp:
                 else:
                     for i, (sym, amt) in enumerate(self.holdings.items(), start=1):
                         # lookup price
-                        price = next((c['PRICE_USD'] for c in self.cached_coins_data if c['SYMBOL']==sym), 0)
+                        price = self.quotes.price(sym)
                         total_val = price * amt
-                        coin_data = next((c for c in self.cached_coins_data if c['SYMBOL'] == sym), {})
+                        coin_data = self.quotes.quote(sym)
                         # Icon + symbol
                         info_frame = tk.Frame(asset_frame, bg="white")
                         info_frame.grid(row=i, column=0, sticky="w", padx=10, pady=5)
@@ -625,9 +4122,13 @@ class CryptoSimApp:
                         tk.Label(info_frame, text=f"{sym}", font=("Helvetica",11,"bold"), bg="white")\
                         .pack(side="left", padx=(5,0))
 
-                        # Total USD value
-                        tk.Label(asset_frame, text=f"${total_val:,.2f}", font=("Helvetica",11), bg="white")\
-                        .grid(row=i, column=1, sticky="w", padx=10)
+                        # Total USD value ("…" until the first prices arrive)
+                        value_lbl = tk.Label(asset_frame,
+                                 text=f"${total_val:,.2f}" if coin_data or not self.tab_awaits_prices else "…",
+                                 font=("Helvetica",11), bg="white")
+                        value_lbl.grid(row=i, column=1, sticky="w", padx=10)
+                        self.bind_price(value_lbl, sym, lambda c, amt=amt: {
+                            "text": f"${float(c.get('PRICE_USD') or 0) * amt:,.2f}"})
 
                         # Amount
                         tk.Label(asset_frame, text=f"{amt:.6f}", font=("Helvetica",11), bg="white")\
@@ -672,7 +4173,7 @@ class CryptoSimApp:
                                 label="Delete",
                                 command=lambda s=symbol: (
                                     self.holdings.pop(s, None),
-                                    self.save_user_data(),
+                                    self.record_event({"type": "remove_holding", "symbol": s}),
                                     self.switch_tab("Homepage")
                                 )
                             )
@@ -719,34 +4220,17 @@ class CryptoSimApp:
                 table_frame = tk.Frame(buy_sell_frame, bg="#f4f4f4")
                 table_frame.pack(fill="both", expand=True, padx=20, pady=20)
 
-                # Only fetch & cache once
-                if not hasattr(self, 'cached_coins_data'):
-                    try:
-                        response = requests.get(
-                            'https://data-api.coindesk.com/asset/v2/metadata',
-                            params={
-                                "asset_lookup_priority": "SYMBOL",
-                                "quote_asset": "USD",
-                                "asset_language": "en-US",
-                                "assets": "BTC,ETH,SOL,USDT,XRP,BNB,DOGE,ADA,SHIB,TRX,LINK,AVAX",
-                                "groups": "ID,PRICE,MKT_CAP,CHANGE,BASIC"
-                            },
-                            headers={"Content-type": "application/json; charset=UTF-8"}
-                        )
-                        data = response.json()
-                        self.cached_coins_data = list(data['Data'].values())
-                    except Exception as e:
-                        self.cached_coins_data = []
-                        tk.Label(
-                            table_frame,
-                            text=f"Failed to load data: {e}",
-                            font=("Helvetica", 10),
-                            bg="#f4f4f4", fg="red"
-                        ).grid(row=1, column=0, columnspan=6)
-                        return
-
-                    # ← seed display list only on first fetch
-                    self.displayed_coins = list(self.cached_coins_data)
+                # prices come from the cache init_dashboard read; nothing to show until
+                # the first fetch has landed
+                if not self.cached_coins_data:
+                    error = self.prices.last_error
+                    tk.Label(
+                        table_frame,
+                        text=f"Failed to load data: {error}" if error else "Loading market data…",
+                        font=("Helvetica", 10),
+                        bg="#f4f4f4", fg="red" if error else self.gray_text_color
+                    ).grid(row=1, column=0, columnspan=6)
+                    return
 
                 # safety: if displayed_coins for some reason didn't get set
                 if not hasattr(self, 'displayed_coins'):
@@ -762,12 +4246,12 @@ class CryptoSimApp:
 
                 # DATA ROWS
                 # DATA ROWS
-                for i, coin in enumerate(self.displayed_coins, start=1):
+                for i, coin in enumerate(self.displayed_coins[:MARKET_TABLE_ROWS], start=1):
                     name   = coin.get('NAME','')
                     symbol = coin.get('SYMBOL','')
-                    price  = f"${coin.get('PRICE_USD',0):,.2f} USD"
-                    mcap   = f"{coin.get('TOTAL_MKT_CAP_USD',0):,.2f}"
-                    chg    = float(coin.get('SPOT_MOVING_24_HOUR_CHANGE_PERCENTAGE_USD',0))
+                    price  = f"${float(coin.get('PRICE_USD') or 0):,.2f} USD"
+                    mcap   = f"{float(coin.get('TOTAL_MKT_CAP_USD') or 0):,.2f}"
+                    chg    = float(coin.get('SPOT_MOVING_24_HOUR_CHANGE_PERCENTAGE_USD') or 0)
                     color  = "green" if chg >= 0 else "red"
 
                     # — LOAD ICON —
@@ -794,12 +4278,18 @@ class CryptoSimApp:
                     # — TEXT COLUMNS —
                     tk.Label(card, text=f"{name} ({symbol})", font=("Helvetica",10), bg="white")\
                     .grid(row=0, column=1, sticky="w", padx=10)
-                    tk.Label(card, text=price, font=("Helvetica",10), bg="white")\
-                    .grid(row=0, column=2, sticky="w", padx=10)
-                    tk.Label(card, text=mcap, font=("Helvetica",10), bg="white")\
-                    .grid(row=0, column=3, sticky="w", padx=10)
-                    tk.Label(card, text=f"{chg:.2f}%", font=("Helvetica",10), fg=color, bg="white")\
-                    .grid(row=0, column=4, sticky="w", padx=10)
+                    price_lbl = tk.Label(card, text=price, font=("Helvetica",10), bg="white")
+                    price_lbl.grid(row=0, column=2, sticky="w", padx=10)
+                    mcap_lbl = tk.Label(card, text=mcap, font=("Helvetica",10), bg="white")
+                    mcap_lbl.grid(row=0, column=3, sticky="w", padx=10)
+                    chg_lbl = tk.Label(card, text=f"{chg:.2f}%", font=("Helvetica",10), fg=color, bg="white")
+                    chg_lbl.grid(row=0, column=4, sticky="w", padx=10)
+                    # live updates rewrite these three labels in place
+                    self.bind_price(price_lbl, symbol, lambda c: {
+                        "text": f"${float(c.get('PRICE_USD') or 0):,.2f} USD"})
+                    self.bind_price(mcap_lbl, symbol, lambda c: {
+                        "text": f"{float(c.get('TOTAL_MKT_CAP_USD') or 0):,.2f}"})
+                    self.bind_price(chg_lbl, symbol, change_format)
 
                     # — BUY BUTTON —
                     tk.Button(
@@ -813,6 +4303,48 @@ class CryptoSimApp:
                         })
                     ).grid(row=0, column=5, sticky="e", padx=10)
 
+                if len(self.displayed_coins) > MARKET_TABLE_ROWS:
+                    tk.Label(table_frame,
+                             text=f"Showing {MARKET_TABLE_ROWS} of {len(self.displayed_coins):,} assets – "
+                                  "search to find the others",
+                             font=self.text_font, bg="#f4f4f4", fg=self.gray_text_color)\
+                        .grid(row=MARKET_TABLE_ROWS + 1, column=0, columnspan=6, pady=5)
+
+            elif tab_name == "Profile":
+                tk.Label(self.content,
+                         text="Activity History",
+                         font=("Helvetica", 16, "bold"),
+                         bg="#f3f3f3")\
+                    .pack(pady=(10, 5), padx=10, anchor="w")
+
+                total = self.store.activity_count(self.current_username)
+                pages = max(1, -(-total // ACTIVITY_PAGE_SIZE))
+                self.history_page = min(self.history_page, pages - 1)
+                items = self.store.activity_page(self.current_username, self.history_page)
+
+                history_frame = tk.Frame(self.content, bg="white", bd=1, relief="groove")
+                history_frame.pack(fill="x", padx=20, pady=5)
+                if not items:
+                    tk.Label(history_frame, text="No activity yet.",
+                             font=self.text_font, bg="white").pack(pady=20)
+                for item in items:
+                    tk.Label(history_frame, text=item["desc"], font=("Helvetica", 10),
+                             fg=item["color"], bg="white", anchor="w")\
+                        .pack(fill="x", padx=10, pady=2)
+
+                nav = tk.Frame(self.content, bg="#f3f3f3")
+                nav.pack(pady=10)
+                tk.Button(nav, text="← Newer", font=self.text_font, relief="flat",
+                          state="normal" if self.history_page > 0 else "disabled",
+                          command=lambda: self.show_history_page(self.history_page - 1))\
+                    .pack(side="left", padx=10)
+                tk.Label(nav, text=f"Page {self.history_page + 1} of {pages}",
+                         font=self.text_font, bg="#f3f3f3").pack(side="left")
+                tk.Button(nav, text="Older →", font=self.text_font, relief="flat",
+                          state="normal" if self.history_page < pages - 1 else "disabled",
+                          command=lambda: self.show_history_page(self.history_page + 1))\
+                    .pack(side="left", padx=10)
+
             elif tab_name == "Leaderboard":
                 # header
                 tk.Label(self.content,
@@ -821,35 +4353,28 @@ class CryptoSimApp:
                             bg="#f3f3f3")\
                     .pack(pady=(10, 5), padx=10, anchor="w")
 
-                # fetch all users
-                users = self.load_all_users_data()
-
-                # compute net worths
-                networths = []
-                for username, data in users.items():
-                    bal = data.get("balance", 0.0)
-                    holdings = data.get("holdings", {})
-                    total_assets = 0.0
-                    for sym, amt in holdings.items():
-                        price = next(
-                            (c["PRICE_USD"] for c in self.cached_coins_data
-                                if c["SYMBOL"] == sym),
-                            0.0
-                        )
-                        total_assets += price * amt
-                    networths.append((username, bal + total_assets))
-
-                # sort descending by net worth
-                networths.sort(key=lambda x: x[1], reverse=True)
+                if self.tab_awaits_prices:
+                    tk.Label(self.content, text="Loading market data… (ranked by cash for now)",
+                             font=self.text_font, bg="#f3f3f3", fg=self.gray_text_color)\
+                        .pack(anchor="w", padx=20)
+                board = self.get_leaderboard()
 
                 # display rankings
-                for rank, (username, nw) in enumerate(networths, start=1):
+                for rank, (username, nw) in enumerate(board.top(LEADERBOARD_SIZE), start=1):
                     tk.Label(self.content,
                                 text=f"{rank}. {username}: ${nw:.2f} USD",
                                 font=self.text_font,
                                 bg="#f3f3f3")\
                         .pack(anchor="w", padx=20, pady=2)
 
+                my_rank = board.rank(self.current_username)
+                if my_rank is not None:
+                    tk.Label(self.content,
+                                text=f"Your rank: #{my_rank} of {len(board)}",
+                                font=("Helvetica", 10, "bold"),
+                                bg="#f3f3f3")\
+                        .pack(anchor="w", padx=20, pady=(10, 2))
+
                 # re‑highlight the button
                 for name, btn in tab_buttons.items():
                     btn.config(bg=self.highlight_color if name=="Leaderboard"
@@ -883,6 +4408,27 @@ class CryptoSimApp:
 
                 reset_all_button = tk.Button(self.content, text="Reset All Accounts", command=self.clear_all_user_data)
                 reset_all_button.pack(pady=10)
+                tk.Button(self.content, text="Reset Inactive Accounts",
+                          command=self.reset_inactive_users).pack()
+                tk.Label(self.content, textvariable=self.purge_status,
+                         font=self.text_font, bg="#f3f3f3", fg=self.gray_text_color).pack()
+                unreadable = self.store.unreadable_users()
+                if unreadable:
+                    tk.Label(self.content,
+                             text=f"⚠ {len(unreadable)} account(s) could not be read: "
+                                  + ", ".join(unreadable[:5]) + ("…" if len(unreadable) > 5 else ""),
+                             font=self.text_font, bg="#f3f3f3", fg="red").pack()
+                tk.Button(self.content, text="Check & Repair Store",
+                          command=self.repair_store).pack(pady=(5, 0))
+                stats = self.market.stats()
+                if stats["requests"]:
+                    latency = (f", p50 {stats['p50_ms']:.0f} ms, p95 {stats['p95_ms']:.0f} ms"
+                               if stats["p50_ms"] is not None else "")
+                    tk.Label(self.content,
+                             text=f"Market data: {stats['requests']} requests, "
+                                  f"{stats['failure_rate']:.0%} failed, "
+                                  f"{stats['retries']} retries{latency}",
+                             font=self.text_font, bg="#f3f3f3", fg=self.gray_text_color).pack()
 
 
                 canvas = tk.Canvas(self.content, bg="#f3f3f3", highlightthickness=0)
@@ -918,6 +4464,9 @@ class CryptoSimApp:
                         .grid(row=i, column=0, sticky="w", padx=5, pady=2)
                         tk.Label(lf, text=val,    font=self.text_font, bg="white", wraplength=400, justify="left")\
                         .grid(row=i, column=1, sticky="w", padx=5, pady=2)
+                    tk.Button(lf, text="Reset", font=self.text_font,
+                              command=lambda name=user: self.reset_user(name))\
+                    .grid(row=0, column=2, sticky="ne", padx=5, pady=2)
 
                 # re‑highlight the Settings button
                 for name, btn in tab_buttons.items():
@@ -949,11 +4498,17 @@ class CryptoSimApp:
         switch_tab("Homepage")
 
 
+    def show_history_page(self, page):
+        """Opens the activity history (Profile tab) at the given page, 0 = newest."""
+        self.history_page = max(0, page)
+        self.switch_tab("Profile")
+
     def init_coin_detail(self, coin):
         """Displays a detailed coin view with buy/sell options and live conversion."""
         # 1) clear the content area
         for w in self.content.winfo_children():
             w.destroy()
+        self.price_labels = {}
 
         # 2) back button + header (icon, name, price, change)
         back_btn = tk.Button(
@@ -982,11 +4537,18 @@ class CryptoSimApp:
         tk.Label(header, text=f"({coin['symbol']})", font=self.text_font,
                 fg=self.gray_text_color, bg=self.white_color)\
         .pack(side="left", padx=(5,0))
-        tk.Label(header, text=f"${coin['price']:.2f} USD", font=self.title_font,
-                bg=self.white_color).pack(side="right", padx=10)
+        price_lbl = tk.Label(header, text=f"${coin['price']:.2f} USD", font=self.title_font,
+                bg=self.white_color)
+        price_lbl.pack(side="right", padx=10)
         col = "green" if coin["change"]>=0 else "red"
-        tk.Label(header, text=f"{coin['change']:+.2f}%", font=self.text_font,
-                fg=col, bg=self.white_color).pack(side="right")
+        change_lbl = tk.Label(header, text=f"{coin['change']:+.2f}%", font=self.text_font,
+                fg=col, bg=self.white_color)
+        change_lbl.pack(side="right")
+
+        # live quote for the header; the form reads the latest price when it's drawn
+        self.bind_price(price_lbl, coin["symbol"], lambda c: {
+            "text": f"${float(c.get('PRICE_USD') or 0):.2f} USD"})
+        self.bind_price(change_lbl, coin["symbol"], lambda c: change_format(c, "{:+.2f}%"))
 
         # 3) Buy/Sell toggle
         state = tk.StringVar(value="Buy")
@@ -1025,8 +4587,8 @@ class CryptoSimApp:
                 w.destroy()
             style()
 
-            price = coin["price"]
             sym   = coin["symbol"]
+            price = self.prices.get().price(sym) or coin["price"]
 
             # --- You Pay row ---
             r1 = tk.Frame(form_frame, bg=self.white_color)
@@ -1157,6 +4719,7 @@ class CryptoSimApp:
                 return messagebox.showerror("Error", "Insufficient USD balance.")
             self.current_balance -= pay_amt
             self.holdings[sym] = self.holdings.get(sym, 0) + qty
+            cash, qty_delta = -pay_amt, qty
             result_msg = f"Bought {qty:.6f} {sym} for ${pay_amt:.2f} USD"
         else:
             owned = self.holdings.get(sym, 0)
@@ -1164,6 +4727,7 @@ class CryptoSimApp:
                 return messagebox.showerror("Error", f"Not enough {sym} to sell.")
             self.holdings[sym] -= qty
             self.current_balance += pay_amt
+            cash, qty_delta = pay_amt, -qty
             result_msg = f"Sold {qty:.6f} {sym} for ${pay_amt:.2f} USD"
 
                 # record activity
@@ -1171,17 +4735,10 @@ class CryptoSimApp:
         color = "red" if action == "Buy" else "green"
         icon  = self.get_coin_icon(sym, (16,16))
         msg   = result_msg if len(result_msg) <= 30 else result_msg[:27] + "…"
-        self.activity.insert(0, (icon, msg, color))
-        if len(self.activity) > 5:
-            self.activity.pop()
+        self.push_activity(icon, msg, color)
         self.switch_tab("Homepage")
-        self.save_user_data()
-
-
-        # rebuild dashboard & show balance
-        self.switch_to_buy_sell()
-        self.update_balance_display()
-
+        self.record_event({"type": "trade", "cash": cash, "symbol": sym, "qty": qty_delta,
+                           "desc": msg, "color": color})
 
 
         # 1) rebuild dashboard (this recreates balance_label)
@@ -1245,7 +4802,331 @@ class CryptoSimApp:
 
 
 
-if __name__ == "__main__":
+def _last_exported(path):
+    """
+    Returns the username on the last complete line of an export file, cutting off a
+    partial line left by an interrupted run; None if there is no complete line.
+    """
+    with open(path, "rb+") as f:
+        end = f.seek(0, os.SEEK_END)
+        pos, tail = end, b""
+        while pos > 0:
+            step = min(64 * 1024, pos)
+            pos -= step
+            f.seek(pos)
+            tail = f.read(step) + tail
+            cut = tail.rfind(b"\n")
+            if cut >= 0:
+                f.truncate(pos + cut + 1)
+                start = tail.rfind(b"\n", 0, cut) + 1
+                if start == 0 and pos > 0:
+                    continue    # the last line started before this chunk; keep reading
+                return json.loads(tail[start:cut])["username"]
+        f.truncate(0)
+        return None
+
+
+def export_users(store, path, resume=False, progress=None):
+    """
+    Streams every account to path as newline-delimited JSON, one record per line in
+    username order, with the user's full activity history (newest first).
+
+    Memory use is one record at a time. With resume, an existing file is continued
+    after its last complete line. Returns the number of records written.
+    """
+    after = _last_exported(path) if resume and os.path.exists(path) else None
+    written = 0
+    with open(path, "ab" if after is not None else "wb") as out:
+        for record in store.iter_users(after):
+            username = record["username"]
+            record.pop("_gseq", None)
+            record["activity"] = store.activity_page(username, 0, store.activity_count(username))
+            out.write(json.dumps(record, separators=(",", ":")).encode("utf-8") + b"\n")
+            written += 1
+            if progress and written % EXPORT_PAGE == 0:
+                progress(written)
+    if progress:
+        progress(written)
+    return written
+
+
+def import_users(store, path, resume=False, batch=IMPORT_BATCH, progress=None):
+    """
+    Reads an export_users file and writes its records through store.write_batch, `batch`
+    records at a time (one transaction / group commit each).
+
+    The byte offset of the last committed batch is kept in "{path}.progress", so with
+    resume an interrupted import picks up where it stopped; the file is removed once
+    the import completes. Returns the number of records imported.
+    """
+    marker = path + ".progress"
+    offset = 0
+    if resume and os.path.exists(marker):
+        with open(marker) as f:
+            offset = int(f.read().strip() or 0)
+    imported, pending = 0, {}
+    with open(path, "rb") as src:
+        src.seek(offset)
+        for line in src:
+            offset += len(line)
+            if not line.strip():
+                continue
+            record = json.loads(line)
+            pending[record["username"]] = (record, [])
+            if len(pending) >= batch:
+                store.write_batch(pending)
+                imported += len(pending)
+                pending = {}
+                atomic_write(marker, str(offset).encode("ascii"), sync=False)
+                if progress:
+                    progress(imported)
+        if pending:
+            store.write_batch(pending)
+            imported += len(pending)
+    try:
+        os.remove(marker)
+    except FileNotFoundError:
+        pass
+    if progress:
+        progress(imported)
+    return imported
+
+
+def benchmark_record_formats(users=2000, holdings=8, activity=50):
+    """
+    Compares JSON and binary snapshots: save/load throughput and bytes on disk.
+
+    Writes `users` synthetic accounts through a JsonUserStore in each format (no fsync,
+    so the numbers are about the format rather than the disk) and prints a table.
+    """
+    import random
+    import tempfile
+
+    rng = random.Random(42)
+    symbols = ["BTC", "ETH", "SOL", "USDT", "XRP", "BNB", "DOGE", "ADA", "SHIB", "TRX", "LINK", "AVAX"]
+    records = [
+        {
+            "username": f"user{i:06d}",
+            "password": f"pw{i}",
+            "balance": rng.uniform(0, 1e6),
+            "holdings": {sym: rng.uniform(0, 100) for sym in rng.sample(symbols, holdings)},
+            "activity": [{"desc": f"Bought {rng.uniform(0, 5):.6f} BTC for ${rng.uniform(0, 1e4):.2f}…",
+                          "color": rng.choice(["red", "green"])} for _ in range(activity)],
+        }
+        for i in range(users)
+    ]
+
+    print(f"{'format':<8}{'save/s':>12}{'load/s':>12}{'bytes/user':>12}")
+    for binary in (False, True):
+        with tempfile.TemporaryDirectory() as tmp:
+            store = JsonUserStore(tmp, group_commit=False, binary=binary)
+            start = time.perf_counter()
+            for record in records:
+                store.save(record, sync=False)
+            save_s = time.perf_counter() - start
+
+            start = time.perf_counter()
+            for record in records:
+                store.load(record["username"])
+            load_s = time.perf_counter() - start
+
+            size = sum(e.stat().st_size for e in walk_user_files(tmp) if e.name.endswith(SNAPSHOT_EXTS))
+            print(f"{'binary' if binary else 'json':<8}{users / save_s:>12,.0f}"
+                  f"{users / load_s:>12,.0f}{size / users:>12,.0f}")
+
+
+def benchmark_bulk_load(users=100_000, max_workers=BULK_LOAD_WORKERS):
+    """
+    Times bulk_load_users on `users` synthetic accounts with 1, 2, 4, ... max_workers processes
+    (and, for comparison, as many threads).
+
+    Accounts are written straight into a sharded temp tree (every tenth with a short
+    journal), then the whole tree is parsed at each worker count; prints a table.
+    """
+    import random
+    import tempfile
+
+    rng = random.Random(42)
+    symbols = ["BTC", "ETH", "SOL", "USDT", "XRP", "BNB", "DOGE", "ADA", "SHIB", "TRX", "LINK", "AVAX"]
+    counts = [1]
+    while counts[-1] * 2 < max_workers:
+        counts.append(counts[-1] * 2)
+    if max_workers > 1:
+        counts.append(max_workers)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        jobs = []
+        for i in range(users):
+            username = f"user{i:06d}"
+            base = os.path.join(shard_dir(tmp, username), username)
+            os.makedirs(os.path.dirname(base), exist_ok=True)
+            record = {
+                "username": username,
+                "password": f"pw{i}",
+                "balance": rng.uniform(0, 1e6),
+                "holdings": {sym: rng.uniform(0, 100) for sym in rng.sample(symbols, 4)},
+                "activity": [{"desc": f"Deposited ${rng.uniform(0, 1e4):.2f}", "color": "green"}
+                             for _ in range(ACTIVITY_LIMIT)],
+            }
+            atomic_write(base + ".json", json.dumps(record).encode("utf-8"), sync=False)
+            journal = None
+            if i % 10 == 0:
+                journal = base + ".journal"
+                UserJournal(journal).extend([{"type": "deposit", "cash": 1.0,
+                                              "desc": "Deposited $1.00", "color": "green"}] * 5)
+            jobs.append((username, base + ".json", journal))
+
+        print(f"{'pool':<10}{'workers':>8}{'seconds':>10}{'users/s':>12}{'speedup':>9}")
+        baseline = None
+        for processes in (False, True):
+            for workers in counts:
+                start = time.perf_counter()
+                loaded = sum(1 for _, record in bulk_load_users(jobs, workers, processes=processes)
+                             if record is not None)
+                elapsed = time.perf_counter() - start
+                assert loaded == users
+                baseline = baseline or elapsed
+                print(f"{'processes' if processes else 'threads':<10}{workers:>8}{elapsed:>10.2f}"
+                      f"{users / elapsed:>12,.0f}{baseline / elapsed:>8.1f}x")
+
+
+def benchmark_market(fetches=50, provider=None):
+    """
+    Times `fetches` back-to-back fetches from the configured market data provider
+    (a ReplayProvider when CRYPTOSIM_MARKET_REPLAY is set, so this can run offline).
+    """
+    provider = provider or open_market_provider()
+    latencies, failures = [], 0
+    for _ in range(fetches):
+        start = time.perf_counter()
+        try:
+            provider.fetch()
+        except Exception as e:
+            failures += 1
+            print(f"fetch failed: {e}")
+            continue
+        latencies.append(time.perf_counter() - start)
+    provider.close()
+    latencies.sort()
+    print(f"{type(provider).__name__}: {fetches} fetches, {failures} failed")
+    if latencies:
+        pick = lambda q: latencies[min(len(latencies) - 1, int(q * len(latencies)))] * 1000
+        print(f"p50 {pick(0.5):.1f} ms  p95 {pick(0.95):.1f} ms  max {latencies[-1] * 1000:.1f} ms")
+
+
+def main(argv=None):
+    """Runs the GUI, or one of the maintenance commands when given on the command line."""
+    parser = argparse.ArgumentParser(description="CryptoSim trading simulator")
+    parser.add_argument("--migrate-sharded", action="store_true",
+                        help="move flat user_data/*.json accounts into hash-sharded directories")
+    parser.add_argument("--bench-formats", type=int, metavar="USERS", nargs="?", const=2000,
+                        help="benchmark JSON vs binary user snapshots and exit")
+    parser.add_argument("--bench-load", type=int, metavar="USERS", nargs="?", const=100_000,
+                        help="benchmark the parallel bulk loader from 1 to --workers threads "
+                             "and processes and exit")
+    parser.add_argument("--workers", type=int, default=BULK_LOAD_WORKERS,
+                        help=f"workers for --bench-load and --check-store "
+                             f"(default {BULK_LOAD_WORKERS})")
+    parser.add_argument("--export", metavar="FILE",
+                        help="write every account to FILE as newline-delimited JSON and exit")
+    parser.add_argument("--import", dest="import_path", metavar="FILE",
+                        help="add or replace the accounts in an --export FILE and exit")
+    parser.add_argument("--resume", action="store_true",
+                        help="continue an interrupted --export or --import")
+    parser.add_argument("--migrate-records", action="store_true",
+                        help=f"upgrade every user record to schema v{SCHEMA_VERSION} and exit")
+    parser.add_argument("--backup", action="store_true",
+                        help="write a consistent snapshot of every account to the backup and exit")
+    parser.add_argument("--check-store", action="store_true",
+                        help="verify every stored record's checksum and report problems")
+    parser.add_argument("--repair", action="store_true",
+                        help="with --check-store, restore damaged records from the backup")
+    parser.add_argument("--record-market", metavar="FILE",
+                        help="append live CoinDesk responses to FILE for CRYPTOSIM_MARKET_REPLAY")
+    parser.add_argument("--samples", type=int, default=1,
+                        help="responses --record-market records, PRICE_TTL seconds apart")
+    parser.add_argument("--bench-market", type=int, metavar="FETCHES", nargs="?", const=50,
+                        help="time fetches from the configured market data provider and exit")
+    args = parser.parse_args(argv)
+
+    if args.record_market:
+        provider = CoinDeskProvider(record_path=args.record_market)
+        for i in range(args.samples):
+            if i:
+                time.sleep(PRICE_TTL)
+            try:
+                print(f"Recorded {len(provider.fetch())} coins ({i + 1}/{args.samples})")
+            except PartialFetch as e:
+                print(f"Recorded {len(e.fresh)} coins ({i + 1}/{args.samples}); {e}")
+        provider.close()
+        return
+
+    if args.bench_market:
+        benchmark_market(args.bench_market)
+        return
+
+    if args.backup:
+        store = open_user_store()
+        records = StoreBackup().snapshot(store)
+        store.close()
+        print(f"Backed up {records:,} users to {BACKUP_DIR}")
+        return
+
+    if args.check_store:
+        store = open_user_store()
+        backup = StoreBackup()
+        start = time.perf_counter()
+        problems = store.check_integrity(args.workers, processes=True)
+        print(f"Checked store in {time.perf_counter() - start:.2f}s: {len(problems)} problem(s)")
+        for user, kind, detail in problems:
+            print(f"  {user or '-'}: {kind}: {detail}")
+        records, size, seconds = backup.estimate()
+        when = f"~{seconds:.1f}s" if seconds is not None else "unknown (no snapshot yet)"
+        print(f"Backup: {records:,} users, {size / 1e6:.1f} MB to replay, recovery {when}")
+        if args.repair and problems:
+            for user, action in store.repair(problems, backup):
+                print(f"  {user or '-'}: {action}")
+        store.close()
+        return
+
+    if args.migrate_records:
+        store = open_user_store()
+        migrate_records(store, progress=lambda n: print(f"\rChecked {n:,} users", end="", flush=True))
+        store.close()
+        print()
+        return
+
+    if args.export or args.import_path:
+        store = open_user_store()
+        report = lambda n: print(f"\r{n:,} accounts", end="", flush=True)
+        if args.export:
+            export_users(store, args.export, args.resume, progress=report)
+        else:
+            import_users(store, args.import_path, args.resume, progress=report)
+        store.close()
+        print()
+        return
+
+    if args.bench_formats:
+        benchmark_record_formats(args.bench_formats)
+        return
+
+    if args.bench_load:
+        benchmark_bulk_load(args.bench_load, args.workers)
+        return
+
+    if args.migrate_sharded:
+        store = JsonUserStore(USER_DATA_DIR, sharded=True)
+        store.migrate_to_sharded(
+            progress=lambda done, total: print(f"\rMigrated {done}/{total} users", end=""))
+        store.close()
+        print()
+        return
+
     root = tk.Tk()
     app = CryptoSimApp(root)
     root.mainloop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,53 @@
+import os
+
+import pytest
+
+import main
+from main import ActivityLog
+
+
+@pytest.fixture(autouse=True)
+def small_segments(monkeypatch):
+    # 10 entries per segment, an index entry every 4: every path is hit with a short history
+    monkeypatch.setattr(main, "ACTIVITY_SEGMENT_SIZE", 10)
+    monkeypatch.setattr(main, "ACTIVITY_INDEX_STRIDE", 4)
+
+
+def entries(start, end):
+    return [{"desc": f"Deposited ${i}.00", "color": "green"} for i in range(start, end)]
+
+
+def test_pages_are_read_newest_first_across_segments(tmp_path):
+    log = ActivityLog(str(tmp_path / "alice.activity"))
+    log.extend(entries(0, 7))
+    log.extend(entries(7, 25))
+    assert sorted(os.listdir(log.directory))[-1] == "seg-00000002.log"
+    assert log.read(0, 25) == entries(0, 25)
+    assert log.read(8, 13) == entries(8, 13)
+    assert log.page(0, 6) == entries(19, 25)[::-1]
+    assert log.page(4, 6) == entries(0, 1)
+    assert log.page(5, 6) == []
+    assert ActivityLog(log.directory).count() == 25
+
+
+def test_a_torn_tail_is_cut_off(tmp_path):
+    log = ActivityLog(str(tmp_path / "alice.activity"))
+    log.extend(entries(0, 23))
+    with open(log._segment(2, ".log"), "ab") as f:
+        f.write(b"\x00\x00\x01")    # half of a frame header
+    reopened = ActivityLog(log.directory)
+    assert reopened.count() == 23
+    reopened.extend(entries(23, 25))
+    assert ActivityLog(log.directory).read(0, 25) == entries(0, 25)
+
+
+def test_a_lost_index_entry_is_rebuilt(tmp_path):
+    log = ActivityLog(str(tmp_path / "alice.activity"))
+    log.extend(entries(0, 19))
+    # entry 18 starts a stride; the crash lost its index entry but not the data
+    path = log._segment(1, ".idx")
+    with open(path, "r+b") as f:
+        f.truncate(os.path.getsize(path) - 8)
+    reopened = ActivityLog(log.directory)
+    assert reopened.count() == 19
+    assert reopened.read(16, 19) == entries(16, 19)
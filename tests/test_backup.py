@@ -0,0 +1,37 @@
+import main
+from main import JsonUserStore, SqliteUserStore, StoreBackup
+
+
+def record(username, balance=100.0):
+    return {"username": username, "password": "pw", "balance": balance,
+            "holdings": {"BTC": 0.5}, "activity": [], "schema": main.SCHEMA_VERSION}
+
+
+def test_backup_replays_writes_since_its_snapshot(tmp_path):
+    backup = StoreBackup(str(tmp_path / "backup"))
+    s = SqliteUserStore(str(tmp_path / "users.db"))
+    backup.write(s, {"alice": (record("alice"), []), "bob": (record("bob"), [])})
+    backup.snapshot(s)
+    backup.write(s, {"alice": (None, [{"type": "deposit", "cash": 5.0}])})
+    backup.log_delete(["bob"])
+    assert backup.recover() == {"alice": dict(record("alice"), balance=105.0)}
+
+    s.delete_users(["alice"])
+    assert s.repair([(None, "database", "damaged")], backup) == [
+        (None, "rebuilt indexes"), ("alice", "restored from backup")]
+    assert s.load("alice")["balance"] == 105.0
+    s.close()
+
+
+def test_a_damaged_json_record_is_found_and_restored(tmp_path):
+    backup = StoreBackup(str(tmp_path / "backup"))
+    s = JsonUserStore(str(tmp_path / "user_data"))
+    backup.write(s, {"alice": (record("alice"), []), "bob": (record("bob"), [])})
+    with open(s.path("alice"), "r+b") as f:
+        f.seek(5)
+        f.write(b"#")
+    problems = s.check_integrity()
+    assert [(user, kind) for user, kind, _ in problems] == [("alice", "snapshot")]
+    assert s.repair(problems, backup) == [("alice", "restored from backup")]
+    assert s.check_integrity() == []
+    assert s.load("alice")["balance"] == 100.0
@@ -0,0 +1,92 @@
+import os
+
+import main
+from main import JsonUserStore, UserJournal, shard_dir
+
+
+def record(username, balance=100.0, holdings=None, activity=None):
+    return {"username": username, "password": "pw", "balance": balance,
+            "holdings": holdings or {"BTC": 0.5}, "activity": activity or [],
+            "schema": main.SCHEMA_VERSION}
+
+
+DEPOSIT = {"type": "deposit", "cash": 50.0, "desc": "Deposited $50.00", "color": "green"}
+
+
+def test_group_commit_keeps_events_batched_with_a_record(tmp_path):
+    s = JsonUserStore(str(tmp_path / "user_data"), group_commit=True)
+    s.write_batch({"alice": (record("alice"), [DEPOSIT])})
+    assert s.load("alice")["balance"] == 150.0
+    s.close()
+    assert JsonUserStore(str(tmp_path / "user_data")).load("alice")["balance"] == 150.0
+
+
+def test_group_commit_recovers_a_lost_snapshot(tmp_path):
+    root = str(tmp_path / "user_data")
+    s = JsonUserStore(root, group_commit=True)
+    s.write_batch({"alice": (record("alice", balance=7.0), [])})
+    # the group log was fsynced; the snapshot written after it never reached the disk
+    os.remove(s.path("alice"))
+    recovered = JsonUserStore(root, group_commit=True)
+    assert recovered.load("alice")["balance"] == 7.0
+
+
+def test_group_log_without_commit_marker_is_discarded(tmp_path):
+    root = str(tmp_path / "user_data")
+    JsonUserStore(root, group_commit=True)
+    os.makedirs(os.path.join(root, "_commit"), exist_ok=True)
+    torn = UserJournal(os.path.join(root, "_commit", f"{1:020d}.group"))
+    torn.extend([{"username": "ghost", "record": dict(record("ghost"), _gseq=0), "events": []}])
+    s = JsonUserStore(root, group_commit=True)
+    assert not s.exists("ghost")
+    assert not os.listdir(os.path.join(root, "_commit"))
+
+
+def test_load_all_only_reparses_users_whose_files_changed(tmp_path, monkeypatch):
+    s = JsonUserStore(str(tmp_path / "user_data"), load_workers=1)
+    s.save(record("alice"))
+    s.save(record("bob"))
+    assert sorted(s.load_all()) == ["alice", "bob"]
+
+    parsed = []
+    load = s.load
+    monkeypatch.setattr(s, "load", lambda user: parsed.append(user) or load(user))
+    assert sorted(s.load_all()) == ["alice", "bob"]
+    assert parsed == []
+
+    s.append_events("alice", [DEPOSIT])
+    parsed.clear()    # seeding alice's activity log reads her once
+    everyone = s.load_all()
+    assert parsed == ["alice"]
+    assert everyone["alice"]["balance"] == 150.0
+
+    # callers get copies: changing one doesn't reach the cache
+    everyone["bob"]["holdings"]["BTC"] = 99.0
+    assert s.load_all()["bob"]["holdings"] == {"BTC": 0.5}
+
+    s.delete_users(["bob"]).join()
+    assert list(s.load_all()) == ["alice"]
+
+
+def test_flat_users_move_into_shards(tmp_path):
+    root = str(tmp_path / "user_data")
+    flat = JsonUserStore(root, sharded=False)
+    flat.save(record("alice"))
+    flat.append_events("alice", [DEPOSIT])
+    flat.save(record("bob"))
+    flat.close()
+
+    s = JsonUserStore(root, sharded=True)
+    assert s.needs_migration()
+    assert s.load("alice")["balance"] == 150.0    # readable before it moves
+    progress = []
+    s.migrate_to_sharded(lambda done, total: progress.append((done, total)))
+    assert progress == [(1, 2), (2, 2)]
+    assert not s.needs_migration()
+    assert not [fn for fn in os.listdir(root) if not fn.startswith(main.RESERVED_PREFIX)
+                and not os.path.isdir(os.path.join(root, fn))]
+    assert os.path.exists(os.path.join(shard_dir(root, "alice"), "alice.journal"))
+    assert s.load("alice")["balance"] == 150.0
+    assert s.activity_count("alice") == 1
+    assert sorted(s.usernames()) == ["alice", "bob"]
+    assert not JsonUserStore(root, sharded=True).needs_migration()
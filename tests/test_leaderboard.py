@@ -0,0 +1,94 @@
+import random
+import time
+
+import pytest
+
+import main
+from main import BalanceSnapshot, CryptoSimApp, JsonUserStore, LeaderboardIndex, QuoteBook
+
+
+def brute_force(portfolios, prices):
+    worth = {u: bal + sum(prices.get(s, 0.0) * a for s, a in h.items())
+             for u, (bal, h) in portfolios.items()}
+    return sorted(worth.items(), key=lambda item: (-item[1], item[0]))
+
+
+def test_ranking_matches_a_full_sort_through_updates():
+    rng = random.Random(7)
+    symbols = ["BTC", "ETH", "SOL", "DOGE"]
+    portfolios = {f"user{i}": (rng.uniform(0, 1000),
+                               {s: rng.uniform(0, 5) for s in rng.sample(symbols, 2)})
+                  for i in range(200)}
+    prices = {s: rng.uniform(1, 100) for s in symbols}
+    index = LeaderboardIndex(portfolios, prices)
+    assert index.top(200) == brute_force(portfolios, prices)
+
+    # one symbol moves (re-files its holders), then most of them (full re-sort)
+    prices["DOGE"] *= 3
+    index.set_prices(prices)
+    assert index.top(200) == brute_force(portfolios, prices)
+    prices = {s: p * rng.uniform(0.5, 2) for s, p in prices.items()}
+    index.set_prices(prices)
+    assert index.top(200) == brute_force(portfolios, prices)
+
+
+def test_events_update_and_remove():
+    index = LeaderboardIndex({"a": (10.0, {}), "b": (5.0, {"BTC": 1.0})}, {"BTC": 2.0})
+    assert index.top(2) == [("a", 10.0), ("b", 7.0)]
+    index.apply_event("b", {"type": "trade", "cash": -2.0, "symbol": "BTC", "qty": 4.0,
+                            "desc": "Bought BTC", "color": "red"})
+    assert index.top(1) == [("b", 13.0)]
+    assert index.rank("a") == 2
+    index.remove("b")
+    assert index.rank("b") is None and len(index) == 1
+    index.update("c", 1.0, {})
+    assert index.top(5) == [("a", 10.0), ("c", 1.0)]
+
+
+
+def test_balance_snapshot_feeds_the_index(tmp_path):
+    portfolios = {"alice": (1.0, {"BTC": 2.0}), "bob": (50.0, {"AVERYLONGTOKENSYMBOL": 1.0})}
+    snapshot = BalanceSnapshot(str(tmp_path / "balances.snap"))
+    snapshot.build(portfolios)
+    quotes = QuoteBook([{"SYMBOL": "BTC", "PRICE_USD": 30.0},
+                        {"SYMBOL": "AVERYLONGTOKENSYMBOL", "PRICE_USD": 0.5}])
+    read, worth = snapshot.read(quotes)
+    assert read == portfolios
+    index = LeaderboardIndex(read, quotes.prices, worth)
+    assert index.top(2) == [("alice", 61.0), ("bob", 50.5)]
+
+
+class FixedPrices:
+    def __init__(self, quotes):
+        self.quotes = quotes
+
+    def get(self):
+        return self.quotes
+
+
+@pytest.fixture
+def app(tmp_path):
+    """An App with just what get_leaderboard needs: a JSON store whose cache lives inside it."""
+    app = CryptoSimApp.__new__(CryptoSimApp)
+    app.store = JsonUserStore(str(tmp_path / "user_data"))
+    app.balance_snapshot = BalanceSnapshot(str(tmp_path / "user_data" / "_cache" / "balances.snap"))
+    app.prices = FixedPrices(QuoteBook([{"SYMBOL": "BTC", "PRICE_USD": 100.0}]))
+    app.leaderboard = None
+    for name, balance in (("alice", 50.0), ("bob", 500.0)):
+        app.store.save({"username": name, "password": "pw", "balance": balance,
+                        "holdings": {"BTC": 1.0}, "activity": [], "schema": main.SCHEMA_VERSION})
+    yield app
+    app.store.close()
+
+
+def test_leaderboard_comes_from_a_current_snapshot(app, monkeypatch):
+    app.balance_snapshot.build(app.store.load_portfolios(), built_at=time.time())
+    monkeypatch.setattr(app.store, "load_portfolios", lambda: pytest.fail("read the store"))
+    assert app.get_leaderboard().top(2) == [("bob", 600.0), ("alice", 150.0)]
+
+
+def test_leaderboard_skips_a_snapshot_older_than_a_delete(app):
+    app.balance_snapshot.build(app.store.load_portfolios(), built_at=time.time())
+    time.sleep(0.01)
+    app.store.delete_users(["bob"]).join()
+    assert app.get_leaderboard().top(2) == [("alice", 150.0)]
@@ -0,0 +1,168 @@
+import json
+
+import pytest
+
+import main
+from main import (CoinDeskProvider, PartialFetch, PriceCache, QuoteBook, RateLimiter, ReplayProvider,
+                  load_asset_universe)
+
+
+class FakeClient:
+    """Answers metadata requests from a price table; requests naming a symbol in fail raise."""
+
+    def __init__(self, prices, fail=()):
+        self.prices = prices
+        self.fail = set(fail)
+        self.requests = []
+
+    def get_json(self, url, params=None):
+        symbols = params["assets"].split(",")
+        self.requests.append(symbols)
+        if self.fail & set(symbols):
+            raise ConnectionError("chunk failed")
+        return {"Data": {s: {"SYMBOL": s, "PRICE_USD": self.prices[s]}
+                         for s in symbols if s in self.prices}}
+
+    def close(self):
+        pass
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 100.0
+        self.slept = 0.0
+
+    def monotonic(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.now += seconds
+        self.slept += seconds
+
+
+def test_asset_universe_from_list_dedups_and_uppercases():
+    assert load_asset_universe("btc, ETH,,btc , sol") == ["BTC", "ETH", "SOL"]
+
+
+def test_asset_universe_from_file_skips_blank_lines(tmp_path):
+    path = tmp_path / "assets.txt"
+    path.write_text("BTC\n\n eth \nBTC\nsol\n\n", encoding="utf-8")
+    assert load_asset_universe(str(path)) == ["BTC", "ETH", "SOL"]
+
+
+def test_rate_limiter_allows_a_burst_then_paces(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(main.time, "monotonic", clock.monotonic)
+    monkeypatch.setattr(main.time, "sleep", clock.sleep)
+    limiter = RateLimiter(rate=4, burst=2)
+    for _ in range(2):
+        limiter.acquire()
+    assert clock.slept == 0
+    for _ in range(4):
+        limiter.acquire()
+    assert clock.slept == pytest.approx(1.0)
+
+
+def test_rate_limiter_without_a_rate_never_waits(monkeypatch):
+    monkeypatch.setattr(main.time, "sleep", lambda s: pytest.fail("slept"))
+    limiter = RateLimiter(rate=0)
+    for _ in range(100):
+        limiter.acquire()
+
+
+@pytest.mark.parametrize("workers", [1, 4])
+def test_chunks_merge_in_universe_order(workers):
+    assets = [f"C{i}" for i in range(10)]
+    client = FakeClient({s: float(i) for i, s in enumerate(assets)})
+    provider = CoinDeskProvider(client=client, assets=assets, chunk=3, workers=workers, rate=0)
+    coins = provider.fetch()
+    provider.close()
+    assert [c["SYMBOL"] for c in coins] == assets
+    assert sorted(map(len, client.requests)) == [1, 3, 3, 3]
+
+
+def test_failed_chunk_raises_partial_fetch_with_the_rest():
+    assets = ["A", "B", "C", "D"]
+    client = FakeClient({s: 1.0 for s in assets}, fail={"C"})
+    provider = CoinDeskProvider(client=client, assets=assets, chunk=2, workers=1, rate=0)
+    with pytest.raises(PartialFetch) as info:
+        provider.fetch()
+    assert set(info.value.fresh) == {"A", "B"}
+    assert isinstance(info.value.error, ConnectionError)
+
+
+def test_every_chunk_failing_raises_the_error():
+    client = FakeClient({}, fail={"A", "B"})
+    provider = CoinDeskProvider(client=client, assets=["A", "B"], chunk=1, workers=1, rate=0)
+    with pytest.raises(ConnectionError):
+        provider.fetch()
+
+
+def test_partial_fetch_keeps_saved_quotes_and_reports_the_error(tmp_path):
+    path = tmp_path / "market.json"
+    saved = PriceCache(lambda: [{"SYMBOL": "A", "PRICE_USD": 5.0}, {"SYMBOL": "B", "PRICE_USD": 5.0}],
+                       path=str(path))
+    saved.refresh()
+    saved_at = saved.age()
+
+    client = FakeClient({"A": 1.0, "B": 2.0}, fail={"A"})
+    provider = CoinDeskProvider(client=client, assets=["A", "B"], chunk=1, workers=1, rate=0)
+    cache = PriceCache(provider.fetch, path=str(path))
+    assert cache.refresh()
+    assert cache.get().prices == {"A": 5.0, "B": 2.0}
+    assert isinstance(cache.last_error, PartialFetch)
+    assert cache.status()
+    # only complete fetches are saved, so a restart can't pass the merge off as fresh
+    restarted = PriceCache(provider.fetch, path=str(path))
+    assert restarted.get().prices == {"A": 5.0, "B": 5.0}
+    assert restarted.age() >= saved_at
+
+    client.fail.clear()
+    cache.refresh()
+    assert cache.get().prices == {"A": 1.0, "B": 2.0}
+    assert cache.last_error is None and cache.status() == ""
+    assert PriceCache(provider.fetch, path=str(path)).get().prices == {"A": 1.0, "B": 2.0}
+
+
+def test_partial_fetch_merge_prefers_fresh_quotes():
+    previous = QuoteBook([{"SYMBOL": "A", "PRICE_USD": 1.0}, {"SYMBOL": "C", "PRICE_USD": 3.0}])
+    partial = PartialFetch(["A", "B", "C"], {"A": {"SYMBOL": "A", "PRICE_USD": 9.0}}, ValueError())
+    assert [(c["SYMBOL"], c["PRICE_USD"]) for c in partial.merge(previous)] == [("A", 9.0), ("C", 3.0)]
+
+
+def response(price):
+    return {"Data": {"BTC": {"SYMBOL": "BTC", "PRICE_USD": price}}}
+
+
+def test_replay_serves_ndjson_recordings_in_order_and_loops(tmp_path):
+    path = tmp_path / "market.ndjson"
+    path.write_text("".join(json.dumps(response(p)) + "\n" for p in (1.0, 2.0, 3.0)) + "\n")
+    provider = ReplayProvider(str(path), rate=0, latency=0)
+    assert [provider.fetch()[0]["PRICE_USD"] for _ in range(5)] == [1.0, 2.0, 3.0, 1.0, 2.0]
+    assert provider.stream_interval <= main.REPLAY_STREAM_INTERVAL
+
+
+def test_replay_of_a_single_json_response_repeats_it(tmp_path):
+    path = tmp_path / "market.json"
+    path.write_text(json.dumps(response(5.0), indent=2))
+    provider = ReplayProvider(str(path), rate=0, latency=0)
+    assert provider.fetch() == provider.fetch() == [{"SYMBOL": "BTC", "PRICE_USD": 5.0}]
+
+
+def test_replay_rate_follows_wall_time(tmp_path, monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(main.time, "monotonic", clock.monotonic)
+    path = tmp_path / "market.ndjson"
+    path.write_text("\n".join(json.dumps(response(p)) for p in (1.0, 2.0, 3.0)))
+    provider = ReplayProvider(str(path), rate=2, latency=0)
+    assert provider.fetch()[0]["PRICE_USD"] == 1.0
+    assert provider.fetch()[0]["PRICE_USD"] == 1.0    # no time has passed
+    clock.now += 1.0
+    assert provider.fetch()[0]["PRICE_USD"] == 3.0    # two recordings per second
+
+
+def test_replay_without_recordings_is_an_error(tmp_path):
+    path = tmp_path / "empty.ndjson"
+    path.write_text("\n\n")
+    with pytest.raises(ValueError):
+        ReplayProvider(str(path), rate=0, latency=0)
@@ -0,0 +1,74 @@
+import pytest
+import requests
+
+import main
+from main import MarketDataClient
+
+
+class FakeResponse:
+    def __init__(self, status, body=None):
+        self.status_code = status
+        self.body = body
+
+    def raise_for_status(self):
+        if self.status_code >= 400:
+            raise requests.HTTPError(f"HTTP {self.status_code}", response=self)
+
+    def json(self):
+        return self.body
+
+
+class FakeSession:
+    """Plays back `outcomes` (FakeResponses, or exceptions to raise), one per request."""
+
+    def __init__(self, outcomes):
+        self.outcomes = list(outcomes)
+        self.calls = []
+
+    def get(self, url, params=None, timeout=None):
+        self.calls.append(timeout)
+        outcome = self.outcomes.pop(0) if len(self.outcomes) > 1 else self.outcomes[0]
+        if isinstance(outcome, Exception):
+            raise outcome
+        return outcome
+
+
+def client_with(outcomes, **kwargs):
+    client = MarketDataClient(**kwargs)
+    client.session = FakeSession(outcomes)
+    return client
+
+
+def test_retryable_errors_are_retried_until_one_succeeds():
+    client = client_with([FakeResponse(503), requests.ConnectionError("reset"),
+                          FakeResponse(200, {"Data": {}})], backoff=0)
+    assert client.get_json("https://example.invalid") == {"Data": {}}
+    assert client.session.calls == [main.MARKET_TIMEOUT] * 3
+    stats = client.stats()
+    assert (stats["requests"], stats["failures"], stats["retries"]) == (1, 0, 2)
+
+
+def test_client_errors_are_not_retried():
+    client = client_with([FakeResponse(404)], backoff=0)
+    with pytest.raises(requests.HTTPError):
+        client.get_json("https://example.invalid")
+    assert len(client.session.calls) == 1
+    assert client.stats()["failures"] == 1
+
+
+def test_attempts_are_capped():
+    client = client_with([requests.Timeout("slow")], attempts=3, backoff=0)
+    with pytest.raises(requests.Timeout):
+        client.get_json("https://example.invalid")
+    assert len(client.session.calls) == 3
+
+
+def test_retries_stop_when_the_next_backoff_would_overrun_the_budget(monkeypatch):
+    monkeypatch.setattr(main.random, "uniform", lambda low, high: high)
+    # backoffs of 0.05s then 0.1s: the second would end past the 0.12s budget
+    client = client_with([requests.ConnectionError("down")], attempts=10, backoff=0.05,
+                         budget=0.12)
+    with pytest.raises(requests.ConnectionError):
+        client.get_json("https://example.invalid")
+    assert len(client.session.calls) == 2
+    assert client.stats()["retries"] == 1
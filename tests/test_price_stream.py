@@ -0,0 +1,114 @@
+import threading
+
+from main import CryptoSimApp, PriceCache, change_format
+
+
+class FakeRoot:
+    def after(self, ms, callback):
+        pass
+
+
+class FakeLabel:
+    def __init__(self):
+        self.options = {}
+
+    def config(self, **options):
+        self.options.update(options)
+
+    def winfo_exists(self):
+        return True
+
+
+class Feed:
+    """A fetch function serving whatever `coins` currently is."""
+
+    def __init__(self, price):
+        self.set(price)
+
+    def set(self, price):
+        self.coins = [{"SYMBOL": "BTC", "NAME": "Bitcoin", "PRICE_USD": price}]
+
+    def __call__(self):
+        return self.coins
+
+
+def make_app(prices, cached=True):
+    app = CryptoSimApp.__new__(CryptoSimApp)
+    app.root = FakeRoot()
+    app.prices = prices
+    app.prices_seen = -1
+    app.price_deltas = {}
+    app._deltas_lock = threading.Lock()
+    app.price_labels = {}
+    app.leaderboard = None
+    app.current_tab = None
+    app.tab_awaits_prices = False
+    app.displayed_coins = []
+    if cached:
+        app.cached_coins_data = []
+    prices.subscribe(app.queue_price_deltas)
+    return app
+
+
+def bound_label(app):
+    label = FakeLabel()
+    app.bind_price(label, "BTC", lambda c: {"text": f"${float(c.get('PRICE_USD') or 0):,.2f}"})
+    return label
+
+
+def test_refresh_updates_bound_label():
+    feed = Feed(100.0)
+    prices = PriceCache(feed, path=None)
+    app = make_app(prices)
+    prices.refresh()
+    app.watch_prices()
+    label = bound_label(app)
+
+    feed.set(101.5)
+    prices.refresh()
+    app.watch_prices()
+    assert label.options["text"] == "$101.50"
+
+
+def test_refresh_landing_between_drain_and_snapshot_is_not_lost(monkeypatch):
+    feed = Feed(100.0)
+    prices = PriceCache(feed, path=None)
+    app = make_app(prices)
+    prices.refresh()
+    app.watch_prices()
+    label = bound_label(app)
+
+    # the refresher thread wins the race right after watch_prices drained the deltas
+    feed.set(250.0)
+    snapshot = prices.snapshot
+    monkeypatch.setattr(prices, "snapshot", lambda: (prices.refresh(), snapshot())[1])
+    app.watch_prices()
+    monkeypatch.setattr(prices, "snapshot", snapshot)
+    app.watch_prices()
+    assert label.options["text"] == "$250.00"
+
+
+def test_deltas_apply_before_coin_data_is_cached():
+    feed = Feed(100.0)
+    prices = PriceCache(feed, path=None)
+    app = make_app(prices, cached=False)
+    label = bound_label(app)
+    prices.refresh()
+    app.watch_prices()
+    assert label.options["text"] == "$100.00"
+
+
+def test_subscribers_run_under_the_cache_lock():
+    feed = Feed(1.0)
+    prices = PriceCache(feed, path=None)
+    seen = []
+    prices.subscribe(lambda changes: seen.append((prices._lock.locked(), dict(changes))))
+    prices.refresh()
+    feed.set(1.0)
+    prices.refresh()   # nothing changed: no callback
+    assert seen == [(True, {"BTC": feed.coins[0]})]
+
+
+def test_change_format_handles_missing_values():
+    assert change_format({"SPOT_MOVING_24_HOUR_CHANGE_PERCENTAGE_USD": None}) == {"text": "0.00%", "fg": "green"}
+    assert change_format({"SPOT_MOVING_24_HOUR_CHANGE_PERCENTAGE_USD": -1.5}, "{:+.2f}%") == {"text": "-1.50%", "fg": "red"}
@@ -0,0 +1,22 @@
+from main import QuoteBook
+
+
+def coin(symbol, price, change=0.0):
+    return {"SYMBOL": symbol, "PRICE_USD": price, "SPOT_MOVING_24_HOUR_CHANGE_PERCENTAGE_USD": change}
+
+
+def test_lookups():
+    book = QuoteBook([coin("BTC", 100.0), coin("ETH", None)])
+    assert book.price("BTC") == 100.0
+    assert book.price("ETH") == 0.0 and book.price("XRP") == 0.0
+    assert book.quote("XRP") == {}
+    assert book.vector(["ETH", "BTC"]) == [0.0, 100.0]
+    assert "BTC" in book and len(book) == 2
+
+
+def test_changes_since_reports_only_what_moved():
+    old = QuoteBook([coin("BTC", 100.0), coin("ETH", 10.0, 1.0), coin("SOL", 5.0)])
+    new = QuoteBook([coin("BTC", 100.0), coin("ETH", 10.0, 2.0), coin("DOGE", 0.1)])
+    assert new.changes_since(old) == {"ETH": coin("ETH", 10.0, 2.0), "DOGE": coin("DOGE", 0.1)}
+    assert new.changes_since(new) == {}
+    assert new.changes_since(QuoteBook()) == new.by_symbol
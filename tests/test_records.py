@@ -0,0 +1,37 @@
+import json
+
+import pytest
+
+import main
+from main import decode_user_record, encode_user_record, parse_user_snapshot, record_checksum
+
+
+def record(username, balance=100.0, holdings=None, activity=None):
+    return {"username": username, "password": "pw", "balance": balance,
+            "holdings": holdings or {"BTC": 0.5}, "activity": activity or [],
+            "schema": main.SCHEMA_VERSION}
+
+
+def test_binary_record_round_trip():
+    rec = record("ünïcode", holdings={"BTC": 1.25, "ETH": 3.0},
+                 activity=[{"desc": "Bought BTC", "color": "green"}])
+    assert decode_user_record(encode_user_record(rec)) == rec
+
+
+def test_binary_record_rejects_truncation():
+    with pytest.raises(ValueError):
+        decode_user_record(encode_user_record(record("alice"))[:-3])
+
+
+def test_binary_record_crc_catches_a_flipped_byte():
+    data = bytearray(encode_user_record(record("alice")))
+    data[20] ^= 0x01    # inside the balance, so the record still parses
+    with pytest.raises(ValueError, match="checksum"):
+        decode_user_record(bytes(data))
+
+
+def test_json_snapshot_checksum_is_verified():
+    rec = record("alice")
+    data = json.dumps(dict(rec, _crc=record_checksum(rec))).replace("100.0", "900.0").encode()
+    with pytest.raises(ValueError, match="checksum"):
+        parse_user_snapshot(data)
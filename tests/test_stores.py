@@ -0,0 +1,191 @@
+import json
+import os
+import time
+
+import pytest
+
+import main
+from main import (JsonUserStore, SqliteUserStore, export_users, import_users, migrate_records,
+                  open_user_store, upgrade_record)
+
+
+def record(username, balance=100.0, holdings=None, activity=None):
+    return {"username": username, "password": "pw", "balance": balance,
+            "holdings": holdings or {"BTC": 0.5}, "activity": activity or [],
+            "schema": main.SCHEMA_VERSION}
+
+
+DEPOSIT = {"type": "deposit", "cash": 50.0, "desc": "Deposited $50.00", "color": "green"}
+
+
+@pytest.fixture(params=["json", "binary", "sqlite"])
+def store(request, tmp_path):
+    if request.param == "sqlite":
+        s = SqliteUserStore(str(tmp_path / "users.db"))
+    else:
+        s = JsonUserStore(str(tmp_path / "user_data"), binary=request.param == "binary")
+    yield s
+    s.close()
+
+
+def test_sqlite_store_imports_legacy_json_files_once(tmp_path, monkeypatch):
+    root = tmp_path / "user_data"
+    root.mkdir()
+    (root / "alice.json").write_text(json.dumps(record("alice", balance=42.0)))
+    monkeypatch.setattr(main, "USER_DATA_DIR", str(root))
+    monkeypatch.setattr(main, "USER_DB_PATH", str(root / "cryptosim.db"))
+    monkeypatch.setattr(main, "BACKGROUND_RECORD_MIGRATION", False)
+    store = open_user_store("sqlite")
+    assert store.load("alice")["balance"] == 42.0
+    store.delete_users(["alice"])
+    store.close()
+    # the legacy file is left alone and isn't imported a second time
+    assert (root / "alice.json").exists()
+    store = open_user_store("sqlite")
+    assert store.usernames() == []
+    store.close()
+
+
+def test_events_apply_on_top_of_the_snapshot(store):
+    store.save(record("alice"))
+    store.append_events("alice", [{"type": "trade", "cash": -50.0, "symbol": "ETH", "qty": 2.0,
+                                   "desc": "Bought ETH", "color": "red"}])
+    loaded = store.load("alice")
+    assert loaded["balance"] == 50.0
+    assert loaded["holdings"] == {"BTC": 0.5, "ETH": 2.0}
+    assert loaded["activity"][0]["desc"] == "Bought ETH"
+
+
+def test_account_load_leaves_out_activity(store):
+    store.save(record("alice", activity=[{"desc": "Deposited $5.00", "color": "green"}]))
+    account = store.load_account("alice")
+    assert account["balance"] == 100.0 and "activity" not in account
+    assert store.activity_page("alice", 0) == [{"desc": "Deposited $5.00", "color": "green"}]
+
+
+def test_deleted_users_are_gone_everywhere(store):
+    store.save(record("alice"))
+    store.save(record("bob"))
+    purge = store.delete_users(["alice"])
+    if purge is not None:
+        purge.join()
+    assert sorted(store.usernames()) == ["bob"]
+    assert store.inactive_users(-1) == ["bob"]
+    store.save(record("alice", activity=[]))
+    assert store.activity_count("alice") == 0
+
+
+def test_clear_empties_the_store_at_once_and_purges_in_the_background(store):
+    for i in range(5):
+        store.save(record(f"user{i}", activity=[{"desc": "Deposited $5.00", "color": "green"}]))
+    purge = store.clear()
+    assert store.usernames() == [] and store.load_all() == {}
+    purge.join(5)
+    assert purge.done()
+    removed, total = purge.progress()
+    assert total and removed == total
+    store.save(record("user0"))
+    assert store.usernames() == ["user0"]
+    assert store.activity_count("user0") == 0
+
+
+def test_a_purge_interrupted_by_a_crash_is_finished_on_open(tmp_path):
+    root = tmp_path / "user_data"
+    s = JsonUserStore(str(root))
+    s.save(record("alice"))
+    # crashed right after the rename: the tombstone is all that's left
+    tomb = tmp_path / f"user_data{main.TOMBSTONE_MARK}1"
+    os.replace(root, tomb)
+    JsonUserStore(str(root))
+    deadline = time.monotonic() + 5
+    while tomb.exists() and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert not tomb.exists()
+
+
+def test_events_for_a_cleared_user_are_dropped(store):
+    store.save(record("alice"))
+    store.clear().join()
+    store.write_batch({"alice": (None, [DEPOSIT])})
+    store.append_events("alice", [DEPOSIT])
+    assert store.load("alice") is None
+    assert store.usernames() == []
+    assert store.activity_count("alice") == 0
+    # registering the name again starts from a clean slate
+    store.save(record("alice"))
+    assert store.load("alice")["balance"] == 100.0
+    assert store.activity_count("alice") == 0
+
+
+def test_ndjson_export_import_round_trip(store, tmp_path):
+    history = [{"desc": f"Deposited ${i}.00", "color": "green"} for i in range(12, 0, -1)]
+    store.save(record("alice", activity=history))
+    store.save(record("bob", balance=3.0))
+    path = str(tmp_path / "users.ndjson")
+    assert export_users(store, path) == 2
+
+    target = SqliteUserStore(str(tmp_path / "imported.db"))
+    assert import_users(target, path) == 2
+    assert target.load("bob")["balance"] == 3.0
+    assert target.activity_count("alice") == len(history)
+    assert target.activity_page("alice", 0, 3) == history[:3]
+    assert not os.path.exists(path + ".progress")
+    target.close()
+
+
+def test_v1_records_are_upgraded():
+    old = {"username": "alice", "balance": "12.5", "holdings": {"BTC": "1"},
+           "activity": [{"desc": "hi"}, "junk"]}
+    assert upgrade_record(old)
+    assert old == {"username": "alice", "password": "", "balance": 12.5, "holdings": {"BTC": 1.0},
+                   "activity": [{"desc": "hi", "color": "black"}], "schema": main.SCHEMA_VERSION}
+    assert not upgrade_record(old)
+
+
+def test_loading_writes_an_upgraded_record_back(store):
+    store.save(dict(record("alice"), schema=1))
+    store.save(dict(record("bob"), schema=1))
+    assert store.load("alice")["schema"] == main.SCHEMA_VERSION
+    assert store.load_account("bob")["schema"] == main.SCHEMA_VERSION
+    assert migrate_records(store) == 2
+    if isinstance(store, SqliteUserStore):
+        stored = store._read_record(store._conn(), "alice")
+    else:
+        stored = main.read_user_snapshot(store.path("alice"))
+    assert stored["schema"] == main.SCHEMA_VERSION
+
+
+def test_upgrade_write_back_keeps_a_concurrent_deposit(tmp_path):
+    path = str(tmp_path / "users.db")
+    other = SqliteUserStore(path)   # stands in for the background writer's connection
+    other.save(dict(record("alice"), schema=1))
+
+    class RacingStore(SqliteUserStore):
+        """Commits a deposit through `other` right after load() first reads alice."""
+        raced = False
+
+        def _read_record(self, conn, username):
+            found = super()._read_record(conn, username)
+            if not self.raced:
+                self.raced = True
+                other.append_events(username, [DEPOSIT])
+            return found
+
+    store = RacingStore(path)
+    assert store.load("alice")["balance"] == 150.0
+    assert other.load("alice")["balance"] == 150.0
+    assert other.load("alice")["schema"] == main.SCHEMA_VERSION
+    store.close()
+    other.close()
+
+
+def test_reserved_names_are_not_accounts(tmp_path):
+    root = tmp_path / "user_data"
+    s = JsonUserStore(str(root))
+    s.save(record("alice"))
+    (root / "_cache").mkdir()
+    (root / "_cache" / "market.json").write_text('{"fetched_at": 1, "coins": []}')
+    (root / "_stray.json").write_text("{}")
+    assert s.usernames() == ["alice"]
+    assert list(s.load_all()) == ["alice"]
+    assert s.check_integrity() == []
@@ -0,0 +1,80 @@
+import os
+import threading
+import time
+
+import pytest
+
+import main
+from main import BloomFilter, SqliteUserStore, UsernameIndex
+
+
+def test_bloom_filter_has_no_false_negatives_and_few_false_positives():
+    bloom = BloomFilter(capacity=1000, fp_rate=0.01)
+    for i in range(1000):
+        bloom.add(f"user{i}")
+    assert all(f"user{i}" in bloom for i in range(1000))
+    false_positives = sum(f"other{i}" in bloom for i in range(10000))
+    assert false_positives < 300    # 1% expected
+
+
+def test_bloom_filter_round_trips_through_bytes():
+    bloom = BloomFilter(capacity=10)
+    bloom.add("alice")
+    loaded = BloomFilter.from_bytes(bloom.to_bytes())
+    assert "alice" in loaded and loaded.count == 1 and loaded.bits == bloom.bits
+    with pytest.raises(ValueError):
+        BloomFilter.from_bytes(b"CSBF")
+    with pytest.raises(ValueError):
+        BloomFilter.from_bytes(bloom.to_bytes()[:-1])
+
+
+class GatedStore:
+    """Counts exists() lookups; usernames() waits for `gate`, holding the rebuild back."""
+
+    def __init__(self, store):
+        self.store = store
+        self.gate = threading.Event()
+        self.lookups = []
+
+    def usernames(self):
+        self.gate.wait(5)
+        return self.store.usernames()
+
+    def exists(self, username):
+        self.lookups.append(username)
+        return self.store.exists(username)
+
+
+def wait_for_rebuild(index):
+    """Waits until the background rebuild has finished and saved its filter."""
+    deadline = time.monotonic() + 5
+    while not (index._names is not None and index._on_disk) and time.monotonic() < deadline:
+        time.sleep(0.01)
+
+
+def test_saved_filter_answers_until_the_rebuild_is_done(tmp_path):
+    store = SqliteUserStore(str(tmp_path / "users.db"))
+    store.save({"username": "alice", "password": "pw", "balance": 1.0, "holdings": {},
+                "activity": [], "schema": main.SCHEMA_VERSION})
+    path = str(tmp_path / "_cache" / "usernames.bloom")
+    wait_for_rebuild(UsernameIndex(store, path))
+    assert os.path.exists(path)
+
+    gated = GatedStore(store)
+    index = UsernameIndex(gated, path)
+    assert "zed" not in index
+    assert "alice" in index
+    assert gated.lookups == ["alice"]    # only the possible match went to the store
+
+    index.add("carol")
+    assert not os.path.exists(path)      # the saved filter no longer covers every name
+    assert "carol" in index
+
+    gated.gate.set()
+    wait_for_rebuild(index)
+    assert "carol" in index and "alice" in index and "zed" not in index
+    assert gated.lookups == ["alice"]
+    assert os.path.exists(path)
+    index.discard(["alice"])
+    assert "alice" not in index
+    store.close()
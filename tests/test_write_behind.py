@@ -0,0 +1,84 @@
+import time
+
+import pytest
+
+import main
+from main import SqliteUserStore, WriteBehindStore
+
+
+def record(username, balance=100.0):
+    return {"username": username, "password": "pw", "balance": balance,
+            "holdings": {"BTC": 0.5}, "activity": [], "schema": main.SCHEMA_VERSION}
+
+
+class FailingStore(SqliteUserStore):
+    """SqliteUserStore whose next `failures` batch writes raise (all of them if None)."""
+
+    def __init__(self, path, failures=None):
+        super().__init__(path)
+        self.failures = failures
+        self.attempts = 0
+
+    def write_batch(self, batch):
+        self.attempts += 1
+        if self.failures is None or self.failures > 0:
+            if self.failures:
+                self.failures -= 1
+            raise OSError("disk full")
+        super().write_batch(batch)
+
+
+@pytest.fixture(autouse=True)
+def fast_retries(monkeypatch):
+    monkeypatch.setattr(main, "WRITE_RETRY_DELAY", 0.01)
+
+
+def test_queued_writes_coalesce_and_flush(tmp_path):
+    store = WriteBehindStore(SqliteUserStore(str(tmp_path / "users.db")), window=0.05)
+    store.save(record("alice"))
+    store.save(record("alice", balance=150.0))
+    assert store.load("alice")["balance"] == 150.0
+    store.close()
+
+
+def test_failed_write_is_retried_before_flush_returns(tmp_path):
+    backing = FailingStore(str(tmp_path / "users.db"), failures=2)
+    store = WriteBehindStore(backing, window=0)
+    store.save(record("bob"))
+    store.append_event("bob", {"type": "deposit", "cash": 50.0, "desc": "Deposited $50.00",
+                               "color": "green"})
+    assert store.load("bob")["balance"] == 150.0
+    assert backing.attempts == 3
+    store.close()
+
+
+def test_flush_raises_once_writes_keep_failing(tmp_path):
+    store = WriteBehindStore(FailingStore(str(tmp_path / "users.db")), window=0)
+    store.save(record("bob"))
+    with pytest.raises(OSError, match="disk full"):
+        store.flush()
+    with pytest.raises(OSError, match="1 user"):
+        store.close()
+
+
+def test_close_gives_up_after_bounded_retries(tmp_path):
+    backing = FailingStore(str(tmp_path / "users.db"))
+    store = WriteBehindStore(backing, window=10)
+    store.save(record("bob"))
+    started = time.monotonic()
+    with pytest.raises(OSError, match="could not be saved"):
+        store.close()
+    assert time.monotonic() - started < 2
+    assert backing.attempts == main.WRITE_RETRY_LIMIT
+
+
+def test_clear_drops_a_failing_batch(tmp_path):
+    backing = FailingStore(str(tmp_path / "users.db"))
+    store = WriteBehindStore(backing, window=0)
+    store.save(record("bob"))
+    with pytest.raises(OSError):
+        store.flush()
+    backing.failures = 0
+    store.clear().join()
+    assert store.load("bob") is None
+    store.close()